@@ -2,6 +2,8 @@
 ASGI config for alx_backend_graphql project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; websocket connections to the GraphQL
+subscriptions endpoint (see ``.subscriptions``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready: it pulls in the schema and models.
+from .subscriptions import GraphQLSubscriptionApp  # noqa: E402
+
+subscription_application = GraphQLSubscriptionApp()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await subscription_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,183 @@
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    InlineFragmentNode,
+    get_named_type,
+    is_composite_type,
+    is_list_type,
+    is_non_null_type,
+    value_from_ast_untyped,
+)
+
+# Relay plumbing between a connection and its nodes; it adds neither
+# depth nor cost of its own.
+CONNECTION_WRAPPERS = {'edges', 'node', 'pageInfo'}
+
+
+def get_cost_limits():
+    limits = {
+        'MAX_DEPTH': 7,
+        'MAX_COST': 5000,
+        'MAX_PAGE_SIZE': graphene_settings.RELAY_CONNECTION_MAX_LIMIT,
+        'DEFAULT_PAGE_SIZE': graphene_settings.RELAY_CONNECTION_MAX_LIMIT,
+        'DEFAULT_FANOUT': 10,
+    }
+    limits.update(getattr(settings, 'GRAPHQL_COST', None) or {})
+    return limits
+
+
+@dataclass
+class CostAnalysis:
+    cost: int = 0
+    depth: int = 0
+    limits: dict = field(default_factory=dict)
+    errors: list = field(default_factory=list)
+
+    def as_extension(self):
+        return {
+            'requested': self.cost,
+            'maximum': self.limits.get('MAX_COST'),
+            'depth': self.depth,
+            'maxDepth': self.limits.get('MAX_DEPTH'),
+        }
+
+
+def _is_connection(graphql_type):
+    named = get_named_type(graphql_type)
+    return hasattr(named, 'fields') and 'edges' in named.fields and 'pageInfo' in named.fields
+
+
+def _unwrap(graphql_type):
+    while is_non_null_type(graphql_type):
+        graphql_type = graphql_type.of_type
+    return graphql_type
+
+
+class CostAnalyzer:
+    """
+    Static cost estimate of an operation, computed before execution.
+
+    Every object a field resolves costs one unit, multiplied by how many
+    times its parent is expected to be resolved. Connections multiply
+    their children by the requested ``first``/``last`` (or
+    ``DEFAULT_PAGE_SIZE`` at the top level and ``DEFAULT_FANOUT`` when
+    nested, which is the typical M2M fan-out); plain lists multiply by
+    ``DEFAULT_FANOUT``.
+    """
+
+    def __init__(self, schema, document, variables=None, limits=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.limits = limits or get_cost_limits()
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self.analysis = CostAnalysis(limits=self.limits)
+
+    def analyze(self, operation):
+        root = self.schema.get_root_type(operation.operation)
+        if root is not None:
+            self._visit(operation.selection_set, root, multiplier=1, depth=0, nested=False)
+        self._check()
+        return self.analysis
+
+    def _argument(self, node, name):
+        for argument in node.arguments or ():
+            if argument.name.value == name:
+                return value_from_ast_untyped(argument.value, self.variables)
+        return None
+
+    def _page_size(self, node, nested):
+        sizes = [self._argument(node, name) for name in ('first', 'last')]
+        sizes = [size for size in sizes if isinstance(size, int)]
+        for size in sizes:
+            if size > self.limits['MAX_PAGE_SIZE']:
+                self.analysis.errors.append(
+                    f"Requested page size {size} on `{node.name.value}` exceeds the "
+                    f"maximum of {self.limits['MAX_PAGE_SIZE']}."
+                )
+        if sizes:
+            return max(sizes)
+        return self.limits['DEFAULT_FANOUT'] if nested else self.limits['DEFAULT_PAGE_SIZE']
+
+    def _selections(self, selection_set, parent_type):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection, parent_type
+            elif isinstance(selection, InlineFragmentNode):
+                type_ = parent_type
+                if selection.type_condition is not None:
+                    type_ = self.schema.get_type(selection.type_condition.name.value) or parent_type
+                yield from self._selections(selection.selection_set, type_)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is not None:
+                    type_ = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+                    yield from self._selections(fragment.selection_set, type_)
+
+    def _visit(self, selection_set, parent_type, multiplier, depth, nested):
+        for node, type_ in self._selections(selection_set, parent_type):
+            name = node.name.value
+            if name.startswith('__'):
+                continue
+            fields = getattr(type_, 'fields', None) or {}
+            field_def = fields.get(name)
+            if field_def is None:
+                continue
+            return_type = _unwrap(field_def.type)
+            named = get_named_type(return_type)
+
+            if name in CONNECTION_WRAPPERS:
+                if node.selection_set is not None:
+                    self._visit(node.selection_set, named, multiplier, depth, nested)
+                continue
+
+            field_depth = depth + 1
+            self.analysis.depth = max(self.analysis.depth, field_depth)
+            if not is_composite_type(named) or node.selection_set is None:
+                continue
+
+            if _is_connection(return_type):
+                page = self._page_size(node, nested)
+                self.analysis.cost += multiplier + multiplier * page
+                child_multiplier = multiplier * page
+            elif is_list_type(return_type):
+                child_multiplier = multiplier * self.limits['DEFAULT_FANOUT']
+                self.analysis.cost += child_multiplier
+            else:
+                self.analysis.cost += multiplier
+                child_multiplier = multiplier
+            self._visit(node.selection_set, named, child_multiplier, field_depth, nested=True)
+
+    def _check(self):
+        if self.analysis.depth > self.limits['MAX_DEPTH']:
+            self.analysis.errors.append(
+                f"Query depth {self.analysis.depth} exceeds the maximum of {self.limits['MAX_DEPTH']}."
+            )
+        if self.analysis.cost > self.limits['MAX_COST']:
+            self.analysis.errors.append(
+                f"Query cost {self.analysis.cost} exceeds the maximum of {self.limits['MAX_COST']}."
+            )
+
+
+def analyze_cost(schema, document, operation, variables=None):
+    """
+    Return the ``CostAnalysis`` of ``operation``; its ``errors`` list is
+    non-empty when a limit is exceeded.
+    """
+    return CostAnalyzer(schema, document, variables).analyze(operation)
+
+
+def cost_errors(analysis):
+    return [
+        GraphQLError(message, extensions={'code': 'QUERY_TOO_COMPLEX'})
+        for message in analysis.errors
+    ]
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from graphql import parse, print_ast
+from graphql.validation import validate
+
+CachedDocument = namedtuple('CachedDocument', ['query', 'document', 'errors', 'normalized_id'])
+
+
+def document_id(query):
+    """
+    The sha256 hex digest used both as the cache key and as the Apollo
+    persisted-query hash.
+    """
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class DocumentCache:
+    """
+    Thread-safe LRU of parsed and validated GraphQL documents keyed by
+    their sha256 document ID, with hit/miss counters.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_parse(self, query, schema, validation_rules=None, max_errors=None, key=None):
+        """
+        Return the cached document for ``query``, parsing and validating
+        it on a miss. Syntax errors propagate and are not cached.
+        """
+        key = key or document_id(query)
+        entry = self.get(key)
+        if entry is None:
+            document = parse(query)
+            errors = validate(schema, document, validation_rules, max_errors)
+            entry = CachedDocument(query, document, errors, document_id(print_ast(document)))
+            self.set(key, entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -0,0 +1,373 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from graphql import print_ast
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+
+def get_instrumentation_settings():
+    options = {
+        'DEBUG_HEADER': 'X-GraphQL-Debug',
+        'SLOW_OPERATION_THRESHOLD': None,
+        'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],
+        'METRICS_OPERATION_NAMES': None,
+        'METRICS_MAX_OPERATION_NAMES': 100,
+    }
+    options.update(getattr(settings, 'GRAPHQL_INSTRUMENTATION', None) or {})
+    return options
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    """
+    In-process histogram rendered in the Prometheus text exposition
+    format, with one series per label tuple.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(pairs + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(pairs + [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_labels(pairs)} {total}')
+            lines.append(f'{self.name}_count{_labels(pairs)} {count}')
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class CacheMetrics:
+    """
+    Hit and miss counters and the size of a cache with a ``stats()``
+    method (see ``.documents.DocumentCache``), read at scrape time.
+    """
+
+    def __init__(self, name, documentation, cache):
+        self.name = name
+        self.documentation = documentation
+        self.cache = cache
+
+    def expose(self):
+        stats = self.cache.stats()
+        lines = []
+        for suffix, kind, value, documentation in (
+            ('hits_total', 'counter', stats['hits'], 'lookups served from'),
+            ('misses_total', 'counter', stats['misses'], 'lookups that missed'),
+            ('size', 'gauge', stats['size'], 'entries held in'),
+            ('max_size', 'gauge', stats['maxsize'], 'capacity of'),
+        ):
+            name = f'{self.name}_{suffix}'
+            lines.append(f'# HELP {name} {documentation.capitalize()} the {self.documentation}.')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines)
+
+    def clear(self):
+        self.cache.clear()
+
+
+OPERATION_DURATION = Histogram(
+    'graphql_operation_duration_seconds',
+    'Wall time spent executing a GraphQL operation.',
+    ('operation', 'type'),
+)
+OPERATION_SQL_QUERIES = Histogram(
+    'graphql_operation_sql_queries',
+    'SQL queries issued per GraphQL operation.',
+    ('operation', 'type'),
+    QUERY_COUNT_BUCKETS,
+)
+OPERATION_SQL_DURATION = Histogram(
+    'graphql_operation_sql_duration_seconds',
+    'Time spent in SQL per GraphQL operation.',
+    ('operation', 'type'),
+)
+RESOLVER_DURATION = Histogram(
+    'graphql_resolver_duration_seconds',
+    'Time spent in the resolvers of a schema field (Type.field) per GraphQL operation.',
+    ('field',),
+)
+SERIALIZATION_DURATION = Histogram(
+    'graphql_response_serialization_seconds',
+    'Time spent encoding GraphQL responses to JSON.',
+)
+
+METRICS = [
+    OPERATION_DURATION,
+    OPERATION_SQL_QUERIES,
+    OPERATION_SQL_DURATION,
+    RESOLVER_DURATION,
+    SERIALIZATION_DURATION,
+]
+
+
+_operation_names = set()
+_operation_names_lock = threading.Lock()
+
+
+def operation_label(name):
+    """
+    The metrics label of an operation name. Names are chosen by clients,
+    so only ``METRICS_OPERATION_NAMES`` are kept when it is set, and
+    otherwise the first ``METRICS_MAX_OPERATION_NAMES`` distinct names
+    seen; everything else is ``other``.
+    """
+    if not name or name == 'anonymous':
+        return 'anonymous'
+    options = get_instrumentation_settings()
+    if options['METRICS_OPERATION_NAMES'] is not None:
+        return name if name in options['METRICS_OPERATION_NAMES'] else 'other'
+    with _operation_names_lock:
+        if name in _operation_names:
+            return name
+        if len(_operation_names) < options['METRICS_MAX_OPERATION_NAMES']:
+            _operation_names.add(name)
+            return name
+    return 'other'
+
+
+class OperationProfile:
+    """
+    Wall time, SQL count and SQL time of one operation, broken down by
+    resolver path (list indexes dropped, so every edge of a connection
+    adds to the same path). The metrics aggregate the paths by schema
+    field, since paths contain client-chosen aliases.
+    """
+
+    def __init__(self, operation_name, operation_type, document):
+        self.operation_name = operation_name or 'anonymous'
+        self.operation_type = operation_type
+        self.document = document
+        self.start = time.perf_counter()
+        self.duration = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.paths = {}
+        self.fields = {}
+        self._lock = threading.Lock()
+
+    def path_stats(self, path, field):
+        with self._lock:
+            stats = self.paths.get(path)
+            if stats is None:
+                # calls, time, sql count, sql time
+                stats = self.paths[path] = [0, 0.0, 0, 0.0]
+                self.fields[path] = field
+            return stats
+
+    def record_resolver(self, stats, elapsed):
+        with self._lock:
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def record_sql(self, stats, elapsed):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_time += elapsed
+            if stats is not None:
+                stats[2] += 1
+                stats[3] += elapsed
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        labels = (operation_label(self.operation_name), self.operation_type)
+        OPERATION_DURATION.observe(self.duration, *labels)
+        OPERATION_SQL_QUERIES.observe(self.sql_count, *labels)
+        OPERATION_SQL_DURATION.observe(self.sql_time, *labels)
+        fields = {}
+        for path, (calls, elapsed, sql_count, sql_time) in self.paths.items():
+            field = self.fields[path]
+            fields[field] = fields.get(field, 0.0) + elapsed
+        for field, elapsed in fields.items():
+            RESOLVER_DURATION.observe(elapsed, field)
+
+        threshold = get_instrumentation_settings()['SLOW_OPERATION_THRESHOLD']
+        if threshold is not None and self.duration >= threshold:
+            logger.warning(
+                "Slow GraphQL %s %s took %.3fs (%d SQL queries, %.3fs in SQL): %s",
+                self.operation_type, self.operation_name, self.duration,
+                self.sql_count, self.sql_time, print_ast(self.document),
+            )
+
+    def summary(self):
+        resolvers = sorted(self.paths.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'operation': self.operation_name,
+            'duration': round(self.duration or 0.0, 6),
+            'sql': {'count': self.sql_count, 'time': round(self.sql_time, 6)},
+            'resolverTime': round(sum(stats[1] for _, stats in resolvers), 6),
+            'resolvers': [
+                {
+                    'path': path,
+                    'field': self.fields[path],
+                    'calls': calls,
+                    'time': round(elapsed, 6),
+                    'sqlCount': sql_count,
+                    'sqlTime': round(sql_time, 6),
+                }
+                for path, (calls, elapsed, sql_count, sql_time) in resolvers
+            ],
+        }
+
+
+_profile = ContextVar('graphql_operation_profile', default=None)
+_current = ContextVar('graphql_resolver_stats', default=None)
+
+
+def _sql_timer(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_sql(_current.get(), time.perf_counter() - start)
+
+
+def _install_timer(conn):
+    if _sql_timer not in conn.execute_wrappers:
+        conn.execute_wrappers.append(_sql_timer)
+
+
+def _connection_created(sender, connection, **kwargs):
+    _install_timer(connection)
+
+
+connection_created.connect(_connection_created)
+
+
+@contextmanager
+def profile_operation(operation_name, operation_type, document):
+    """
+    Profile the operation executed inside the block. SQL is attributed
+    to whichever resolver is running when it is issued, through context
+    variables, so ``sync_to_async`` threads are covered as well.
+    """
+    _install_timer(connection)
+    profile = OperationProfile(operation_name, operation_type, document)
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+        profile.finish()
+
+
+def _path_key(path):
+    keys = []
+    while path is not None:
+        if isinstance(path.key, str):
+            keys.append(path.key)
+        path = path.prev
+    return '.'.join(reversed(keys))
+
+
+class InstrumentationMiddleware:
+    """
+    Graphene middleware recording the wall time and SQL of every resolver
+    into the profile of the running operation. Enable it through
+    ``GRAPHENE['MIDDLEWARE']``.
+    """
+
+    def resolve(self, next, root, info, **args):
+        profile = _profile.get()
+        if profile is None:
+            return next(root, info, **args)
+        stats = profile.path_stats(_path_key(info.path), f'{info.parent_type.name}.{info.field_name}')
+        start = time.perf_counter()
+        token = _current.set(stats)
+        try:
+            result = next(root, info, **args)
+        finally:
+            _current.reset(token)
+        if isawaitable(result):
+            return self._await(result, profile, stats, start)
+        profile.record_resolver(stats, time.perf_counter() - start)
+        return result
+
+    async def _await(self, result, profile, stats, start):
+        token = _current.set(stats)
+        try:
+            return await result
+        finally:
+            _current.reset(token)
+            profile.record_resolver(stats, time.perf_counter() - start)
+
+
+def is_metrics_client(request):
+    return request.META.get('REMOTE_ADDR') in get_instrumentation_settings()['METRICS_ALLOWED_IPS']
+
+
+def wants_debug(request):
+    """
+    Whether to return the profile with the response. The profile shows
+    SQL and timings, so the header is honoured only under ``DEBUG`` or
+    from the hosts allowed to scrape ``/metrics``.
+    """
+    header = get_instrumentation_settings()['DEBUG_HEADER']
+    if not header or not request.META.get('HTTP_' + header.upper().replace('-', '_')):
+        return False
+    return settings.DEBUG or is_metrics_client(request)
+
+
+def render_metrics():
+    return '\n'.join(metric.expose() for metric in METRICS) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, restricted to ``METRICS_ALLOWED_IPS``.
+    """
+    if not is_metrics_client(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,10 @@
+import os
+from datetime import timedelta
 from pathlib import Path
+
+from celery.schedules import crontab
+from kombu import Queue
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-key'
 DEBUG = True
@@ -11,9 +17,11 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'graphene_django',
+    'django_celery_beat',
     'crm',
 ]
 MIDDLEWARE = [
+    'crm.routers.RoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -23,16 +31,193 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 ROOT_URLCONF = 'alx_backend_graphql.urls'
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+# Connections are kept open for CONN_MAX_AGE seconds and checked before
+# being reused, instead of one new connection per request.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# GraphQL queries and the report tasks read from READ_ALIASES (database
+# aliases of replicas) when there are any; see crm.routers and
+# settings_replica for a local two-file setup.
+DATABASE_ROUTERS = ['crm.routers.ReadReplicaRouter']
+CRM_DATABASE_ROUTING = {
+    'READ_ALIASES': [],
+    'HEALTH_CHECK_INTERVAL': 30,
+}
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
 USE_I18N = True
 USE_TZ = True
 STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-GRAPHENE = {'SCHEMA': 'alx_backend_graphql.schema.schema'}
+GRAPHENE = {
+    'SCHEMA': 'alx_backend_graphql.schema.schema',
+    'MIDDLEWARE': ['alx_backend_graphql.instrumentation.InstrumentationMiddleware'],
+}
+# Parsed/validated documents kept in the GraphQL view's LRU (keyed by sha256)
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+# Response cache for read-only GraphQL queries, invalidated on model writes.
+# BACKEND is 'django' (the CACHES alias in CACHE_ALIAS, shared between
+# processes when that cache is, e.g. Redis or Memcached) or 'lru' (per
+# process: writes made by other processes go unnoticed for up to TIMEOUT,
+# so only use it with a single process). Off until CACHES points at a
+# shared cache; the default local-memory cache is per process too.
+# Responses that read from a replica (READ_ALIASES) are never cached.
+GRAPHQL_RESPONSE_CACHE = {
+    'ENABLED': False,
+    'BACKEND': 'django',
+    'MAX_ENTRIES': 1024,
+    'TIMEOUT': 60,
+    'CACHE_ALIAS': 'default',
+}
+# Static cost limits applied before execution (see alx_backend_graphql.cost).
+# Connections count first/last objects per parent, or DEFAULT_PAGE_SIZE at
+# the top level and DEFAULT_FANOUT when nested; edges/node don't add depth.
+GRAPHQL_COST = {
+    'MAX_DEPTH': 7,
+    'MAX_COST': 5000,
+    'MAX_PAGE_SIZE': 100,
+    'DEFAULT_PAGE_SIZE': 100,
+    'DEFAULT_FANOUT': 10,
+}
+# Per-resolver profiling: the profile is returned under extensions.debug
+# when DEBUG_HEADER is sent (honoured only under DEBUG or from
+# METRICS_ALLOWED_IPS), operations slower than SLOW_OPERATION_THRESHOLD
+# seconds are logged (None disables), and /metrics serves the histograms.
+# Metrics label resolvers by schema field and operations by name: only
+# METRICS_OPERATION_NAMES when set, else the first METRICS_MAX_OPERATION_NAMES
+# names seen; the rest are reported as "other".
+GRAPHQL_INSTRUMENTATION = {
+    'DEBUG_HEADER': 'X-GraphQL-Debug',
+    'SLOW_OPERATION_THRESHOLD': 1.0,
+    'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],
+    'METRICS_OPERATION_NAMES': None,
+    'METRICS_MAX_OPERATION_NAMES': 100,
+}
+# GraphQL subscriptions (websockets at PATH, served by asgi.py). BACKEND is
+# 'memory' (events from this process only) or 'redis' (events from every
+# process that writes, through REDIS_URL). A listener more than QUEUE_SIZE
+# messages behind is dropped and has to resync from changeEvents. Events
+# are published as writes commit, waiting at most PUBLISH_TIMEOUT seconds
+# for Redis.
+GRAPHQL_SUBSCRIPTIONS = {
+    'BACKEND': 'memory',
+    'REDIS_URL': 'redis://localhost:6379/1',
+    'PATH': '/graphql',
+    'QUEUE_SIZE': 1000,
+    'PUBLISH_TIMEOUT': 1.0,
+    'CONNECTION_INIT_TIMEOUT': 10,
+    'MAX_SUBSCRIPTIONS': 20,
+}
+# Celery Configuration
+# Both URLs can be overridden from the environment, e.g. memory:// and
+# cache+memory:// to run tasks in tests without Redis.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_TIMEZONE = 'UTC'
+
+# Task routing: long reports, stock maintenance and notifications each get
+# their own queue, so a slow report cannot delay the heartbeat or the
+# reservation sweep. Start one worker per profile in CRM_WORKER_PROFILES.
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+# Each queue needs its own routing key: bare Queue(name) objects all bind
+# the default key, and every task would be delivered to every queue.
+CELERY_TASK_QUEUES = tuple(
+    Queue(name, routing_key=name) for name in ('default', 'reports', 'stock', 'notifications')
+)
+CELERY_TASK_ROUTES = {
+    'crm.tasks.generate_crm_report': {'queue': 'reports'},
+    'crm.tasks.generate_weekly_reports': {'queue': 'reports'},
+    'crm.tasks.aggregate_customer_range': {'queue': 'reports'},
+    'crm.tasks.merge_weekly_reports': {'queue': 'reports'},
+    'crm.tasks.release_expired_reservations': {'queue': 'stock'},
+    'crm.tasks.update_low_stock': {'queue': 'stock'},
+    'crm.tasks.prune_change_events': {'queue': 'stock'},
+    'crm.tasks.log_crm_heartbeat': {'queue': 'notifications'},
+}
+# Acknowledge after the task ran, so a task whose worker dies is redelivered,
+# and reserve one message per process, so a long report does not sit on
+# prefetched messages other processes could run.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Defaults for tasks that do not set their own limits.
+CELERY_TASK_SOFT_TIME_LIMIT = 300
+CELERY_TASK_TIME_LIMIT = 360
+# Only results somebody reads are stored (the chord partials); they expire
+# after a day instead of piling up in the backend.
+CELERY_TASK_IGNORE_RESULT = False
+CELERY_RESULT_EXPIRES = timedelta(days=1)
+
+# Worker profiles for `python -m crm.worker <profile>`: the queues one
+# worker consumes, its pool size and its prefetch multiplier.
+CRM_WORKER_PROFILES = {
+    'reports': {'queues': ['reports'], 'concurrency': 2, 'prefetch_multiplier': 1},
+    'stock': {'queues': ['stock'], 'concurrency': 2, 'prefetch_multiplier': 1},
+    'notifications': {'queues': ['notifications', 'default'], 'concurrency': 4, 'prefetch_multiplier': 4},
+}
+
+# Celery Beat Configuration
+# Beat is the only scheduler: the former django_crontab jobs (heartbeat and
+# low-stock restock from crm.cron) run as tasks too.
+CELERY_BEAT_SCHEDULE = {
+    'generate-weekly-reports': {
+        'task': 'crm.tasks.generate_weekly_reports',
+        'schedule': crontab(day_of_week='mon', hour=6, minute=15),
+    },
+    'release-expired-reservations': {
+        'task': 'crm.tasks.release_expired_reservations',
+        'schedule': 60.0,
+        # A missed sweep is replaced by the next one.
+        'options': {'expires': 55},
+    },
+    'log-crm-heartbeat': {
+        'task': 'crm.tasks.log_crm_heartbeat',
+        'schedule': crontab(minute='*/5'),
+        'options': {'expires': 240},
+    },
+    'update-low-stock': {
+        'task': 'crm.tasks.update_low_stock',
+        'schedule': crontab(minute=0, hour='*/12'),
+    },
+    'prune-change-events': {
+        'task': 'crm.tasks.prune_change_events',
+        'schedule': crontab(minute=30, hour=3),
+    },
+}
+
+# Weekly per-customer/per-product reports: customer ID ranges aggregated in
+# parallel, merged into CRM_REPORT_DIR/crm_weekly_report_YYYYMMDD.csv with
+# the week's totals in its header (formerly /tmp/crm_report_log.txt)
+CRM_REPORT_RANGES = 8
+CRM_REPORT_DIR = '/tmp'
+
+# Order/stock change log (crm.events): events are inserted BATCH_SIZE at a
+# time, and events older than RETENTION_DAYS that every consumer has
+# processed are pruned.
+CRM_EVENT_LOG = {
+    'BATCH_SIZE': 500,
+    'RETENTION_DAYS': 7,
+}
@@ -0,0 +1,27 @@
+"""
+Local stand-in for a primary/replica deployment, with two SQLite files:
+``db.sqlite3`` is the primary and ``db.replica.sqlite3`` the replica.
+Nothing replicates between them; copy the primary over with::
+
+    DJANGO_SETTINGS_MODULE=alx_backend_graphql.settings_replica python manage.py sync_replica
+
+so reads made before the next sync see replication lag, as they would
+against a real replica. Only the primary is migrated (see
+``ReadReplicaRouter.allow_migrate``); in tests the replica mirrors the
+primary's test database.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, CRM_DATABASE_ROUTING, DATABASES
+
+DATABASES = {
+    'default': {
+        **DATABASES['default'],
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    'replica': {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+CRM_DATABASE_ROUTING = {**CRM_DATABASE_ROUTING, 'READ_ALIASES': ['replica']}
@@ -0,0 +1,234 @@
+"""
+GraphQL subscriptions over websockets, served from ``asgi.py``.
+
+Speaks the ``graphql-transport-ws`` protocol used by Apollo Client and
+the ``graphql-ws`` library
+(https://github.com/enisdenjo/graphql-ws/blob/master/PROTOCOL.md).
+Documents go through the same document cache and cost limits as the
+HTTP views. Each pushed event is executed in a worker thread with a
+fresh context, so the usual synchronous resolvers and loaders apply and
+a long-lived subscription never serves data cached by an earlier event.
+"""
+import asyncio
+import json
+import logging
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast
+from graphql.execution import create_source_event_stream
+
+from .cost import analyze_cost, cost_errors
+from .views import document_cache
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = 'graphql-transport-ws'
+
+DEFAULTS = {
+    'PATH': '/graphql',
+    'CONNECTION_INIT_TIMEOUT': 10,
+    'MAX_SUBSCRIPTIONS': 20,
+}
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'GRAPHQL_SUBSCRIPTIONS', None) or {})
+    return options
+
+
+class GraphQLSubscriptionApp:
+    """
+    ASGI application for ``websocket`` scopes; ``asgi.py`` routes the
+    websocket connections here and everything else to Django.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = schema or graphene_settings.SCHEMA
+        self.options = get_options()
+
+    async def __call__(self, scope, receive, send):
+        await Connection(self, scope, receive, send).run()
+
+
+class Connection:
+    """
+    One websocket connection and its running subscriptions, keyed by the
+    client-chosen operation ID.
+    """
+
+    def __init__(self, app, scope, receive, send):
+        self.app = app
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.acknowledged = False
+        self.initialised = False
+        self.closed = False
+        self.subscriptions = {}
+
+    async def send(self, message):
+        if not self.closed:
+            await self._send({'type': 'websocket.send', 'text': json.dumps(message, cls=DjangoJSONEncoder)})
+
+    async def close(self, code, reason=''):
+        if not self.closed:
+            self.closed = True
+            await self._send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        path = self.app.options['PATH']
+        if self.scope['path'].rstrip('/') != path.rstrip('/') or PROTOCOL not in self.scope.get('subprotocols', ()):
+            # Rejected before the handshake completes: the client gets a 403.
+            await self._send({'type': 'websocket.close', 'code': 4406})
+            return
+        await self._send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.app.options['CONNECTION_INIT_TIMEOUT']
+        try:
+            while not self.closed:
+                timeout = None if self.initialised else max(deadline - loop.time(), 0)
+                try:
+                    message = await asyncio.wait_for(self.receive(), timeout)
+                except asyncio.TimeoutError:
+                    await self.close(4408, 'Connection initialisation timeout')
+                    break
+                if message['type'] == 'websocket.disconnect':
+                    self.closed = True
+                    break
+                if message['type'] == 'websocket.receive':
+                    await self.handle(message.get('text') or message.get('bytes'))
+        finally:
+            for task in list(self.subscriptions.values()):
+                task.cancel()
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            kind = message['type']
+        except (TypeError, ValueError, KeyError):
+            return await self.close(4400, 'Invalid message')
+
+        if kind == 'connection_init':
+            if self.initialised:
+                return await self.close(4429, 'Too many initialisation requests')
+            self.initialised = self.acknowledged = True
+            return await self.send({'type': 'connection_ack'})
+        if kind == 'ping':
+            return await self.send({'type': 'pong'})
+        if kind == 'pong':
+            return
+        if kind == 'subscribe':
+            if not self.acknowledged:
+                return await self.close(4401, 'Unauthorized')
+            operation_id, payload = message.get('id'), message.get('payload')
+            if not isinstance(operation_id, str) or not isinstance(payload, dict):
+                return await self.close(4400, 'Invalid message')
+            if operation_id in self.subscriptions:
+                return await self.close(4409, f'Subscriber for {operation_id} already exists')
+            if len(self.subscriptions) >= self.app.options['MAX_SUBSCRIPTIONS']:
+                return await self.send_errors(operation_id, [GraphQLError(
+                    f"At most {self.app.options['MAX_SUBSCRIPTIONS']} subscriptions per connection"
+                )])
+            self.subscriptions[operation_id] = asyncio.create_task(self.subscribe(operation_id, payload))
+            return
+        if kind == 'complete':
+            task = self.subscriptions.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+            return
+        await self.close(4400, f'Unknown message type {kind!r}')
+
+    async def send_errors(self, operation_id, errors):
+        await self.send({
+            'id': operation_id,
+            'type': 'error',
+            'payload': [GraphQLView.format_error(error) for error in errors],
+        })
+
+    def prepare(self, query, variables, operation_name):
+        """
+        Resolve the payload to a cached document and its subscription
+        operation. Returns ``(entry, operation_ast, errors)``.
+        """
+        schema = self.app.schema.graphql_schema
+        try:
+            entry = document_cache.get_or_parse(
+                query, schema, max_errors=graphene_settings.MAX_VALIDATION_ERRORS
+            )
+        except GraphQLError as error:
+            return None, None, [error]
+        if entry.errors:
+            return None, None, entry.errors
+        operation_ast = get_operation_ast(entry.document, operation_name)
+        if operation_ast is None:
+            return None, None, [GraphQLError("Unknown operation.")]
+        if operation_ast.operation != OperationType.SUBSCRIPTION:
+            return None, None, [GraphQLError(
+                "Only subscriptions are served over websockets; send queries and mutations to /graphql."
+            )]
+        analysis = analyze_cost(schema, entry.document, operation_ast, variables)
+        if analysis.errors:
+            return None, None, cost_errors(analysis)
+        return entry, operation_ast, None
+
+    def context(self):
+        return SimpleNamespace(scope=self.scope)
+
+    def execute_event(self, document, event, variables, operation_name):
+        return execute(
+            self.app.schema.graphql_schema, document, root_value=event,
+            context_value=self.context(), variable_values=variables, operation_name=operation_name,
+        )
+
+    async def subscribe(self, operation_id, payload):
+        query = payload.get('query') or ''
+        variables = payload.get('variables') or {}
+        operation_name = payload.get('operationName')
+        try:
+            entry, operation_ast, errors = self.prepare(query, variables, operation_name)
+            if errors:
+                return await self.send_errors(operation_id, errors)
+
+            stream = await create_source_event_stream(
+                self.app.schema.graphql_schema, entry.document, None, self.context(), variables, operation_name
+            )
+            if isinstance(stream, ExecutionResult):
+                return await self.send_errors(operation_id, stream.errors)
+            try:
+                async for event in stream:
+                    result = await sync_to_async(self.execute_event)(
+                        entry.document, event, variables, operation_name
+                    )
+                    await self.send({'id': operation_id, 'type': 'next', 'payload': self.format_result(result)})
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                # The source stream broke (e.g. the listener overflowed):
+                # report it as a result, then complete.
+                logger.warning("Subscription %s failed", operation_id, exc_info=True)
+                result = ExecutionResult(errors=[GraphQLError(str(error), original_error=error)])
+                await self.send({'id': operation_id, 'type': 'next', 'payload': self.format_result(result)})
+            finally:
+                aclose = getattr(stream, 'aclose', None)
+                if aclose is not None:
+                    await aclose()
+            await self.send({'id': operation_id, 'type': 'complete'})
+        finally:
+            if self.subscriptions.get(operation_id) is asyncio.current_task():
+                del self.subscriptions[operation_id]
+
+    def format_result(self, result):
+        response = {'data': result.data}
+        if result.errors:
+            response['errors'] = [GraphQLView.format_error(error) for error in result.errors]
+        return response
@@ -1,6 +1,15 @@
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
+
+from crm.export import export_view
+
+from .instrumentation import metrics_view
+from .views import AsyncCRMGraphQLView, CRMGraphQLView
 urlpatterns = [
-    path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path("graphql", csrf_exempt(CRMGraphQLView.as_view(graphiql=True))),
+    # Async execution path; serve it through asgi.py (e.g. uvicorn/daphne).
+    path("graphql/async", csrf_exempt(AsyncCRMGraphQLView.as_view())),
+    path("metrics", metrics_view),
+    # Streaming CSV/NDJSON export of customers or orders, filtered like allCustomers/allOrders.
+    path("export/<str:resource>", export_view),
 ]
@@ -0,0 +1,393 @@
+import inspect
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.http.response import HttpResponseBadRequest
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, validate_schema
+from graphql.error import GraphQLError
+
+from crm.response_cache import get_response_cache
+from crm.routers import read_replica
+
+from .cost import analyze_cost, cost_errors
+from .documents import DocumentCache, document_id
+from .instrumentation import METRICS, SERIALIZATION_DURATION, CacheMetrics, profile_operation, wants_debug
+
+document_cache = DocumentCache(getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 256))
+METRICS.append(CacheMetrics('graphql_document_cache', 'GraphQL document cache', document_cache))
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQLView that accepts Apollo automatic persisted queries and
+    serves repeat documents from an LRU of parsed and validated ASTs, so
+    only the first request for a document pays for parse and validate.
+    Results of query operations are additionally served from the
+    response cache when it is enabled.
+
+    Every operation is costed before execution (see ``.cost``) and
+    rejected when it exceeds the configured depth, cost or page-size
+    limits; the computed cost is returned under ``extensions.cost``.
+    Executions are profiled (see ``.instrumentation``), and the profile
+    is returned under ``extensions.debug`` when the debug header is set.
+    """
+
+    document_cache = document_cache
+
+    def get_persisted_query_hash(self, request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        persisted = (extensions or {}).get('persistedQuery')
+        if not persisted:
+            return None
+        if persisted.get('version') != 1:
+            raise HttpError(HttpResponseBadRequest("Unsupported persisted query version."))
+        return persisted.get('sha256Hash')
+
+    def get_document(self, request, data, query):
+        """
+        Resolve the request to a cached document, following the APQ
+        protocol when a ``persistedQuery`` extension is present.
+        """
+        sha256_hash = self.get_persisted_query_hash(request, data)
+        schema = self.schema.graphql_schema
+        rules = self.validation_rules
+        max_errors = graphene_settings.MAX_VALIDATION_ERRORS
+
+        if sha256_hash is None:
+            return self.document_cache.get_or_parse(query, schema, rules, max_errors)
+        if not query:
+            entry = self.document_cache.get(sha256_hash)
+            if entry is None:
+                raise GraphQLError(
+                    "PersistedQueryNotFound",
+                    extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'},
+                )
+            return entry
+        if document_id(query) != sha256_hash:
+            raise HttpError(HttpResponseBadRequest("Provided sha256Hash does not match query."))
+        return self.document_cache.get_or_parse(query, schema, rules, max_errors, key=sha256_hash)
+
+    def prepare_request(self, request, data, query, operation_name, show_graphiql=False):
+        """
+        Resolve the request to a cached document and its operation.
+
+        Returns ``(entry, operation_ast, result)`` where ``result`` is set
+        when the request is already answered (an error, or ``None`` for
+        GraphiQL) and must not be executed.
+        """
+        if not query and self.get_persisted_query_hash(request, data) is None:
+            if show_graphiql:
+                return None, None, None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return None, None, ExecutionResult(data=None, errors=schema_validation_errors)
+
+        try:
+            entry = self.get_document(request, data, query)
+        except HttpError:
+            raise
+        except Exception as e:
+            return None, None, ExecutionResult(errors=[e])
+
+        if entry.errors:
+            return None, None, ExecutionResult(data=None, errors=entry.errors)
+
+        operation_ast = get_operation_ast(entry.document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None, None, None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+        return entry, operation_ast, None
+
+    def check_cost(self, entry, operation_ast, variables):
+        """
+        Cost the operation against the configured limits. Returns
+        ``(analysis, result)`` where ``result`` is the rejection to send
+        instead of executing, if any.
+        """
+        if operation_ast is None:
+            return None, None
+        analysis = analyze_cost(self.schema.graphql_schema, entry.document, operation_ast, variables)
+        if analysis.errors:
+            return analysis, self.with_cost(ExecutionResult(errors=cost_errors(analysis)), analysis)
+        return analysis, None
+
+    def with_cost(self, result, analysis):
+        if analysis is not None and result is not None:
+            result.extensions = {**(result.extensions or {}), 'cost': analysis.as_extension()}
+        return result
+
+    def profile(self, entry, operation_ast, operation_name):
+        if operation_ast is not None:
+            operation_name = operation_name or (operation_ast.name and operation_ast.name.value)
+            operation_type = operation_ast.operation.value
+        else:
+            operation_type = 'unknown'
+        return profile_operation(operation_name, operation_type, entry.document)
+
+    def with_profile(self, request, result, profile):
+        if wants_debug(request):
+            result.extensions = {**(result.extensions or {}), 'debug': profile.summary()}
+        return result
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        entry, operation_ast, result = self.prepare_request(
+            request, data, query, operation_name, show_graphiql
+        )
+        if entry is None:
+            return result
+        analysis, result = self.check_cost(entry, operation_ast, variables)
+        if result is not None:
+            return result
+
+        with self.profile(entry, operation_ast, operation_name) as profile:
+            if operation_ast is not None and operation_ast.operation == OperationType.QUERY:
+                # Queries may read from a replica (see crm.routers).
+                with read_replica():
+                    result = self.execute_cached_query(request, entry, variables, operation_name)
+            else:
+                result = self.execute_document(request, entry.document, operation_ast, variables, operation_name)
+        return self.with_profile(request, self.with_cost(result, analysis), profile)
+
+    def build_response(self, request, execution_result, id=None, pretty=False):
+        """
+        Serialize ``execution_result`` the way ``GraphQLView.get_response``
+        does, also passing its ``extensions`` through to the client.
+        """
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.errors and any(
+            not getattr(e, "path", None) for e in execution_result.errors
+        ):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+
+        if execution_result.extensions:
+            response["extensions"] = execution_result.extensions
+
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+
+        start = time.perf_counter()
+        content = self.json_encode(request, response, pretty=pretty)
+        SERIALIZATION_DURATION.observe(time.perf_counter() - start)
+        return content, status_code
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        if not execution_result:
+            return None, 200
+        return self.build_response(request, execution_result, id, pretty=show_graphiql)
+
+    def execute_cached_query(self, request, entry, variables, operation_name):
+        """
+        Serve a query from the response cache, or execute it while
+        recording which models it reads and cache the result when it
+        completes without errors.
+        """
+        cache = get_response_cache()
+        if cache is None or request.META.get('HTTP_CACHE_CONTROL') == 'no-cache':
+            return self.execute_document(request, entry.document, None, variables, operation_name)
+
+        key = cache.make_key(entry.normalized_id, variables, operation_name)
+        data = cache.lookup(key)
+        if data is not None:
+            return ExecutionResult(data=data)
+
+        versions = cache.snapshot()
+        with cache.record_tags() as tags:
+            result = self.execute_document(request, entry.document, None, variables, operation_name)
+        if not result.errors:
+            cache.store(key, result.data, tags, versions)
+        return result
+
+    def execute_document(self, request, document, operation_ast, variables, operation_name):
+        schema = self.schema.graphql_schema
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """
+    Async variant of ``CRMGraphQLView`` for ASGI deployments.
+
+    Queries are executed on the event loop: the connection fields and
+    totals switch to their async ORM resolvers (see ``crm.fields.is_async``)
+    and independent top-level fields are awaited concurrently by
+    graphql-core. Mutations still run synchronously, in a worker thread,
+    so they keep their transaction handling.
+    """
+
+    view_is_async = True
+
+    def get_context(self, request):
+        request.graphql_async = True
+        return request
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["GET", "POST"], "GraphQL only supports GET and POST requests."
+                    )
+                )
+
+            data = self.parse_body(request)
+
+            if self.batch:
+                responses = [await self.aget_response(request, entry) for entry in data]
+                result = "[{}]".format(",".join([response[0] for response in responses]))
+                status_code = (
+                    responses
+                    and max(responses, key=lambda response: response[1])[1]
+                    or 200
+                )
+            else:
+                result, status_code = await self.aget_response(request, data)
+
+            return HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+            return response
+
+    async def aget_response(self, request, data):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = await self.aexecute_graphql_request(
+            request, data, query, variables, operation_name
+        )
+        return self.build_response(request, execution_result, id)
+
+    async def aexecute_graphql_request(self, request, data, query, variables, operation_name):
+        entry, operation_ast, result = self.prepare_request(request, data, query, operation_name)
+        if entry is None:
+            return result
+        analysis, result = self.check_cost(entry, operation_ast, variables)
+        if result is not None:
+            return result
+
+        with self.profile(entry, operation_ast, operation_name) as profile:
+            if operation_ast is not None and operation_ast.operation == OperationType.QUERY:
+                with read_replica():
+                    result = await self.aexecute_cached_query(request, entry, variables, operation_name)
+            else:
+                result = await sync_to_async(self.execute_document)(
+                    request, entry.document, operation_ast, variables, operation_name
+                )
+        return self.with_profile(request, self.with_cost(result, analysis), profile)
+
+    async def aexecute_cached_query(self, request, entry, variables, operation_name):
+        cache = get_response_cache()
+        if cache is None or request.META.get('HTTP_CACHE_CONTROL') == 'no-cache':
+            return await self.aexecute_document(request, entry.document, variables, operation_name)
+
+        key = cache.make_key(entry.normalized_id, variables, operation_name)
+        data = await sync_to_async(cache.lookup)(key)
+        if data is not None:
+            return ExecutionResult(data=data)
+
+        versions = await sync_to_async(cache.snapshot)()
+        with cache.record_tags() as tags:
+            result = await self.aexecute_document(request, entry.document, variables, operation_name)
+        if not result.errors:
+            await sync_to_async(cache.store)(key, result.data, tags, versions)
+        return result
+
+    async def aexecute_document(self, request, document, variables, operation_name):
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            result = execute(self.schema.graphql_schema, document, **execute_options)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
@@ -0,0 +1,474 @@
+import asyncio
+import json
+import platform
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from importlib import import_module
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+from django.db.migrations import AddIndex
+from django.db.models import Max
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from . import reports, tasks
+from .celery import app
+from .management.commands.seed_crm import seed_epoch
+from .models import Order, Product
+from .stock import restock_low_stock
+
+ENDPOINT = '/graphql'
+ASYNC_ENDPOINT = '/graphql/async'
+
+# Dataset sizes passed to the seed_crm command.
+SIZES = {
+    'small': {'customers': 100, 'products': 50, 'orders': 1000},
+    'medium': {'customers': 1000, 'products': 200, 'orders': 10000},
+    'large': {'customers': 10000, 'products': 1000, 'orders': 100000},
+    # For the customer search scenarios; orders are kept small.
+    'customers-1m': {'customers': 1000000, 'products': 1000, 'orders': 10000},
+    # For the weekly report: every order falls in the reported week.
+    'orders-1m': {'customers': 100000, 'products': 1000, 'orders': 1000000, 'days': 7},
+    # For the restock scenarios: about 1% of the products are low on stock.
+    'products-500k': {'customers': 100, 'products': 500000, 'orders': 1000},
+    # For the filter scenarios with and without the filter indexes.
+    'filters-1m': {'customers': 1000000, 'products': 100000, 'orders': 1000000},
+}
+
+ALL_ORDERS = """
+query AllOrders($first: Int, $totalAmountGte: Decimal, $totalAmountLte: Decimal,
+                $orderDateGte: Date, $orderDateLte: Date, $customerName: String,
+                $productName: String, $productId: Decimal, $search: String) {
+  allOrders(first: $first, totalAmountGte: $totalAmountGte, totalAmountLte: $totalAmountLte,
+            orderDateGte: $orderDateGte, orderDateLte: $orderDateLte, customerName: $customerName,
+            productName: $productName, productId: $productId, search: $search) {
+    totalCount
+    edges {
+      node {
+        id
+        totalAmount
+        orderDate
+        customer { id name email }
+        products(first: 10) { edges { node { id name price } } }
+      }
+    }
+  }
+}
+"""
+
+LOW_STOCK_PRODUCTS = """
+query LowStockProducts {
+  allProducts(first: 100, lowStock: true) {
+    totalCount
+    edges { node { id name price stock } }
+  }
+}
+"""
+
+TOTALS = """
+query Totals($since: Date) {
+  totalCustomers
+  totalOrders
+  totalRevenue
+  recentCustomers: totalCustomers(since: $since)
+  recentRevenue: totalRevenue(since: $since)
+}
+"""
+
+FILTER_PRODUCTS = """
+query FilterProducts($priceGte: Decimal, $priceLte: Decimal, $stockLte: Decimal) {
+  allProducts(first: 50, priceGte: $priceGte, priceLte: $priceLte, stockLte: $stockLte) {
+    totalCount
+    edges { node { id name price stock } }
+  }
+}
+"""
+
+SEARCH_CUSTOMERS = """
+query SearchCustomers($name: String, $email: String, $search: String, $createdAtGte: Date,
+                      $phonePattern: String) {
+  allCustomers(first: 20, name: $name, email: $email, search: $search, createdAtGte: $createdAtGte,
+               phonePattern: $phonePattern) {
+    totalCount
+    edges { node { id name email } }
+  }
+}
+"""
+
+CREATE_CUSTOMER = """
+mutation CreateCustomer($name: String!, $email: String!, $phone: String!) {
+  createCustomer(name: $name, email: $email, phone: $phone) {
+    customer { id name email }
+  }
+}
+"""
+
+UPDATE_LOW_STOCK = """
+mutation UpdateLowStock {
+  updateLowStockProducts {
+    success
+    updatedProducts { id name stock }
+  }
+}
+"""
+
+
+class Scenario:
+    """
+    One benchmarked operation. ``variables`` is called with the iteration
+    number so mutations can use unique inputs; mutations run in a
+    transaction that is rolled back, so every iteration sees the same data.
+    """
+
+    def __init__(self, name, query, variables=None, mutation=False):
+        self.name = name
+        self.query = query
+        self.variables = variables or (lambda iteration: {})
+        self.mutation = mutation
+
+
+def get_scenarios(seed=42):
+    # Dates are relative to the newest timestamp seed_crm generates for
+    # ``seed``, so the filters match the same rows on every run.
+    epoch = seed_epoch(seed)
+
+    def days_ago(days):
+        return (epoch - timedelta(days=days)).date().isoformat()
+
+    def orders(**filters):
+        return lambda iteration: {'first': 50, **filters}
+
+    return [
+        Scenario('allOrders', ALL_ORDERS, orders()),
+        Scenario('allOrders.totalAmountGte', ALL_ORDERS, orders(totalAmountGte='1000')),
+        Scenario('allOrders.totalAmountLte', ALL_ORDERS, orders(totalAmountLte='500')),
+        Scenario('allOrders.orderDateGte', ALL_ORDERS, orders(orderDateGte=days_ago(30))),
+        Scenario('allOrders.orderDateLte', ALL_ORDERS, orders(orderDateLte=days_ago(60))),
+        Scenario('allOrders.customerName', ALL_ORDERS, orders(customerName='ali')),
+        Scenario('allOrders.productName', ALL_ORDERS, orders(productName='mon')),
+        Scenario('allOrders.productId', ALL_ORDERS, lambda iteration: {
+            'first': 50,
+            'productId': str(Product.objects.order_by('pk').values_list('pk', flat=True).first()),
+        }),
+        Scenario('allOrders.search', ALL_ORDERS, orders(search='monitor')),
+        Scenario('allProducts.lowStock', LOW_STOCK_PRODUCTS),
+        Scenario('allProducts.priceRange', FILTER_PRODUCTS, lambda iteration: {'priceGte': '100', 'priceLte': '101'}),
+        Scenario('allProducts.stockLte', FILTER_PRODUCTS, lambda iteration: {'stockLte': '2'}),
+        # The icontains filter and the full-text index, for the same input.
+        Scenario('allCustomers.name', SEARCH_CUSTOMERS, lambda iteration: {'name': 'johnson'}),
+        Scenario('allCustomers.search', SEARCH_CUSTOMERS, lambda iteration: {'search': 'johnson'}),
+        Scenario('allCustomers.emailRare', SEARCH_CUSTOMERS, lambda iteration: {'email': '-99999'}),
+        Scenario('allCustomers.searchRare', SEARCH_CUSTOMERS, lambda iteration: {'search': '99999'}),
+        Scenario('allCustomers.createdAtGte', SEARCH_CUSTOMERS, lambda iteration: {'createdAtGte': days_ago(1)}),
+        Scenario('allCustomers.phonePattern', SEARCH_CUSTOMERS, lambda iteration: {'phonePattern': '+1555'}),
+        Scenario('totals', TOTALS, lambda iteration: {'since': days_ago(7)}),
+        Scenario('createCustomer', CREATE_CUSTOMER, lambda iteration: {
+            'name': 'Bench Customer',
+            'email': f'bench-{iteration}@example.com',
+            'phone': '+12025550100',
+        }, mutation=True),
+        Scenario('updateLowStockProducts', UPDATE_LOW_STOCK, mutation=True),
+    ]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _body(scenario, variables):
+    return json.dumps({'query': scenario.query, 'variables': variables})
+
+
+def _check(scenario, response):
+    if response.status_code != 200:
+        raise BenchmarkError(f"{scenario.name}: HTTP {response.status_code}")
+    errors = response.json().get('errors')
+    if errors:
+        raise BenchmarkError(f"{scenario.name}: {errors}")
+
+
+def _post(client, scenario, variables):
+    _check(scenario, client.post(ENDPOINT, data=_body(scenario, variables), content_type='application/json'))
+
+
+def _timed(client, scenario, iteration):
+    variables = scenario.variables(iteration)
+    # The query log is a bounded deque: once seeding filled it, captured
+    # slices would come back empty.
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        if scenario.mutation:
+            with transaction.atomic():
+                started = time.perf_counter()
+                _post(client, scenario, variables)
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+        else:
+            started = time.perf_counter()
+            _post(client, scenario, variables)
+            elapsed = time.perf_counter() - started
+    # Drop the savepoint statements of the rollback wrapper.
+    sql = [query for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+    return elapsed, len(sql)
+
+
+def run_scenario(scenario, repeat=20, warmup=2, client=None):
+    """
+    Run ``scenario`` through the test client and return latency statistics
+    in milliseconds plus the SQL query count of one request.
+    """
+    client = client or Client()
+    for iteration in range(warmup):
+        _timed(client, scenario, -1 - iteration)
+    timings, sql_counts = [], []
+    for iteration in range(repeat):
+        elapsed, sql = _timed(client, scenario, iteration)
+        timings.append(elapsed * 1000)
+        sql_counts.append(sql)
+    return _summary(timings, sql_counts)
+
+
+def _summary(timings, sql_counts):
+    timings = sorted(timings)
+    return {
+        'repeat': len(timings),
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3),
+        'sql_queries': max(sql_counts),
+    }
+
+
+def _report_week():
+    last = Order.objects.aggregate(last=Max('order_date'))['last'] or timezone.now()
+    return reports.week_window(last + timedelta(microseconds=1))
+
+
+def _report_single(since, until, parts):
+    customers, products = reports.merge_partials([reports.aggregate_range(0, 2 ** 63 - 1, since, until)])
+    reports.write_report(reports.report_path(until), since, until, customers, products)
+
+
+def _report_chord(since, until, parts):
+    tasks.generate_weekly_reports.delay(until.isoformat())
+
+
+def _report_parallel(since, until, parts):
+    # What the reports workers do, with one thread per range.
+    def aggregate(bounds):
+        try:
+            return reports.aggregate_range(*bounds, since, until)
+        finally:
+            connection.close()
+
+    ranges = reports.customer_ranges(parts, since, until)
+    with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as pool:
+        partials = list(pool.map(aggregate, ranges))
+    customers, products = reports.merge_partials(partials)
+    reports.write_report(reports.report_path(until), since, until, customers, products)
+
+
+REPORT_VARIANTS = {
+    # One aggregation over every customer.
+    'weeklyReport.single': _report_single,
+    # The chord in eager mode: the ranges run one after another.
+    'weeklyReport.chord': _report_chord,
+    # The ranges run concurrently, as on a pool of report workers.
+    'weeklyReport.parallel': _report_parallel,
+}
+
+
+def _time_calls(call, repeat, rollback=False):
+    timings, sql_counts = [], []
+    for _ in range(repeat):
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries, transaction.atomic() if rollback else nullcontext():
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+            if rollback:
+                transaction.set_rollback(True)
+        sql_counts.append(len([query for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]))
+    return _summary(timings, sql_counts)
+
+
+def run_report(name, repeat=3, parts=None):
+    """
+    Build the weekly report of the last seeded week with one of
+    ``REPORT_VARIANTS`` and return the same statistics as
+    ``run_scenario``. The SQL count only covers the calling thread.
+    """
+    parts = parts or getattr(settings, 'CRM_REPORT_RANGES', 8)
+    since, until = _report_week()
+    eager = {'task_always_eager': True, 'task_eager_propagates': True}
+    previous = {key: app.conf[key] for key in eager}
+    app.conf.update(eager)
+    try:
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(CRM_REPORT_DIR=directory, CRM_REPORT_RANGES=parts):
+            return _time_calls(lambda: REPORT_VARIANTS[name](since, until, parts), repeat)
+    finally:
+        app.conf.update(previous)
+
+
+def _restock_loop(threshold, increment):
+    # What UpdateLowStockProducts did before: one full-row save() per product.
+    for product in Product.objects.filter(stock__lt=threshold):
+        product.stock += increment
+        product.save()
+
+
+def _restock_bulk(threshold, increment):
+    restock_low_stock(threshold, increment, max_batch=Product.objects.count() or 1)
+
+
+RESTOCK_VARIANTS = {
+    'restock.loop': _restock_loop,
+    'restock.bulk': _restock_bulk,
+}
+
+
+def run_restock(name, repeat=3, threshold=10, increment=10):
+    """
+    Restock every product below ``threshold`` with one of
+    ``RESTOCK_VARIANTS``, rolling each run back so all of them see the
+    same low-stock rows.
+    """
+    return _time_calls(lambda: RESTOCK_VARIANTS[name](threshold, increment), repeat, rollback=True)
+
+
+def _load_wsgi(scenario, concurrency, requests):
+    # A thread per client, as in a threaded WSGI server.
+    def client(count):
+        client, timings = Client(), []
+        try:
+            for iteration in range(count):
+                started = time.perf_counter()
+                _post(client, scenario, scenario.variables(iteration))
+                timings.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+        return timings
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return [t for timings in pool.map(client, _shares(requests, concurrency)) for t in timings]
+
+
+def _load_asgi(scenario, concurrency, requests):
+    # A coroutine per client on one event loop, as in an ASGI server.
+    async def client(count):
+        client, timings = AsyncClient(), []
+        for iteration in range(count):
+            started = time.perf_counter()
+            response = await client.post(
+                ASYNC_ENDPOINT, data=_body(scenario, scenario.variables(iteration)),
+                content_type='application/json',
+            )
+            timings.append(time.perf_counter() - started)
+            _check(scenario, response)
+        return timings
+
+    async def run():
+        results = await asyncio.gather(*(client(count) for count in _shares(requests, concurrency)))
+        return [t for timings in results for t in timings]
+
+    return asyncio.run(run())
+
+
+def _shares(requests, concurrency):
+    return [requests // concurrency + (n < requests % concurrency) for n in range(concurrency)]
+
+
+LOAD_SERVERS = {
+    'wsgi': _load_wsgi,
+    'asgi': _load_asgi,
+}
+
+
+def run_load(scenario, server, concurrency, requests):
+    """
+    Send ``requests`` requests for a read-only ``scenario`` from
+    ``concurrency`` concurrent clients through Django's WSGI
+    (``CRMGraphQLView``) or ASGI (``AsyncCRMGraphQLView``) handler, in
+    this process, and return the latency statistics plus the throughput.
+    """
+    # Under load the operation time is mostly queueing: don't log every
+    # request as slow.
+    instrumentation = {**getattr(settings, 'GRAPHQL_INSTRUMENTATION', {}), 'SLOW_OPERATION_THRESHOLD': None}
+    with override_settings(GRAPHQL_INSTRUMENTATION=instrumentation):
+        started = time.perf_counter()
+        timings = LOAD_SERVERS[server](scenario, concurrency, requests)
+        elapsed = time.perf_counter() - started
+    result = _summary([timing * 1000 for timing in timings], [0])
+    result.update(concurrency=concurrency, requests_per_second=round(len(timings) / elapsed, 1))
+    return result
+
+
+@contextmanager
+def without_filter_indexes():
+    """
+    Drop the indexes added by the ``0003_filter_indexes`` migration for
+    the block, to measure the filters as they ran before it, and create
+    them again afterwards.
+    """
+    migration = import_module('crm.migrations.0003_filter_indexes')
+    added = [
+        (apps.get_model('crm', operation.model_name), operation.index)
+        for operation in migration.Migration.operations if isinstance(operation, AddIndex)
+    ]
+    with connection.schema_editor() as editor:
+        for model, index in added:
+            editor.remove_index(model, index)
+        migration.drop_trigram_indexes(apps, editor)
+    try:
+        yield
+    finally:
+        with connection.schema_editor() as editor:
+            for model, index in added:
+                editor.add_index(model, index)
+            migration.create_trigram_indexes(apps, editor)
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Compare two result documents. A scenario regresses when its median
+    latency grows by more than ``threshold`` (a fraction) or it issues
+    more SQL queries than the baseline. Returns ``(rows, regressions)``
+    where each row is ``(size, scenario, baseline median, current median,
+    change, baseline sql, current sql, regressed)``.
+    """
+    rows, regressions = [], []
+    for size, scenarios in current['results'].items():
+        for name, result in scenarios.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0.0
+            regressed = change > threshold or result['sql_queries'] > before['sql_queries']
+            row = (
+                size, name, before['median_ms'], result['median_ms'], change,
+                before['sql_queries'], result['sql_queries'], regressed,
+            )
+            rows.append(row)
+            if regressed:
+                regressions.append(row)
+    return rows, regressions
@@ -0,0 +1,191 @@
+import re
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+
+from .models import Customer, Product, Order, OrderItem
+from .orders import ZERO, compute_totals, lock_products
+from .stock import decrement_stock
+from . import events, response_cache, stats
+
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+PHONE_RE = re.compile(r'^(\+\d{7,15}|\d{3}-\d{3}-\d{4})$')
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _error(index, field, message):
+    return {'index': index, 'field': field, 'message': message}
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _insert(model, rows, chunk_size, errors):
+    """
+    Insert ``(index, instance)`` pairs with ``bulk_create`` one chunk at a
+    time. A chunk that hits an integrity error is retried row by row so
+    only the offending rows are reported. Like ``bulk_create`` itself this
+    sends no model signals; callers update the stats rollup directly.
+    """
+    created = []
+    for chunk in _chunks(rows, chunk_size):
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([instance for _, instance in chunk])
+            created.extend(chunk)
+        except IntegrityError:
+            for index, instance in chunk:
+                try:
+                    with transaction.atomic():
+                        model.objects.bulk_create([instance])
+                    created.append((index, instance))
+                except IntegrityError as e:
+                    instance.pk = None
+                    errors.append(_error(index, None, str(e)))
+    if created:
+        response_cache.invalidate(model)
+    return created
+
+
+def validate_customers(rows):
+    """
+    Validate customer rows column by column: one regex pass over the
+    emails and phones, one set pass for duplicates inside the batch and
+    one query for emails that already exist.
+    """
+    errors = {}
+    emails = [(row.get('email') or '').strip().lower() for row in rows]
+    phones = [row.get('phone') for row in rows]
+
+    for index, row in enumerate(rows):
+        if not (row.get('name') or '').strip():
+            errors.setdefault(index, _error(index, 'name', "Name is required"))
+    for index, email in enumerate(emails):
+        if not EMAIL_RE.match(email):
+            errors.setdefault(index, _error(index, 'email', "Invalid email format"))
+    for index, phone in enumerate(phones):
+        if phone and not PHONE_RE.match(phone):
+            errors.setdefault(index, _error(index, 'phone', "Invalid phone format"))
+
+    seen = set()
+    for index, email in enumerate(emails):
+        if email in seen:
+            errors.setdefault(index, _error(index, 'email', "Duplicate email in batch"))
+        seen.add(email)
+
+    existing = set(
+        Customer.objects.filter(email__in=[e for e in seen if e]).values_list('email', flat=True)
+    )
+    for index, email in enumerate(emails):
+        if email in existing:
+            errors.setdefault(index, _error(index, 'email', "Email already exists"))
+    return errors
+
+
+def bulk_create_customers(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    errors = validate_customers(rows)
+    pending = [
+        (index, Customer(name=row['name'].strip(), email=row['email'].strip().lower(), phone=row.get('phone')))
+        for index, row in enumerate(rows) if index not in errors
+    ]
+    errors = list(errors.values())
+    created = _insert(Customer, pending, chunk_size, errors)
+    stats.record_customers([instance for _, instance in created])
+    return [instance for _, instance in created], sorted(errors, key=lambda e: e['index'])
+
+
+def bulk_create_products(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    errors = []
+    pending = []
+    for index, row in enumerate(rows):
+        name = (row.get('name') or '').strip()
+        stock = row.get('stock') or 0
+        try:
+            price = Decimal(str(row.get('price')))
+        except (InvalidOperation, ValueError):
+            price = None
+        if not name:
+            errors.append(_error(index, 'name', "Name is required"))
+        elif price is None or price <= 0:
+            errors.append(_error(index, 'price', "Price must be positive"))
+        elif stock < 0:
+            errors.append(_error(index, 'stock', "Stock cannot be negative"))
+        else:
+            pending.append((index, Product(name=name, price=price, stock=stock)))
+    created = _insert(Product, pending, chunk_size, errors)
+    events.record_many(events.STOCK_CHANGED, [
+        (product.pk, {'delta': product.stock, 'stock': product.stock}) for _, product in created if product.stock
+    ])
+    return [instance for _, instance in created], sorted(errors, key=lambda e: e['index'])
+
+
+def bulk_create_orders(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Create orders of one of each of their products, in chunks, through the
+    same path as ``place_order``: the chunk's products are locked, stock is
+    checked against the locked rows (rows it cannot cover are rejected),
+    lines snapshot the current prices, the totals are computed by the
+    database and stock is taken with one UPDATE. The query count per chunk
+    does not depend on the number of orders or lines.
+    """
+    errors = []
+    customer_ids = {row['customer_id'] for row in rows}
+    known_customers = set(Customer.objects.filter(pk__in=customer_ids).values_list('pk', flat=True))
+
+    pending = []
+    for index, row in enumerate(rows):
+        ids = list(dict.fromkeys(row.get('product_ids') or []))
+        if row['customer_id'] not in known_customers:
+            errors.append(_error(index, 'customerId', f"Invalid customer ID: {row['customer_id']}"))
+        elif not ids:
+            errors.append(_error(index, 'productIds', "At least one product must be selected"))
+        else:
+            pending.append((index, row['customer_id'], ids))
+
+    created = []
+    for chunk in _chunks(pending, chunk_size):
+        with transaction.atomic(), events.batch():
+            products = lock_products({pk for _, _, ids in chunk for pk in ids})
+            available = {pk: product.stock for pk, product in products.items()}
+            orders = []
+            for index, customer_id, ids in chunk:
+                missing = [pk for pk in ids if pk not in products]
+                short = [products[pk].name for pk in ids if pk in products and available[pk] < 1]
+                if missing:
+                    errors.append(_error(index, 'productIds', f"Invalid product ID(s): {missing}"))
+                elif short:
+                    errors.append(_error(index, 'productIds', f"Insufficient stock: {', '.join(short)}"))
+                else:
+                    for pk in ids:
+                        available[pk] -= 1
+                    order = Order(customer_id=customer_id, total_amount=ZERO)
+                    order._bulk_product_ids = ids
+                    orders.append((index, order))
+
+            orders = _insert(Order, orders, chunk_size, errors)
+            if not orders:
+                continue
+            quantities = defaultdict(int)
+            for _, order in orders:
+                for pk in order._bulk_product_ids:
+                    quantities[pk] += 1
+            decrement_stock(quantities)
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=order.pk, product_id=pk, quantity=1, unit_price=products[pk].price)
+                for _, order in orders for pk in order._bulk_product_ids
+            ])
+            compute_totals([order.pk for _, order in orders])
+            totals = dict(Order.objects.filter(pk__in=[order.pk for _, order in orders]).values_list('pk', 'total_amount'))
+            for _, order in orders:
+                order.total_amount = totals[order.pk]
+            response_cache.invalidate(OrderItem)
+            stats.record_orders([order for _, order in orders])
+            events.record_many(events.ORDER_CREATED, [
+                (order.pk, {'customer_id': order.customer_id}) for _, order in orders
+            ])
+        created.extend(orders)
+    return [instance for _, instance in created], sorted(errors, key=lambda e: e['index'])
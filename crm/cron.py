@@ -1,8 +1,7 @@
 from datetime import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 from gql.transport.exceptions import TransportQueryError
-import sys
+
+from crm import events, graphql_client
 
 def log_crm_heartbeat():
     timestamp = datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
@@ -10,22 +9,15 @@ def log_crm_heartbeat():
     log_entries = [f"{timestamp} CRM is alive"]
     
     try:
-        # Setup GraphQL client with timeout
-        url = "http://localhost:8000/graphql"
-        transport = RequestsHTTPTransport(
-            url=url,
-            timeout=10
-        )
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        
-        # Query the hello field using gql
-        query = gql("""
+        # Query the hello field over HTTP: executing it in-process would
+        # report the endpoint alive while the web server is down.
+        query = """
             query HealthCheck {
                 hello
             }
-        """)
+        """
         
-        result = client.execute(query)
+        result = graphql_client.execute(query, mode='http')
         hello_message = result.get('hello', 'No hello message')
         log_entries.append(f"{timestamp} GraphQL endpoint is responsive - {hello_message}")
         
@@ -38,51 +30,82 @@ def log_crm_heartbeat():
     with open('/tmp/crm_heartbeat_log.txt', 'a') as f:
         f.write("\n".join(log_entries) + "\n")
 
+UPDATE_LOW_STOCK = """
+    mutation UpdateLowStock($productIds: [ID!], $maxBatch: Int = 1000) {
+        updateLowStockProducts(productIds: $productIds, maxBatch: $maxBatch) {
+            success
+            message
+            updatedProducts {
+                id
+                name
+                stock
+            }
+        }
+    }
+"""
+
+# Products restocked per mutation during the full scan.
+RESTOCK_BATCH = 1000
+
+def _restock(product_ids=None):
+    """
+    Run the restock mutation, limited to ``product_ids`` when given (all
+    of them are checked), otherwise for up to ``RESTOCK_BATCH`` products,
+    and return the products it updated. Raises if the mutation failed, so
+    the caller's checkpoint is not moved.
+    """
+    if product_ids is not None:
+        variables = {"productIds": product_ids, "maxBatch": max(len(product_ids), 1)}
+    else:
+        variables = {"maxBatch": RESTOCK_BATCH}
+    result = graphql_client.execute(UPDATE_LOW_STOCK, variables)
+    mutation_data = result.get("updateLowStockProducts") or {}
+    if not mutation_data.get("success", False):
+        raise RuntimeError(mutation_data.get("message", "Mutation was not successful"))
+    return mutation_data.get("updatedProducts") or []
+
 def update_low_stock():
+    """
+    Restock low-stock products. Only products whose stock changed since
+    the last run (per the change log) are checked; the first run, which
+    has no checkpoint yet, checks every product.
+    """
     timestamp = datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
+    consumer = events.Consumer('update_low_stock', [events.STOCK_CHANGED])
+    updated_products = []
     
     try:
-        # Setup GraphQL client
-        url = "http://localhost:8000/graphql"
-        transport = RequestsHTTPTransport(url=url)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        
-        # Define the mutation using gql
-        mutation = gql("""
-            mutation UpdateLowStock {
-                updateLowStockProducts {
-                    success
-                    message
-                    updatedProducts {
-                        id
-                        name
-                        stock
-                    }
-                }
-            }
-        """)
-        
-        # Execute the mutation
-        result = client.execute(mutation)
-        
-        # Process the result
-        mutation_data = result.get("updateLowStockProducts", {})
-        success = mutation_data.get("success", False)
-        message = mutation_data.get("message", "No message returned")
-        updated_products = mutation_data.get("updatedProducts", [])
-        
-        # Build log message
-        log_entries = [f"{timestamp}: {message}"]
+        position = consumer.position()
+        if position is None:
+            # Take the log position before the full scan, so changes made
+            # during it are checked again on the next run.
+            start = events.latest_position()
+            # Each mutation restocks at most RESTOCK_BATCH products; the
+            # scan is complete once one comes back short. Restocked
+            # products are no longer low (increment >= threshold), so
+            # every round makes progress.
+            while True:
+                products = _restock()
+                updated_products.extend(products)
+                if len(products) < RESTOCK_BATCH:
+                    break
+            consumer.commit(start)
+            log_entries = [f"{timestamp}: Full scan, updated {len(updated_products)} low-stock products"]
+        else:
+            changed = consumer.consume(
+                lambda batch: updated_products.extend(_restock(sorted({str(event.object_id) for event in batch})))
+            )
+            log_entries = [
+                f"{timestamp}: {changed} stock changes since event #{position}, "
+                f"updated {len(updated_products)} low-stock products"
+            ]
         
-        if success:
-            if updated_products:
-                log_entries.append("Updated products:")
-                for product in updated_products:
-                    log_entries.append(f"  - {product['name']}: Stock level → {product['stock']}")
-            else:
-                log_entries.append("No products required restocking")
+        if updated_products:
+            log_entries.append("Updated products:")
+            for product in updated_products:
+                log_entries.append(f"  - {product['name']}: Stock level → {product['stock']}")
         else:
-            log_entries.append("Mutation was not successful")
+            log_entries.append("No products required restocking")
         
         # Write to log file
         with open('/tmp/low_stock_updates_log.txt', 'a') as f:
@@ -95,4 +118,4 @@ def update_low_stock():
     except Exception as e:
         error_message = f"{timestamp}: Error in update_low_stock: {str(e)}\n"
         with open('/tmp/low_stock_updates_log.txt', 'a') as f:
-            f.write(error_message)
\ No newline at end of file
+            f.write(error_message)
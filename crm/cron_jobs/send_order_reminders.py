@@ -1,92 +1,292 @@
 #!/usr/bin/env python3
+"""
+Send reminders for recent orders.
+
+New orders are read from the ``order.created`` events of the change log
+(``changeEvents``), grouped per customer and handed to a sender through a
+bounded thread pool; orders older than 7 days are skipped. Events are
+handled one page (``PAGE_SIZE``) at a time, and after each page the
+position of its last event is saved as the checkpoint in ``STATE_FILE``,
+so every run only handles orders it has not seen yet and never rescans
+the order table.
+
+Reminders that fail are kept in ``STATE_FILE`` too and retried at the
+start of the next runs, without holding the checkpoint back. After
+``MAX_ATTEMPTS`` failures a reminder is appended to ``DEAD_LETTER_FILE``
+(one JSON object per line) instead.
+
+Senders (``ORDER_REMINDER_SENDER``, or a dotted path to a class):
+
+* ``file`` appends the reminders to ``OUTBOX_FILE`` (the default);
+* ``smtp`` delivers them to an SMTP server, by default the local debug
+  server started with ``python -m aiosmtpd -n -l localhost:1025``.
+"""
 
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 from gql.transport.exceptions import TransportQueryError
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from importlib import import_module
+from pathlib import Path
+import json
+import os
+import smtplib
 import sys
+import threading
 
-def send_order_reminders():
-    # GraphQL endpoint configuration
-    url = "http://localhost:8000/graphql"
-    
-    try:
-        # Setup GraphQL client
-        transport = RequestsHTTPTransport(
-            url=url,
-            use_json=True,
-            headers={
-                "Content-type": "application/json",
-            }
-        )
-        
-        client = Client(
-            transport=transport,
-            fetch_schema_from_transport=True,
-        )
-        
-        # Calculate date 7 days ago
-        one_week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        
-        # Define GraphQL query
-        query = gql("""
-            query GetRecentOrders($since: String!) {
-                recentOrders(since: $since) {
-                    id
-                    orderDate
-                    customer {
-                        email
-                        name
-                    }
-                    status
+# Run standalone from crontab: make the project importable.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from crm import graphql_client
+
+LOG_FILE = '/tmp/order_reminders_log.txt'
+STATE_FILE = os.environ.get('ORDER_REMINDER_STATE', '/tmp/order_reminders_state.json')
+OUTBOX_FILE = os.environ.get('ORDER_REMINDER_OUTBOX', '/tmp/order_reminders_outbox.txt')
+DEAD_LETTER_FILE = os.environ.get('ORDER_REMINDER_DEAD_LETTERS', '/tmp/order_reminders_dead_letters.jsonl')
+PAGE_SIZE = 100
+MAX_WORKERS = int(os.environ.get('ORDER_REMINDER_WORKERS', 4))
+MAX_ATTEMPTS = int(os.environ.get('ORDER_REMINDER_MAX_ATTEMPTS', 5))
+
+ORDER_EVENTS = """
+    query OrderEvents($after: Int!, $first: Int!) {
+        changeEvents(after: $after, first: $first, kinds: ["order.created"]) {
+            position
+            order {
+                id
+                orderDate
+                totalAmount
+                customer {
+                    email
+                    name
                 }
             }
-        """)
-        
-        # Execute query with variables
-        result = client.execute(query, variable_values={"since": one_week_ago})
-        
-        # Process results
-        orders = result.get('recentOrders', [])
-        
-        # Create log entry
+        }
+    }
+"""
+
+
+class FileSender:
+    """
+    Appends each reminder to a local outbox file.
+    """
+
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, customer, orders):
+        lines = [f"To: {customer['name']} <{customer['email']}>"]
+        lines += [f"  - Order #{order['id']} on {order['orderDate']} ({order['totalAmount']})" for order in orders]
+        with self._lock, open(self.path, 'a') as outbox:
+            outbox.write("\n".join(lines) + "\n")
+
+
+class SMTPSender:
+    """
+    Sends each reminder as an email, one connection per worker thread.
+    """
+
+    def __init__(self, host=None, port=None, sender='crm@localhost'):
+        self.host = host or os.environ.get('ORDER_REMINDER_SMTP_HOST', 'localhost')
+        self.port = int(port or os.environ.get('ORDER_REMINDER_SMTP_PORT', 1025))
+        self.sender = sender
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = smtplib.SMTP(self.host, self.port, timeout=10)
+        return connection
+
+    def send(self, customer, orders):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = customer['email']
+        message['Subject'] = f"Reminder about your {len(orders)} recent order(s)"
+        message.set_content("\n".join(
+            f"Order #{order['id']} placed on {order['orderDate']}" for order in orders
+        ))
+        try:
+            self._connection().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self._local.connection = None
+            self._connection().send_message(message)
+
+
+SENDERS = {
+    'file': FileSender,
+    'smtp': SMTPSender,
+}
+
+
+def get_sender(name=None):
+    name = name or os.environ.get('ORDER_REMINDER_SENDER', 'file')
+    if name in SENDERS:
+        return SENDERS[name]()
+    module, _, attr = name.rpartition('.')
+    return getattr(import_module(module), attr)()
+
+
+def load_state():
+    """
+    Return the checkpoint and the reminders waiting to be retried.
+    """
+    try:
+        with open(STATE_FILE) as state:
+            state = json.load(state)
+        return int(state.get('position') or 0), list(state.get('retries') or [])
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 0, []
+
+
+def save_state(position, retries):
+    tmp = STATE_FILE + '.tmp'
+    with open(tmp, 'w') as state:
+        json.dump({
+            'position': position,
+            'retries': retries,
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }, state)
+    os.replace(tmp, STATE_FILE)
+
+
+def order_batches(since, after=0):
+    """
+    Yield ``(orders, position)`` for each page of events after ``after``:
+    the orders placed since ``since`` and the position of the page's last
+    event. Orders deleted or older than ``since`` are left out, but the
+    position still moves past them.
+    """
+    while True:
+        page = graphql_client.execute(ORDER_EVENTS, {"after": after, "first": PAGE_SIZE})['changeEvents']
+        if not page:
+            return
+        orders = [
+            event['order'] for event in page
+            if event['order'] is not None and datetime.fromisoformat(event['order']['orderDate']) >= since
+        ]
+        after = int(page[-1]['position'])
+        yield orders, after
+        if len(page) < PAGE_SIZE:
+            return
+
+
+def group_by_customer(orders):
+    """
+    Return one reminder ``{'customer': ..., 'orders': [...]}`` per
+    customer with an email address.
+    """
+    reminders = {}
+    for order in orders:
+        customer = order.get('customer') or {}
+        if customer.get('email'):
+            reminders.setdefault(customer['email'], {'customer': customer, 'orders': []})['orders'].append(order)
+    return list(reminders.values())
+
+
+def deliver(sender, reminders, max_workers=MAX_WORKERS):
+    """
+    Send ``reminders`` through a bounded thread pool and return the
+    ``(reminder, error)`` pairs of the failed deliveries.
+    """
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(sender.send, reminder['customer'], reminder['orders']): reminder
+            for reminder in reminders
+        }
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failures.append((futures[future], future.exception()))
+    return failures
+
+
+def reschedule(failures):
+    """
+    Split failed reminders into those to retry on the next run and those
+    that ran out of attempts, counting this failure.
+    """
+    retries, dead = [], []
+    for reminder, error in failures:
+        reminder = {**reminder, 'attempts': reminder.get('attempts', 0) + 1, 'error': str(error)}
+        (dead if reminder['attempts'] >= MAX_ATTEMPTS else retries).append(reminder)
+    return retries, dead
+
+
+def dead_letter(reminders):
+    with open(DEAD_LETTER_FILE, 'a') as dead_letters:
+        for reminder in reminders:
+            dead_letters.write(json.dumps(reminder) + "\n")
+
+
+def describe(reminder):
+    order_ids = ", ".join(f"#{order['id']}" for order in reminder['orders'])
+    return f"{reminder['customer']['email']}: orders {order_ids}"
+
+
+def send_order_reminders():
+    try:
+        # Calculate the start of the 7 day window
+        one_week_ago = datetime.now(timezone.utc) - timedelta(days=7)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entries = [f"{timestamp}: Found {len(orders)} orders from the last 7 days"]
-        
-        for order in orders:
-            order_id = order.get('id', 'Unknown ID')
-            customer_email = order.get('customer', {}).get('email', 'No email')
-            order_date = order.get('orderDate', 'Unknown date')
-            status = order.get('status', 'Unknown status')
-            
-            log_entries.append(
-                f"  - Order #{order_id} ({status}): {customer_email} on {order_date}"
-            )
-        
-        log_entries.append("Order reminders processed successfully!")
-        
+        log_entries = []
+        sender = get_sender()
+        position, waiting = load_state()
+        sent, retries, dead = 0, [], []
+
+        def handle(reminders):
+            nonlocal sent
+            failed, gave_up = reschedule(deliver(sender, reminders))
+            sent += len(reminders) - len(failed) - len(gave_up)
+            retries.extend(failed)
+            dead.extend(gave_up)
+            dead_letter(gave_up)
+
+        # Reminders that failed on earlier runs go first.
+        handle(waiting)
+        save_state(position, retries)
+        for orders, position in order_batches(one_week_ago, after=position):
+            reminders = group_by_customer(orders)
+            log_entries += [f"  - {describe(reminder)}" for reminder in reminders]
+            handle(reminders)
+            save_state(position, retries)
+
+        log_entries.insert(0, (
+            f"{timestamp}: Sent {sent} reminders for orders from the last 7 days "
+            f"({len(waiting)} retried from earlier runs)"
+        ))
+        for reminder in retries + dead:
+            log_entries.append(f"  ! Reminder to {describe(reminder)} failed: {reminder['error']}")
+        if retries:
+            log_entries.append(f"{len(retries)} reminders failed; they will be retried on the next run.")
+        if dead:
+            log_entries.append(f"{len(dead)} reminders gave up after {MAX_ATTEMPTS} attempts, see {DEAD_LETTER_FILE}.")
+        if not retries and not dead:
+            log_entries.append("Order reminders processed successfully!")
+
         # Write to log file
         full_log = "\n".join(log_entries) + "\n"
-        with open('/tmp/order_reminders_log.txt', 'a') as log_file:
+        with open(LOG_FILE, 'a') as log_file:
             log_file.write(full_log)
-        
+
         # Print success message to console
         print("Order reminders processed!")
-        
+
     except TransportQueryError as e:
-        # Handle GraphQL query errors
+        # Handle GraphQL query errors; the pages handled so far are
+        # checkpointed already.
         error_msg = f"{datetime.now()}: GraphQL Query Error: {e.errors}\n"
-        with open('/tmp/order_reminders_log.txt', 'a') as log_file:
+        with open(LOG_FILE, 'a') as log_file:
             log_file.write(error_msg)
         print(f"GraphQL Error: {e.errors}")
-        
+
     except Exception as e:
         # Handle other errors
         error_msg = f"{datetime.now()}: Unexpected error: {str(e)}\n"
-        with open('/tmp/order_reminders_log.txt', 'a') as log_file:
+        with open(LOG_FILE, 'a') as log_file:
             log_file.write(error_msg)
         print(f"Error: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    send_order_reminders()
\ No newline at end of file
+    send_order_reminders()
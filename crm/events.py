@@ -0,0 +1,204 @@
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+
+from . import pubsub
+from .models import ChangeEvent, ChangeLogLock, EventCheckpoint
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = ChangeEvent.ORDER_CREATED
+STOCK_CHANGED = ChangeEvent.STOCK_CHANGED
+
+_pending = ContextVar('crm_change_events', default=None)
+
+
+def get_options():
+    options = {'BATCH_SIZE': 500, 'RETENTION_DAYS': 7}
+    options.update(getattr(settings, 'CRM_EVENT_LOG', None) or {})
+    return options
+
+
+@contextmanager
+def batch():
+    """
+    Collect the events recorded inside the block and insert them with one
+    ``bulk_create`` when it exits without an error. Nested blocks join the
+    outermost one.
+    """
+    if _pending.get() is not None:
+        yield
+        return
+    pending = []
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    if pending:
+        _insert(pending)
+
+
+def record_many(kind, rows):
+    """
+    Append one ``kind`` event per ``(object_id, data)`` pair, in the
+    current ``batch()`` if there is one. Call it inside the transaction
+    that makes the change, so the events commit (or roll back) with it.
+    """
+    events = [ChangeEvent(kind=kind, object_id=object_id, data=data) for object_id, data in rows]
+    pending = _pending.get()
+    if pending is not None:
+        pending.extend(events)
+    elif events:
+        _insert(events)
+
+
+def _insert(events):
+    # Appenders take no shared lock: IDs are handed out on insert but
+    # transactions commit in any order, so readers go by the position
+    # assigned after the commit instead.
+    with transaction.atomic():
+        ChangeEvent.objects.bulk_create(events, batch_size=get_options()['BATCH_SIZE'])
+        transaction.on_commit(partial(_committed, events))
+
+
+def _committed(events):
+    try:
+        assign_positions()
+    except Exception:
+        # The events are committed; the next appender or consumer run
+        # positions them.
+        logger.exception("Could not assign change log positions")
+        return
+    _publish(events)
+
+
+def assign_positions():
+    """
+    Give the committed events that have no position yet the next ones, in
+    ID order, and return how many were positioned.
+
+    Runs in its own short transaction under the ``ChangeLogLock`` row, so
+    positions become visible in increasing order: a reader that sees a
+    position also sees every lower one that will ever exist. Only this
+    update is serialised, not the transactions that append events.
+    """
+    with transaction.atomic():
+        ChangeLogLock.objects.select_for_update().get_or_create(pk=1)
+        pending = ChangeEvent.objects.filter(position=None)
+        bounds = pending.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            return 0
+        # position = id + offset keeps the ID order and follows the last
+        # position handed out; without late commits it is the ID itself.
+        offset = max(0, latest_position() - bounds['first'] + 1)
+        return pending.filter(id__range=(bounds['first'], bounds['last'])).update(position=F('id') + offset)
+
+
+def _publish(events):
+    """
+    Push committed events to the subscriptions (``crm.pubsub``), one
+    message per kind.
+    """
+    positions = dict(
+        ChangeEvent.objects.filter(pk__in=[event.pk for event in events]).values_list('pk', 'position')
+    )
+    messages = defaultdict(list)
+    for event in events:
+        messages[event.kind].append({
+            'id': event.pk, 'position': positions.get(event.pk),
+            'object_id': event.object_id, 'data': event.data,
+        })
+    for kind, rows in messages.items():
+        pubsub.publish(kind, {'events': rows})
+
+
+def record(kind, object_id, **data):
+    record_many(kind, [(object_id, data)])
+
+
+def latest_position():
+    return ChangeEvent.objects.aggregate(position=Max('position'))['position'] or 0
+
+
+def read(kinds=None, after=0, limit=None, until=None):
+    """
+    Positioned events after position ``after`` (and up to ``until``),
+    oldest first. Positions become visible in increasing order (see
+    ``assign_positions``), so an event can never turn up below a
+    checkpoint taken from what is visible now.
+    """
+    options = get_options()
+    events = ChangeEvent.objects.filter(position__gt=after)
+    if kinds:
+        events = events.filter(kind__in=kinds)
+    if until is not None:
+        events = events.filter(position__lte=until)
+    return list(events.order_by('position')[:limit or options['BATCH_SIZE']])
+
+
+class Consumer:
+    """
+    A named reader of the change log that checkpoints the last position it
+    processed, so each run only sees events recorded since the previous
+    one. Delivery is at least once: a handler that fails leaves the
+    checkpoint where it was and its batch is read again.
+    """
+
+    def __init__(self, name, kinds):
+        self.name = name
+        self.kinds = kinds
+
+    def position(self):
+        """
+        The checkpoint, or ``None`` for a consumer that has never run and
+        has to start from a full scan.
+        """
+        return EventCheckpoint.objects.filter(consumer=self.name).values_list('position', flat=True).first()
+
+    def commit(self, position):
+        EventCheckpoint.objects.update_or_create(consumer=self.name, defaults={'position': position})
+
+    def consume(self, handler, batch_size=None):
+        """
+        Call ``handler`` with every batch of pending events and move the
+        checkpoint after each one. Events recorded while the run is in
+        progress (including by the handler itself) are left for the next
+        run. Returns the number of events handled.
+        """
+        # Position whatever a failed post-commit hook left behind.
+        assign_positions()
+        position = self.position() or 0
+        until = latest_position()
+        handled = 0
+        while True:
+            events = read(self.kinds, after=position, limit=batch_size, until=until)
+            if not events:
+                return handled
+            handler(events)
+            position = events[-1].position
+            self.commit(position)
+            handled += len(events)
+
+
+def prune(now=None):
+    """
+    Delete events older than ``RETENTION_DAYS`` that every consumer has
+    processed. Returns the number of events deleted.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=get_options()['RETENTION_DAYS'])
+    events = ChangeEvent.objects.filter(created_at__lt=cutoff)
+    slowest = EventCheckpoint.objects.aggregate(position=Min('position'))['position']
+    if slowest is not None:
+        events = events.filter(position__lte=slowest)
+    deleted, _ = events.delete()
+    return deleted
@@ -0,0 +1,178 @@
+import csv
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import HttpResponseNotFound, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from graphene.utils.str_converters import to_snake_case
+
+from .filters import CustomerFilter, OrderFilter
+from .models import Customer, Order, Product
+from .routers import read_alias
+
+DEFAULT_CHUNK_SIZE = 2000
+MAX_CHUNK_SIZE = 10000
+# Rows are encoded into buffers of roughly this size before being handed
+# to the server, instead of one write per row.
+FLUSH_BYTES = 64 * 1024
+
+
+class CustomerExport:
+    filterset_class = CustomerFilter
+    columns = ['id', 'name', 'email', 'phone', 'created_at']
+    distinct_filters = ()
+
+    def get_queryset(self):
+        return Customer.objects.only(*self.columns).order_by('pk')
+
+    def row(self, customer):
+        return [customer.id, customer.name, customer.email, customer.phone, customer.created_at]
+
+
+class OrderExport:
+    filterset_class = OrderFilter
+    columns = ['id', 'order_date', 'total_amount', 'customer_id', 'customer_name', 'customer_email', 'products']
+    # Filters joining the M2M table, which can repeat an order.
+    distinct_filters = ('product_name', 'product_id')
+
+    def get_queryset(self):
+        # With chunk_size, iterator() runs the prefetch once per chunk.
+        return (
+            Order.objects.select_related('customer')
+            .only('id', 'order_date', 'total_amount', 'customer__id', 'customer__name', 'customer__email')
+            .prefetch_related(Prefetch('products', queryset=Product.objects.only('id', 'name').order_by('pk')))
+            .order_by('pk')
+        )
+
+    def row(self, order):
+        return [
+            order.id,
+            order.order_date,
+            order.total_amount,
+            order.customer.id,
+            order.customer.name,
+            order.customer.email,
+            [product.name for product in order.products.all()],
+        ]
+
+
+EXPORTS = {
+    'customers': CustomerExport,
+    'orders': OrderExport,
+}
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ';'.join(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def ndjson_lines(columns, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+def buffered(lines, flush_bytes=FLUSH_BYTES):
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= flush_bytes:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', csv_lines),
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+}
+
+
+def _filter_params(query_params):
+    # Accept both the GraphQL (camelCase) and filter set (snake_case) names.
+    return {to_snake_case(key): value for key, value in query_params.items()}
+
+
+@require_GET
+def export_view(request, resource):
+    """
+    Stream every ``customers`` or ``orders`` row matching the filter set
+    arguments given in the query string as CSV or NDJSON (``format``).
+
+    Rows are read through ``iterator(chunk_size)``, so memory stays flat
+    regardless of the result size. ``gzip=1`` compresses the stream, with
+    ``Content-Encoding`` when the client accepts it and as a ``.gz``
+    attachment otherwise.
+    """
+    export_class = EXPORTS.get(resource)
+    if export_class is None:
+        return HttpResponseNotFound()
+    export = export_class()
+
+    params = _filter_params(request.GET)
+    output_format = params.pop('format', 'ndjson')
+    compress = params.pop('gzip', '') in ('1', 'true')
+    if output_format not in FORMATS:
+        return JsonResponse({'errors': {'format': [f"Choose one of {', '.join(FORMATS)}."]}}, status=400)
+    try:
+        chunk_size = min(int(params.pop('chunk_size', DEFAULT_CHUNK_SIZE)), MAX_CHUNK_SIZE)
+    except ValueError:
+        return JsonResponse({'errors': {'chunk_size': ["Enter a whole number."]}}, status=400)
+    if chunk_size < 1:
+        return JsonResponse({'errors': {'chunk_size': ["Must be positive."]}}, status=400)
+
+    # Rows are streamed after the view returns, outside any read_replica()
+    # block, so the replica is chosen here.
+    queryset = export.get_queryset().using(read_alias())
+    filterset = export.filterset_class(params, queryset=queryset)
+    if not filterset.is_valid():
+        return JsonResponse({'errors': filterset.errors.get_json_data()}, status=400)
+    queryset = filterset.qs
+    if any(params.get(name) for name in export.distinct_filters):
+        queryset = queryset.distinct()
+
+    content_type, encode = FORMATS[output_format]
+    rows = (export.row(instance) for instance in queryset.iterator(chunk_size=chunk_size))
+    stream = buffered(encode(export.columns, rows))
+    filename = f'{resource}.{output_format}'
+
+    if compress:
+        stream = gzipped(stream)
+        if 'gzip' not in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            content_type, filename = 'application/gzip', filename + '.gz'
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if compress and content_type != 'application/gzip':
+        response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,292 @@
+import base64
+import json
+from datetime import datetime
+from functools import partial
+
+import graphene
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from graphene.relay.connection import PageInfo, connection_adapter, page_info_adapter
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql_relay import connection_from_array_slice, cursor_to_offset, get_offset_with_default, offset_to_cursor
+
+from .optimizer import optimize_queryset
+
+
+def is_async(info):
+    """
+    Whether the current request is executed by the async GraphQL view,
+    in which case resolvers must not touch the database synchronously.
+    """
+    return getattr(info.context, 'graphql_async', False)
+
+
+def _check_pagination_args(args, info, max_limit, enforce_first_or_last):
+    # Same checks DjangoConnectionField.connection_resolver applies.
+    first, last = args.get('first'), args.get('last')
+    if enforce_first_or_last:
+        assert first or last, (
+            "You must provide a `first` or `last` value to properly paginate the `{}` connection."
+        ).format(info.field_name)
+    if max_limit:
+        if first:
+            assert first <= max_limit, (
+                "Requesting {} records on the `{}` connection exceeds the `first` limit of {} records."
+            ).format(first, info.field_name, max_limit)
+        if last:
+            assert last <= max_limit, (
+                "Requesting {} records on the `{}` connection exceeds the `last` limit of {} records."
+            ).format(last, info.field_name, max_limit)
+    if args.get('offset') is not None:
+        assert args.get('before') is None, (
+            "You can't provide a `before` value at the same time as an `offset` value to properly paginate the `{}` connection."
+        ).format(info.field_name)
+
+
+def _slice_bounds(args, array_length, max_limit):
+    """
+    Compute the ``[start, end)`` rows of the page the relay arguments
+    select, so only that slice has to be fetched.
+    """
+    offset = args.pop('offset', None)
+    if offset:
+        after = args.get('after')
+        if after:
+            offset += cursor_to_offset(after) + 1
+        args['after'] = offset_to_cursor(offset - 1)
+    if max_limit is not None and args.get('first') is None and args.get('last') is None:
+        args['first'] = max_limit
+
+    start = max(get_offset_with_default(args.get('after'), -1) + 1, 0)
+    end = min(array_length, get_offset_with_default(args.get('before'), array_length))
+    if isinstance(args.get('first'), int):
+        end = min(end, start + args['first'])
+    if isinstance(args.get('last'), int):
+        start = max(start, end - args['last'])
+    return start, max(start, end)
+
+
+class CountableConnection(graphene.relay.Connection):
+    """
+    Relay connection with an opt-in ``totalCount``. The count is only run
+    when the client selects the field and the resolver has not already
+    computed it.
+    """
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(self, info):
+        if getattr(self, 'length', None) is not None:
+            return self.length
+        if is_async(info):
+            return self.iterable.acount()
+        return self.iterable.count()
+
+
+class BatchedConnectionField(DjangoFilterConnectionField):
+    """
+    Filter connection field that trims the queryset to the client's
+    selection set and hands every node of the resolved page to the node
+    type's ``prime_loaders`` hook, so nested relations of the whole page
+    are fetched in one batch instead of once per edge.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        queryset = super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+        return optimize_queryset(queryset, info)
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                            max_limit, enforce_first_or_last, root, info, **args):
+        if is_async(info):
+            return cls.aconnection_resolver(
+                resolver, connection, default_manager, queryset_resolver,
+                max_limit, enforce_first_or_last, root, info, **args
+            )
+        result = super().connection_resolver(
+            resolver, connection, default_manager, queryset_resolver,
+            max_limit, enforce_first_or_last, root, info, **args
+        )
+        cls.prime_loaders(connection, result, info)
+        return result
+
+    @classmethod
+    async def aconnection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                                   max_limit, enforce_first_or_last, root, info, **args):
+        """
+        Async counterpart of ``connection_resolver``: building the filtered
+        queryset touches no database, and the count and page rows are read
+        with ``acount()`` and async iteration.
+        """
+        _check_pagination_args(args, info, max_limit, enforce_first_or_last)
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = default_manager
+        queryset = queryset_resolver(connection, iterable, info, args)
+        result = await cls.aresolve_connection(connection, args, queryset, max_limit=max_limit)
+        cls.prime_loaders(connection, result, info)
+        return result
+
+    @classmethod
+    async def aresolve_connection(cls, connection, args, iterable, max_limit=None):
+        array_length = await iterable.acount()
+        start, end = _slice_bounds(args, array_length, max_limit)
+        rows = [row async for row in iterable[start:end]]
+        result = connection_from_array_slice(
+            rows,
+            args,
+            slice_start=start,
+            array_length=array_length,
+            array_slice_length=len(rows),
+            connection_type=partial(connection_adapter, connection),
+            edge_type=connection.Edge,
+            page_info_type=page_info_adapter,
+        )
+        result.iterable = iterable
+        result.length = array_length
+        return result
+
+    @classmethod
+    def prime_loaders(cls, connection, result, info):
+        prime_loaders = getattr(connection._meta.node, 'prime_loaders', None)
+        if prime_loaders is not None:
+            prime_loaders([edge.node for edge in result.edges], info)
+
+
+def encode_keyset_cursor(values):
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(f'keyset:{payload}'.encode()).decode()
+
+
+def decode_keyset_cursor(cursor, fields):
+    try:
+        prefix, payload = base64.urlsafe_b64decode(cursor.encode()).decode().split(':', 1)
+        values = json.loads(payload)
+        if prefix != 'keyset' or not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [
+            datetime.fromisoformat(value) if field.get_internal_type() == 'DateTimeField' else field.to_python(value)
+            for field, value in zip(fields, values)
+        ]
+    except (ValueError, TypeError, ValidationError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _after(names, values, descending=False):
+    """
+    Build the row comparison ``(a, id) > (x, y)`` as
+    ``a >= x AND (a > x OR id > y)``, which keeps a sargable range bound
+    on the leading column.
+    """
+    gt, gte = ('lt', 'lte') if descending else ('gt', 'gte')
+    (column, tiebreak), (value, tiebreak_value) = names, values
+    return Q(**{f'{column}__{gte}': value}) & (
+        Q(**{f'{column}__{gt}': value}) | Q(**{f'{tiebreak}__{gt}': tiebreak_value})
+    )
+
+
+class KeysetConnectionField(BatchedConnectionField):
+    """
+    Connection field paginated on an indexed ``(column, id)`` key instead
+    of an offset, so page N costs the same as page 1. Cursors encode the
+    key of the edge, and ``totalCount`` is only computed when selected.
+    """
+
+    def __init__(self, *args, keyset=('created_at', 'id'), **kwargs):
+        assert len(keyset) == 2, "keyset must be a (column, unique tiebreaker) pair"
+        self.keyset = tuple(keyset)
+        super().__init__(*args, **kwargs)
+        # Offsets are what keyset pagination replaces.
+        self._base_args.pop('offset', None)
+
+    @property
+    def filtering_args(self):
+        # Pages are ordered by the key, which would throw away the order
+        # of filters that rank their results (e.g. search): leave those out.
+        ordering = getattr(self.filterset_class, 'ordering_filters', ())
+        return {name: arg for name, arg in super().filtering_args.items() if name not in ordering}
+
+    def get_queryset_resolver(self):
+        return partial(super().get_queryset_resolver(), keyset=self.keyset)
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class, keyset):
+        queryset = super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+        immediate, defer = queryset.query.deferred_loading
+        if immediate and not defer:
+            # The cursor is built from the key columns, so never defer them.
+            queryset = queryset.only(*immediate, *keyset)
+        return queryset.order_by(*keyset)
+
+    @classmethod
+    def keyset_page(cls, args, iterable, max_limit=None):
+        """
+        Return the queryset slice holding the requested page plus one
+        look-ahead row, together with what ``keyset_connection`` needs to
+        turn the fetched rows into a connection.
+        """
+        names = [name.lstrip('-') for name in iterable.query.order_by]
+        fields = [iterable.model._meta.get_field(name) for name in names]
+        first, last = args.get('first'), args.get('last')
+        after, before = args.get('after'), args.get('before')
+        if first is None and last is None:
+            first = max_limit or 100
+
+        page = iterable
+        if after:
+            page = page.filter(_after(names, decode_keyset_cursor(after, fields)))
+        if before:
+            page = page.filter(_after(names, decode_keyset_cursor(before, fields), descending=True))
+
+        backwards = last is not None and first is None
+        limit = last if backwards else first
+        if backwards:
+            page = page.reverse()
+        return page[:limit + 1], (fields, limit, backwards)
+
+    @classmethod
+    def keyset_connection(cls, connection, args, iterable, rows, page_spec):
+        fields, limit, backwards = page_spec
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows = rows[::-1]
+            has_next, has_previous = bool(args.get('before')), has_more
+        else:
+            has_next, has_previous = has_more, bool(args.get('after'))
+
+        edges = [
+            connection.Edge(node=row, cursor=encode_keyset_cursor([getattr(row, f.attname) for f in fields]))
+            for row in rows
+        ]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous,
+                has_next_page=has_next,
+            ),
+        )
+        result.iterable = iterable
+        result.length = None
+        return result
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        page, page_spec = cls.keyset_page(args, iterable, max_limit)
+        return cls.keyset_connection(connection, args, iterable, list(page), page_spec)
+
+    @classmethod
+    async def aresolve_connection(cls, connection, args, iterable, max_limit=None):
+        page, page_spec = cls.keyset_page(args, iterable, max_limit)
+        rows = [row async for row in page]
+        return cls.keyset_connection(connection, args, iterable, rows, page_spec)
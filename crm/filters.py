@@ -1,5 +1,8 @@
 import django_filters
-from .models import Customer, Product, Order
+from django.db.models import Q
+
+from .models import Customer, Product, Order, OrderItem
+from .search import matching_ids, search
 
 class CustomerFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(lookup_expr='icontains')
@@ -7,11 +10,21 @@ class CustomerFilter(django_filters.FilterSet):
     created_at_gte = django_filters.DateFilter(field_name='created_at', lookup_expr='gte')
     created_at_lte = django_filters.DateFilter(field_name='created_at', lookup_expr='lte')
     phone_pattern = django_filters.CharFilter(method='filter_phone_pattern')
+    search = django_filters.CharFilter(method='filter_search')
+
+    # Filters that order the results; keyset connections leave them out.
+    ordering_filters = ['search']
 
     class Meta:
         model = Customer
         fields = ['name', 'email', 'created_at']
 
+    def filter_search(self, queryset, name, value):
+        """
+        Full-text prefix search over name and email, ranked by relevance
+        """
+        return search(queryset, value)
+
     def filter_phone_pattern(self, queryset, name, value):
         """
         Custom filter for phone numbers starting with specific pattern
@@ -25,11 +38,21 @@ class ProductFilter(django_filters.FilterSet):
     stock_gte = django_filters.NumberFilter(field_name='stock', lookup_expr='gte')
     stock_lte = django_filters.NumberFilter(field_name='stock', lookup_expr='lte')
     low_stock = django_filters.BooleanFilter(method='filter_low_stock')
+    search = django_filters.CharFilter(method='filter_search')
+
+    # Filters that order the results; keyset connections leave them out.
+    ordering_filters = ['search']
 
     class Meta:
         model = Product
         fields = ['name', 'price', 'stock']
 
+    def filter_search(self, queryset, name, value):
+        """
+        Full-text prefix search over the product name, ranked by relevance
+        """
+        return search(queryset, value)
+
     def filter_low_stock(self, queryset, name, value):
         """
         Filter products with low stock (stock < 10)
@@ -46,7 +69,20 @@ class OrderFilter(django_filters.FilterSet):
     customer_name = django_filters.CharFilter(field_name='customer__name', lookup_expr='icontains')
     product_name = django_filters.CharFilter(field_name='products__name', lookup_expr='icontains')
     product_id = django_filters.NumberFilter(field_name='products__id')
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Order
-        fields = ['total_amount', 'order_date']
\ No newline at end of file
+        fields = ['total_amount', 'order_date']
+
+    def filter_search(self, queryset, name, value):
+        """
+        Orders whose customer or one of whose products matches the search
+        index. Orders are not ranked; they keep the connection's ordering.
+        """
+        customers = matching_ids(Customer, value, queryset.db)
+        products = matching_ids(Product, value, queryset.db)
+        return queryset.filter(
+            Q(customer_id__in=customers)
+            | Q(pk__in=OrderItem.objects.filter(product_id__in=products).values('order_id'))
+        )
@@ -0,0 +1,162 @@
+"""
+Shared GraphQL client for the cron jobs and Celery tasks.
+
+Two modes are available:
+
+* ``http`` talks to the GraphQL endpoint through one long-lived
+  ``requests`` session per process (pooled, with retries). Documents are
+  validated against the SDL in ``crm/schema.graphql`` instead of an
+  introspection query on every run.
+* ``local`` executes against ``alx_backend_graphql.schema.schema`` in the
+  current process, skipping HTTP entirely. ``auto`` (the default) picks
+  it whenever Django is set up, i.e. inside manage.py commands and
+  Celery workers (including the beat-scheduled former cron jobs).
+
+Callers that exist to exercise the endpoint itself, such as the
+heartbeat, pass ``mode='http'``.
+
+Regenerate the SDL whenever the schema changes::
+
+    python manage.py graphql_schema --schema alx_backend_graphql.schema.schema --out crm/schema.graphql
+"""
+import threading
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+
+from gql import Client, gql
+from gql.transport.exceptions import TransportQueryError
+from gql.transport.requests import RequestsHTTPTransport
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SCHEMA_PATH = Path(__file__).with_name('schema.graphql')
+
+DEFAULTS = {
+    'MODE': 'auto',
+    'URL': 'http://localhost:8000/graphql',
+    'TIMEOUT': 10,
+    'POOL_SIZE': 4,
+    'RETRIES': 3,
+}
+
+
+def get_client_settings():
+    from django.conf import settings
+
+    options = dict(DEFAULTS)
+    if settings.configured:
+        options.update(getattr(settings, 'CRM_GRAPHQL_CLIENT', None) or {})
+    return options
+
+
+def django_is_ready():
+    from django.apps import apps
+
+    return apps.ready
+
+
+@lru_cache(maxsize=64)
+def _parse(query):
+    return gql(query)
+
+
+class HTTPClient:
+    """
+    gql client over a persistent, pooled ``requests`` session, validating
+    documents against the local SDL.
+    """
+
+    def __init__(self, url, timeout=10, pool_size=4, retries=3, schema_path=SCHEMA_PATH):
+        self.transport = RequestsHTTPTransport(url=url, timeout=timeout)
+        self.client = Client(schema=Path(schema_path).read_text(), transport=self.transport)
+        self.pool_size = pool_size
+        self.retries = retries
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = self.client.connect_sync()
+                # Failed connections are retried for every request, since
+                # nothing was sent. 502/503/504 responses only for urllib3's
+                # idempotent methods: documents are POSTed, and a mutation
+                # may have committed before the gateway gave up.
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    max_retries=Retry(total=self.retries, backoff_factor=0.1, status_forcelist=(502, 503, 504)),
+                )
+                self.transport.session.mount('http://', adapter)
+                self.transport.session.mount('https://', adapter)
+            return self._session
+
+    def execute(self, query, variables=None):
+        return self.session().execute(_parse(query), variable_values=variables)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self.client.close_sync()
+                self._session = None
+
+
+class LocalClient:
+    """
+    Executes documents against the project schema in this process.
+    Errors are raised as ``TransportQueryError`` like in HTTP mode.
+    """
+
+    def __init__(self, schema=None):
+        if schema is None:
+            from alx_backend_graphql.schema import schema
+        self.schema = schema
+
+    def execute(self, query, variables=None):
+        # A fresh context per call, so loaders do not outlive the operation.
+        result = self.schema.execute(query, variable_values=variables, context_value=SimpleNamespace())
+        if result.errors:
+            errors = [error.formatted for error in result.errors]
+            raise TransportQueryError(str(errors[0]), errors=errors, data=result.data)
+        return result.data
+
+    def close(self):
+        pass
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(mode=None):
+    """
+    Return the process-wide client for ``mode`` (``http``, ``local`` or
+    ``auto``), by default the mode configured by ``CRM_GRAPHQL_CLIENT``.
+    """
+    options = get_client_settings()
+    mode = mode or options['MODE']
+    if mode == 'auto':
+        mode = 'local' if django_is_ready() else 'http'
+    with _lock:
+        client = _clients.get(mode)
+        if client is None:
+            if mode == 'local':
+                client = LocalClient()
+            else:
+                client = HTTPClient(
+                    options['URL'],
+                    timeout=options['TIMEOUT'],
+                    pool_size=options['POOL_SIZE'],
+                    retries=options['RETRIES'],
+                )
+            _clients[mode] = client
+        return client
+
+
+def execute(query, variables=None, mode=None):
+    """
+    Execute ``query`` with the shared client for ``mode`` and return its
+    data. GraphQL errors raise ``TransportQueryError`` in both modes.
+    """
+    return get_client(mode).execute(query, variables)
@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+from django.db.models import F
+
+from .models import Customer, Order, Product
+
+
+class BatchLoader:
+    """
+    Synchronous, per-request DataLoader.
+
+    Keys are queued with ``register`` (usually for every node on a
+    connection page) and the first ``load`` that misses the cache fetches
+    all queued keys with a single call to ``batch_load_fn``.
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._queue = set()
+
+    def register(self, keys):
+        self._queue.update(key for key in keys if key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+        self._queue.discard(key)
+
+    def load(self, key):
+        if key not in self._cache:
+            self._queue.add(key)
+            self.dispatch()
+        return self._cache[key]
+
+    def load_many(self, keys):
+        self.register(keys)
+        return [self.load(key) for key in keys]
+
+    def dispatch(self):
+        keys, self._queue = list(self._queue), set()
+        if not keys:
+            return
+        results = self.batch_load_fn(keys)
+        for key in keys:
+            if key in results:
+                self._cache[key] = results[key]
+            else:
+                self._cache[key] = self.default() if callable(self.default) else self.default
+
+
+class Loaders:
+    """
+    The loaders shared by every resolver of one GraphQL request.
+    """
+
+    def __init__(self):
+        self.customer = BatchLoader(self._load_customers)
+        self.products_by_order = BatchLoader(self._load_products_by_order, default=list)
+        self.orders_by_customer = BatchLoader(self._load_orders_by_customer, default=list)
+
+    def prime_customers(self, customers):
+        for customer in customers:
+            self.customer.prime(customer.pk, customer)
+        self.orders_by_customer.register(customer.pk for customer in customers)
+
+    def prime_orders(self, orders):
+        for order in orders:
+            if Order.customer.is_cached(order):
+                self.customer.prime(order.customer_id, order.customer)
+        self.customer.register(order.customer_id for order in orders)
+        self.products_by_order.register(order.pk for order in orders)
+
+    def _load_customers(self, ids):
+        return Customer.objects.in_bulk(ids)
+
+    def _load_products_by_order(self, order_ids):
+        grouped = defaultdict(list)
+        products = (
+            Product.objects.filter(orders__id__in=order_ids)
+            .annotate(order_key=F('orders__id'))
+            .order_by('id')
+        )
+        for product in products:
+            grouped[product.order_key].append(product)
+        return grouped
+
+    def _load_orders_by_customer(self, customer_ids):
+        grouped = defaultdict(list)
+        orders = list(Order.objects.filter(customer_id__in=customer_ids).order_by('id'))
+        for order in orders:
+            grouped[order.customer_id].append(order)
+        self.prime_orders(orders)
+        return grouped
+
+
+def get_loaders(info):
+    """
+    Return the loaders attached to the current request, creating them on
+    first use. Without a context object every call gets fresh loaders.
+    """
+    context = info.context
+    if context is None:
+        return Loaders()
+    loaders = getattr(context, 'crm_loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.crm_loaders = loaders
+    return loaders
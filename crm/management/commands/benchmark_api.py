@@ -0,0 +1,170 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from crm import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the GraphQL hot paths against seeded datasets in a throwaway "
+        "test database, write the results as JSON and optionally compare them "
+        "with a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', choices=list(benchmarks.SIZES), default=['small', 'medium', 'large'],
+        )
+        parser.add_argument('--scenarios', nargs='+', help="Only run these scenarios")
+        parser.add_argument(
+            '--reports', action='store_true',
+            help="Also time the weekly report variants (use with --sizes orders-1m)",
+        )
+        parser.add_argument(
+            '--restock', action='store_true',
+            help="Also time the per-row and set-based restock (use with --sizes products-500k)",
+        )
+        parser.add_argument(
+            '--indexes', action='store_true',
+            help="Also run the scenarios without the filter indexes (use with --sizes filters-1m)",
+        )
+        parser.add_argument(
+            '--load', nargs='+', type=int, metavar='CLIENTS',
+            help="Also compare WSGI and ASGI throughput of the read scenarios at these client counts",
+        )
+        parser.add_argument('--load-requests', type=int, default=2000, help="Requests per load run")
+        parser.add_argument('--report-repeat', type=int, default=3, help="Repeat of --reports and --restock")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', metavar='BASELINE', help="Compare with a previous results file")
+        parser.add_argument(
+            '--input', help="Compare this results file with --compare instead of running the suite",
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help="Median latency increase (fraction) reported as a regression",
+        )
+
+    def handle(self, *args, **options):
+        if options['input'] and not options['compare']:
+            raise CommandError("--input needs --compare")
+        if options['repeat'] < 1 or options['report_repeat'] < 1:
+            raise CommandError("--repeat and --report-repeat must be at least 1")
+
+        if options['input']:
+            results = self.load(options['input'])
+        else:
+            results = self.run(options)
+            if options['output']:
+                with open(options['output'], 'w') as output:
+                    json.dump(results, output, indent=2)
+                self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            self.report_comparison(self.load(options['compare']), results, options['threshold'])
+
+    def load(self, path):
+        try:
+            with open(path) as results:
+                return json.load(results)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+    def run(self, options):
+        scenarios = benchmarks.get_scenarios(options['seed'])
+        if options['scenarios']:
+            unknown = set(options['scenarios']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenarios']]
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'environment': benchmarks.environment(),
+            'options': {key: options[key] for key in ('repeat', 'warmup', 'seed')},
+            'sizes': {size: benchmarks.SIZES[size] for size in options['sizes']},
+            'results': {},
+        }
+        # Never touch the configured database: seed and measure in a test one.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Cached responses would measure the cache, not the resolvers.
+            with override_settings(GRAPHQL_RESPONSE_CACHE={'ENABLED': False}):
+                for size in options['sizes']:
+                    self.stdout.write(f"Seeding {size} dataset...")
+                    call_command(
+                        'seed_crm', clear=True, seed=options['seed'], stdout=StringIO(),
+                        **benchmarks.SIZES[size],
+                    )
+                    results['results'][size] = {}
+                    if options['indexes']:
+                        with benchmarks.without_filter_indexes():
+                            self.run_scenarios(scenarios, options, results['results'][size], ' (no indexes)')
+                    self.run_scenarios(scenarios, options, results['results'][size])
+                    for scenario in scenarios if options['load'] else ():
+                        if scenario.mutation:
+                            continue
+                        for concurrency in options['load']:
+                            for server in benchmarks.LOAD_SERVERS:
+                                name = f'{scenario.name}.{server}@{concurrency}'
+                                try:
+                                    result = benchmarks.run_load(
+                                        scenario, server, concurrency, options['load_requests']
+                                    )
+                                except benchmarks.BenchmarkError as e:
+                                    raise CommandError(str(e))
+                                results['results'][size][name] = result
+                                self.stdout.write(
+                                    f"  {name:<40} {result['requests_per_second']:>9.1f} req/s  "
+                                    f"median {result['median_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms"
+                                )
+                    if options['reports']:
+                        for name in benchmarks.REPORT_VARIANTS:
+                            result = benchmarks.run_report(name, options['report_repeat'])
+                            results['results'][size][name] = result
+                            self.write_result(name, result)
+                    if options['restock']:
+                        for name in benchmarks.RESTOCK_VARIANTS:
+                            result = benchmarks.run_restock(name, options['report_repeat'])
+                            results['results'][size][name] = result
+                            self.write_result(name, result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        return results
+
+    def run_scenarios(self, scenarios, options, results, suffix=''):
+        for scenario in scenarios:
+            try:
+                result = benchmarks.run_scenario(scenario, options['repeat'], options['warmup'])
+            except benchmarks.BenchmarkError as e:
+                raise CommandError(str(e))
+            results[scenario.name + suffix] = result
+            self.write_result(scenario.name + suffix, result)
+
+    def write_result(self, name, result):
+        self.stdout.write(
+            f"  {name:<40} median {result['median_ms']:>9.2f} ms  "
+            f"p95 {result['p95_ms']:>9.2f} ms  sql {result['sql_queries']}"
+        )
+
+    def report_comparison(self, baseline, current, threshold):
+        rows, regressions = benchmarks.compare(baseline, current, threshold)
+        for size, name, before, after, change, sql_before, sql_after, regressed in rows:
+            line = (
+                f"{size:<7} {name:<40} {before:>9.2f} -> {after:>9.2f} ms ({change:+.1%})  "
+                f"sql {sql_before} -> {sql_after}"
+            )
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) against the baseline")
+        self.stdout.write(self.style.SUCCESS(f"No regressions in {len(rows)} comparisons"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from crm import stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the CRM stats counters and daily buckets from the source tables"
+
+    def handle(self, *args, **options):
+        days = stats.rebuild()
+        totals = stats.get_totals()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {days} daily buckets: {totals['customers']} customers, "
+            f"{totals['orders']} orders, {totals['revenue']:.2f} revenue"
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from crm import routers
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary database into the replica aliases of "
+        "CRM_DATABASE_ROUTING (the local stand-in for replication)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help="Replica aliases to refresh (default: all READ_ALIASES)")
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or routers.get_options()['READ_ALIASES']
+        if not aliases:
+            raise CommandError("No replica aliases configured in CRM_DATABASE_ROUTING['READ_ALIASES']")
+        source = connections[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            if alias not in connections.settings:
+                raise CommandError(f"Unknown database alias {alias!r}")
+            target = connections[alias]
+            if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+                raise CommandError("sync_replica only copies SQLite files; real replicas are fed by the database server")
+            source.ensure_connection()
+            target.ensure_connection()
+            # The online backup API copies a consistent snapshot, even
+            # while the primary is being written to.
+            source.connection.backup(target.connection)
+            self.stdout.write(self.style.SUCCESS(f"Copied {source.settings_dict['NAME']} to {alias}"))
@@ -0,0 +1,47 @@
+import asyncio
+from contextlib import aclosing
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from crm import events, pubsub
+from crm.cron import _restock
+from crm.schema import LOW_STOCK_THRESHOLD
+
+
+class Command(BaseCommand):
+    help = (
+        "Restock products as soon as a committed stock change leaves them below "
+        "the low-stock threshold, instead of waiting for the update-low-stock beat job"
+    )
+
+    def handle(self, *args, **options):
+        if pubsub.get_options()['BACKEND'] != 'redis':
+            self.stderr.write(self.style.WARNING(
+                "GRAPHQL_SUBSCRIPTIONS['BACKEND'] is not 'redis': only stock changes "
+                "made by this process would be seen."
+            ))
+        try:
+            asyncio.run(self.watch())
+        except KeyboardInterrupt:
+            pass
+
+    async def watch(self):
+        async with aclosing(pubsub.listen(events.STOCK_CHANGED)) as messages:
+            async for message in messages:
+                ids = set()
+                for event in message['events']:
+                    stock = event['data'].get('stock')
+                    if stock is None or stock < LOW_STOCK_THRESHOLD:
+                        ids.add(str(event['object_id']))
+                if not ids:
+                    continue
+                # The mutation re-checks the stock, so changes that did not
+                # report it cost nothing when the product is not low.
+                try:
+                    products = await sync_to_async(_restock)(sorted(ids))
+                except Exception as e:
+                    self.stderr.write(f"Restock of {len(ids)} products failed: {e}")
+                    continue
+                for product in products:
+                    self.stdout.write(f"Restocked {product['name']}: stock level → {product['stock']}")
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def snapshot_unit_prices(apps, schema_editor):
+    # Existing lines get the product's current price as their snapshot.
+    OrderItem = apps.get_model('crm', 'OrderItem')
+    Product = apps.get_model('crm', 'Product')
+    OrderItem.objects.filter(unit_price__isnull=True).update(
+        unit_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_filter_indexes'),
+    ]
+
+    operations = [
+        # Take over the auto-created through table instead of copying it.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='crm.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='crm.product')),
+                    ],
+                    options={
+                        'db_table': 'crm_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='crm.OrderItem', to='crm.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_unit_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def create_search_indexes(apps, schema_editor):
+    # FTS5 tables and triggers on SQLite, GIN tsvector indexes on
+    # PostgreSQL; other backends search with icontains.
+    from crm.search import install
+    install(schema_editor.connection)
+
+
+def drop_search_indexes(apps, schema_editor):
+    from crm.search import uninstall
+    uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
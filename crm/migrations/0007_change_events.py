@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventCheckpoint',
+            fields=[
+                ('consumer', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order.created', 'Order created'), ('stock.changed', 'Stock changed')], max_length=32)),
+                ('object_id', models.BigIntegerField()),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'id'], name='crm_event_kind_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_change_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+    ]
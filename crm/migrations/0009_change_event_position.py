@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:00
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def position_existing_events(apps, schema_editor):
+    # Events committed so far keep their ID as position, so existing
+    # checkpoints stay valid.
+    ChangeEvent = apps.get_model('crm', 'ChangeEvent')
+    ChangeEvent.objects.using(schema_editor.connection.alias).update(position=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_change_log_lock'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='changeevent',
+            name='crm_event_kind_idx',
+        ),
+        migrations.AddField(
+            model_name='changeevent',
+            name='position',
+            field=models.BigIntegerField(null=True, unique=True),
+        ),
+        migrations.RunPython(position_existing_events, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['kind', 'position'], name='crm_event_kind_position_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Customer(models.Model):
     name = models.CharField(max_length=100)
@@ -6,6 +7,14 @@ class Customer(models.Model):
     phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='crm_customer_created_idx'),
+            # varchar_pattern_ops lets PostgreSQL serve phone__startswith
+            # from the index; other backends ignore the opclass.
+            models.Index(fields=['phone'], name='crm_customer_phone_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -13,16 +22,144 @@ class Product(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    # Bumped by every stock write in crm.stock, for optimistic updates.
+    version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock'], name='crm_product_stock_idx'),
+            models.Index(fields=['price'], name='crm_product_price_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product, related_name='orders')
+    products = models.ManyToManyField(Product, related_name='orders', through='OrderItem')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     order_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_date'], name='crm_order_date_idx'),
+            models.Index(fields=['customer', 'order_date'], name='crm_order_customer_date_idx'),
+            models.Index(fields=['total_amount'], name='crm_order_total_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.customer.name}"
+
+class OrderItem(models.Model):
+    """
+    One line of an order: the product, the quantity and the unit price at
+    the time the order was placed.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='order_items')
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        # The table of the auto-created through model this replaced.
+        db_table = 'crm_order_products'
+        unique_together = [('order', 'product')]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} @ {self.unit_price}"
+
+class StockReservation(models.Model):
+    """
+    Stock held for a checkout. The quantity is taken out of
+    ``Product.stock`` when the reservation is made; it is consumed by the
+    order placed with the same token, or put back once ``expires_at``
+    passes.
+    """
+    token = models.UUIDField(db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='crm_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
+
+class StatsCounter(models.Model):
+    """
+    Running all-time totals, one row per counter name.
+    """
+    CUSTOMERS = 'customers'
+    ORDERS = 'orders'
+    REVENUE = 'revenue'
+
+    name = models.CharField(max_length=32, primary_key=True)
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+class DailyStats(models.Model):
+    """
+    Per-day rollup of new customers, orders and revenue.
+    """
+    day = models.DateField(unique=True)
+    customers = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Stats {self.day}"
+
+class ChangeEvent(models.Model):
+    """
+    Append-only log of order and stock changes. Committed events get a
+    ``position`` in commit order, so a consumer resumes from the last
+    position it processed (see crm.events).
+    """
+    ORDER_CREATED = 'order.created'
+    STOCK_CHANGED = 'stock.changed'
+    KINDS = [
+        (ORDER_CREATED, 'Order created'),
+        (STOCK_CHANGED, 'Stock changed'),
+    ]
+
+    kind = models.CharField(max_length=32, choices=KINDS)
+    object_id = models.BigIntegerField()
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # NULL until crm.events.assign_positions() runs after the commit.
+    position = models.BigIntegerField(null=True, unique=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'position'], name='crm_event_kind_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} {self.object_id}"
+
+class ChangeLogLock(models.Model):
+    """
+    A single row locked by ``assign_positions()`` for its short
+    transaction, so positions become visible in increasing order.
+    """
+
+    def __str__(self):
+        return f"Change log lock {self.pk}"
+
+class EventCheckpoint(models.Model):
+    """
+    The last change event position a consumer has processed.
+    """
+    consumer = models.CharField(max_length=64, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.consumer}@{self.position}"
@@ -0,0 +1,130 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+def _collect_fields(selection_set, fragments, fields=None):
+    """
+    Flatten a selection set (including fragment spreads and inline
+    fragments) into a mapping of field name to the list of field nodes
+    selecting it.
+    """
+    if fields is None:
+        fields = {}
+    if selection_set is None:
+        return fields
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            fields.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            _collect_fields(selection.selection_set, fragments, fields)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                _collect_fields(fragment.selection_set, fragments, fields)
+    return fields
+
+
+def _sub_fields(field_nodes, fragments):
+    fields = {}
+    for field_node in field_nodes:
+        _collect_fields(field_node.selection_set, fragments, fields)
+    return fields
+
+
+def _node_fields(connection_nodes, fragments):
+    """
+    Return the fields selected under ``edges { node { ... } }`` of a
+    relay connection.
+    """
+    edges = _sub_fields(connection_nodes, fragments).get('edges', [])
+    return _sub_fields(_sub_fields(edges, fragments).get('node', []), fragments)
+
+
+def _is_connection(field_nodes, fragments):
+    return 'edges' in _sub_fields(field_nodes, fragments)
+
+
+def _plan(model, fields, fragments):
+    """
+    Work out the ``only()`` columns, ``select_related`` paths and
+    ``Prefetch`` objects needed to resolve ``fields`` on ``model``.
+
+    The column list is ``None`` when a selected field cannot be mapped to
+    the model, in which case no columns are deferred.
+    """
+    only = {model._meta.pk.name}
+    select_related = []
+    prefetches = []
+    for field in model._meta.concrete_fields:
+        if field.is_relation:
+            only.add(field.attname)
+
+    for graphql_name, field_nodes in fields.items():
+        if graphql_name == '__typename':
+            continue
+        name = to_snake_case(graphql_name)
+        if name == 'id':
+            continue
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            only = None
+            continue
+
+        if model_field.concrete and (model_field.many_to_one or model_field.one_to_one):
+            related_model = model_field.related_model
+            related_only, related_select, related_prefetches = _plan(
+                related_model, _sub_fields(field_nodes, fragments), fragments
+            )
+            select_related.append(name)
+            select_related.extend(f'{name}__{path}' for path in related_select)
+            if only is not None:
+                only.add(name)
+                if related_only is None:
+                    only.update(f'{name}__{f.name}' for f in related_model._meta.concrete_fields)
+                else:
+                    only.update(f'{name}__{column}' for column in related_only)
+            for prefetch in related_prefetches:
+                prefetch.add_prefix(name)
+                prefetches.append(prefetch)
+        elif model_field.many_to_many or model_field.one_to_many:
+            sub_fields = _sub_fields(field_nodes, fragments)
+            if _is_connection(field_nodes, fragments):
+                sub_fields = _node_fields(field_nodes, fragments)
+            related_queryset = _apply(
+                model_field.related_model._default_manager.all(),
+                *_plan(model_field.related_model, sub_fields, fragments)
+            ).order_by('pk')
+            prefetches.append(Prefetch(name, queryset=related_queryset))
+        elif model_field.concrete:
+            if only is not None:
+                only.add(model_field.attname)
+        else:
+            only = None
+
+    return only, select_related, prefetches
+
+
+def _apply(queryset, only, select_related, prefetches):
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    if only is not None:
+        queryset = queryset.only(*only)
+    return queryset
+
+
+def optimize_queryset(queryset, info):
+    """
+    Apply ``only()``, ``select_related()`` and ``prefetch_related()`` to
+    the queryset backing a connection field, matching exactly what the
+    client selected below ``edges { node { ... } }``.
+    """
+    fragments = info.fragments
+    fields = _node_fields(info.field_nodes, fragments)
+    if not fields:
+        return queryset
+    return _apply(queryset, *_plan(queryset.model, fields, fragments))
@@ -0,0 +1,116 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+
+from .models import Customer, Order, OrderItem, Product
+from .reservations import consume
+from .stock import InsufficientStock, decrement_stock
+from . import events, response_cache, stats
+
+ZERO = Decimal('0')
+
+
+def merge_items(items):
+    """
+    Sum ``(product_id, quantity)`` pairs into ``{product_id: quantity}``.
+    """
+    quantities = defaultdict(int)
+    for product_id, quantity in items:
+        if quantity is None or quantity < 1:
+            raise ValueError(f"Quantity for product {product_id} must be at least 1")
+        quantities[product_id] += quantity
+    if not quantities:
+        raise ValueError("At least one item is required")
+    return quantities
+
+
+def order_total_expression(order_pk):
+    """
+    The order total as a subquery over its lines, so it is computed by the
+    database from the price snapshots rather than by the client.
+    """
+    line_total = ExpressionWrapper(
+        F('quantity') * F('unit_price'),
+        output_field=DecimalField(max_digits=20, decimal_places=2),
+    )
+    return Subquery(
+        OrderItem.objects.filter(order_id=order_pk)
+        .order_by()
+        .values('order_id')
+        .annotate(total=Sum(line_total))
+        .values('total')[:1]
+    )
+
+
+def lock_products(product_ids):
+    """
+    ``{pk: product}`` for ``product_ids``, locked with ``select_for_update``
+    in primary key order, so concurrent orders cannot deadlock.
+    """
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .only('id', 'name', 'price', 'stock')
+        .order_by('pk')
+        .select_for_update()
+    )
+    return {product.pk: product for product in products}
+
+
+def compute_totals(order_pks):
+    """
+    Set ``total_amount`` of the given orders from their lines with one
+    UPDATE. ``update()`` bypasses the order signals; callers adjust the
+    stats rollup themselves.
+    """
+    Order.objects.filter(pk__in=order_pks).update(total_amount=order_total_expression(OuterRef('pk')))
+
+
+def place_order(customer_id, items, reservation=None):
+    """
+    Create an order from ``(product_id, quantity)`` pairs.
+
+    The products are locked (``lock_products``), stock is checked against
+    the locked rows, the lines snapshot the current prices, the total is
+    computed by the database and stock is taken with one conditional
+    UPDATE. With a ``reservation`` token the stock it holds is consumed
+    instead. The query count does not depend on the number of lines; the
+    order and stock change events go into the log with one insert.
+    """
+    quantities = merge_items(items)
+
+    with transaction.atomic(), events.batch():
+        if not Customer.objects.filter(pk=customer_id).exists():
+            raise ValueError(f"Invalid customer ID: {customer_id}")
+
+        if reservation is None:
+            products = lock_products(quantities)
+        else:
+            # Reserved stock is already held, so only unreserved orders lock.
+            products = Product.objects.only('id', 'name', 'price', 'stock').in_bulk(list(quantities))
+        missing = sorted(pk for pk in quantities if pk not in products)
+        if missing:
+            raise ValueError(f"Invalid product ID(s): {missing}")
+        if reservation is not None:
+            consume(reservation, quantities)
+        else:
+            short = [
+                f"{products[pk].name} (requested {quantity}, in stock {products[pk].stock})"
+                for pk, quantity in quantities.items()
+                if products[pk].stock < quantity
+            ]
+            if short:
+                raise InsufficientStock(f"Insufficient stock: {', '.join(short)}")
+            decrement_stock(quantities)
+
+        order = Order.objects.create(customer_id=customer_id, total_amount=ZERO)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=pk, quantity=quantity, unit_price=products[pk].price)
+            for pk, quantity in quantities.items()
+        ])
+        compute_totals([order.pk])
+        order.refresh_from_db(fields=['total_amount'])
+        stats.record_revenue_change(order, order.total_amount)
+        response_cache.invalidate(OrderItem)
+    return order
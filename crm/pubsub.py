@@ -0,0 +1,244 @@
+"""
+Publish/subscribe channel behind the GraphQL subscriptions.
+
+Committed change-log events (see ``crm.events``) are published on one
+channel per event kind, and every listener on that channel gets them
+pushed. The backend is chosen by ``GRAPHQL_SUBSCRIPTIONS['BACKEND']``:
+
+* ``memory`` delivers within the current process only, which is enough
+  when the ASGI server is the only process that writes.
+* ``redis`` publishes through Redis, so writes made by WSGI workers,
+  Celery tasks and other ASGI processes reach every listener. Each
+  process reads Redis over one connection per event loop and fans the
+  messages out locally.
+
+Delivery is best effort: messages published while a listener is
+disconnected are not replayed. Listeners that need every event resume
+from the change log (``changeEvents(after: ...)``).
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'memory',
+    'REDIS_URL': 'redis://localhost:6379/1',
+    'CHANNEL_PREFIX': 'crm.events.',
+    'QUEUE_SIZE': 1000,
+    'PUBLISH_TIMEOUT': 1.0,
+}
+
+_OVERFLOW = object()
+
+
+class SubscriberOverflow(Exception):
+    """
+    Raised to a listener that fell more than ``QUEUE_SIZE`` messages
+    behind; it has to resynchronise from the change log.
+    """
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'GRAPHQL_SUBSCRIPTIONS', None) or {})
+    return options
+
+
+class Listener:
+    """
+    Async iterator over the messages published on one channel since it
+    was created. ``aclose()`` it (e.g. with ``contextlib.aclosing``) to
+    stop listening.
+    """
+
+    def __init__(self, broker, channel, loop, size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+
+    def deliver(self, message):
+        # Publishers run in request and worker threads; the queue belongs
+        # to the listener's event loop.
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            pass  # the loop is closed, the listener is gone
+
+    def _put(self, message):
+        if self.queue.full():
+            # The listener has to resynchronise anyway: drop its backlog
+            # and tell it so.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = _OVERFLOW
+        self.queue.put_nowait(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.queue.get()
+        if message is _OVERFLOW:
+            await self.aclose()
+            raise SubscriberOverflow(
+                f"More than {self.queue.maxsize} undelivered messages on {self.channel!r}"
+            )
+        return message
+
+    async def aclose(self):
+        self.broker.detach(self)
+
+
+class MemoryBroker:
+    """
+    Fans messages out to the listeners of the current process.
+    """
+
+    def __init__(self, queue_size=1000):
+        self.queue_size = queue_size
+        self._listeners = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def has_subscribers(self, channel):
+        with self._lock:
+            return bool(self._listeners.get(channel))
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message, loop=None):
+        with self._lock:
+            listeners = [
+                listener for listener in self._listeners.get(channel, ())
+                if loop is None or listener.loop is loop
+            ]
+        for listener in listeners:
+            listener.deliver(message)
+
+    def listen(self, channel):
+        """
+        Start listening on ``channel`` from the running event loop and
+        return the ``Listener``.
+        """
+        listener = Listener(self, channel, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._listeners[channel].add(listener)
+        return listener
+
+    def detach(self, listener):
+        with self._lock:
+            listeners = self._listeners.get(listener.channel)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[listener.channel]
+
+
+class RedisBroker(MemoryBroker):
+    """
+    Publishes through Redis and delivers what any process published to
+    the listeners of this one.
+    """
+
+    reconnect_delay = 1.0
+
+    def __init__(self, url, prefix, queue_size=1000, publish_timeout=1.0):
+        super().__init__(queue_size)
+        self.url = url
+        self.prefix = prefix
+        self.publish_timeout = publish_timeout
+        self._client = None
+        self._readers = {}
+
+    def publish(self, channel, message):
+        """
+        Publish from the committing thread (an ``on_commit`` hook), so a
+        slow or unreachable Redis holds up the request by at most
+        ``publish_timeout`` seconds; the message is then dropped.
+        """
+        import redis
+        from redis.exceptions import RedisError
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(
+                self.url, socket_timeout=self.publish_timeout, socket_connect_timeout=self.publish_timeout,
+            )
+        try:
+            self._client.publish(self.prefix + channel, json.dumps(message))
+        except (RedisError, OSError):
+            logger.warning("Could not publish to %r through Redis", channel, exc_info=True)
+
+    def listen(self, channel):
+        self._start_reader(asyncio.get_running_loop())
+        return super().listen(channel)
+
+    def _start_reader(self, loop):
+        with self._lock:
+            reader = self._readers.get(loop)
+            if reader is None or reader.done():
+                self._readers[loop] = loop.create_task(self._read(loop))
+
+    async def _read(self, loop):
+        import redis.asyncio
+        from redis.exceptions import RedisError
+
+        while True:
+            client = redis.asyncio.Redis.from_url(self.url)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(self.prefix + '*')
+                async for item in pubsub.listen():
+                    if item['type'] != 'pmessage':
+                        continue
+                    channel = item['channel'].decode()[len(self.prefix):]
+                    self.deliver(channel, json.loads(item['data']), loop=loop)
+            except (RedisError, OSError):
+                logger.warning("Lost the Redis subscription, reconnecting", exc_info=True)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+            await asyncio.sleep(self.reconnect_delay)
+
+
+_broker = None
+_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Return the process-wide broker configured by ``GRAPHQL_SUBSCRIPTIONS``.
+    """
+    global _broker
+    with _lock:
+        if _broker is None:
+            options = get_options()
+            if options['BACKEND'] == 'redis':
+                _broker = RedisBroker(
+                    options['REDIS_URL'], options['CHANNEL_PREFIX'], options['QUEUE_SIZE'], options['PUBLISH_TIMEOUT'],
+                )
+            else:
+                _broker = MemoryBroker(options['QUEUE_SIZE'])
+        return _broker
+
+
+def publish(channel, message):
+    """
+    Publish ``message`` (JSON-serialisable) on ``channel``. Failures are
+    logged, not raised: the write that produced the message has already
+    committed.
+    """
+    try:
+        get_broker().publish(channel, message)
+    except Exception:
+        logger.exception("Could not publish to %r", channel)
+
+
+def listen(channel):
+    return get_broker().listen(channel)
@@ -0,0 +1,134 @@
+import csv
+import math
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min, Sum
+from django.utils import timezone
+
+from .models import Customer, Order, OrderItem, Product
+
+TOP_PRODUCTS = 3
+
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=20, decimal_places=2)
+)
+
+
+def week_window(until=None):
+    until = until or timezone.now()
+    return until - timedelta(days=7), until
+
+
+def _window(since, until):
+    return {'order_date__gte': since, 'order_date__lt': until}
+
+
+def customer_ranges(parts, since, until):
+    """
+    Split the customer IDs that ordered in the window into ``parts``
+    half-open ``[lo, hi)`` ranges of equal width.
+    """
+    bounds = Order.objects.filter(**_window(since, until)).aggregate(
+        lo=Min('customer_id'), hi=Max('customer_id')
+    )
+    if bounds['lo'] is None:
+        return []
+    lo, hi = bounds['lo'], bounds['hi'] + 1
+    width = max(1, math.ceil((hi - lo) / max(1, parts)))
+    return [(start, min(start + width, hi)) for start in range(lo, hi, width)]
+
+
+def aggregate_range(lo, hi, since, until):
+    """
+    Aggregate the orders of customers ``lo <= id < hi`` in the window in
+    the database. Returns JSON-serializable partial results:
+    ``customers`` rows are ``[id, orders, revenue, top product ids]`` and
+    ``products`` rows are ``[id, orders, revenue]``.
+    """
+    orders = Order.objects.filter(customer_id__gte=lo, customer_id__lt=hi, **_window(since, until))
+    lines = OrderItem.objects.filter(
+        order__customer_id__gte=lo, order__customer_id__lt=hi,
+        **{f'order__{key}': value for key, value in _window(since, until).items()}
+    )
+
+    customers = {
+        row['customer_id']: [row['customer_id'], row['orders'], str(row['revenue']), []]
+        for row in orders.order_by().values('customer_id').annotate(
+            orders=Count('id'), revenue=Sum('total_amount')
+        )
+    }
+    per_customer = (
+        lines.values('order__customer_id', 'product_id')
+        .annotate(units=Sum('quantity'))
+        .order_by('order__customer_id', '-units', 'product_id')
+    )
+    for row in per_customer:
+        top = customers[row['order__customer_id']][3]
+        if len(top) < TOP_PRODUCTS:
+            top.append(row['product_id'])
+
+    products = [
+        [row['product_id'], row['orders'], str(row['revenue'])]
+        for row in lines.order_by().values('product_id').annotate(
+            orders=Count('order_id'), revenue=Sum(LINE_TOTAL)
+        )
+    ]
+    return {'customers': list(customers.values()), 'products': products}
+
+
+def merge_partials(partials):
+    """
+    Merge the partial results of ``aggregate_range``. Customer ranges are
+    disjoint; products are summed across ranges.
+    """
+    customers = []
+    products = {}
+    for partial in partials:
+        customers.extend(partial['customers'])
+        for product_id, orders, revenue in partial['products']:
+            total = products.setdefault(product_id, [product_id, 0, Decimal(0)])
+            total[1] += orders
+            total[2] += Decimal(revenue)
+    customers.sort(key=lambda row: Decimal(row[2]), reverse=True)
+    return customers, sorted(products.values(), key=lambda row: row[2], reverse=True)
+
+
+def report_path(until):
+    directory = getattr(settings, 'CRM_REPORT_DIR', '/tmp')
+    return os.path.join(directory, f'crm_weekly_report_{until:%Y%m%d}.csv')
+
+
+def write_report(path, since, until, customers, products):
+    """
+    Write both sections to one CSV file, replacing it atomically. The
+    header carries the window's totals.
+    """
+    customer_names = dict(Customer.objects.filter(pk__in=[row[0] for row in customers]).values_list('pk', 'name'))
+    product_ids = {row[0] for row in products} | {product_id for row in customers for product_id in row[3]}
+    product_names = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'name'))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w', newline='') as report:
+        writer = csv.writer(report)
+        writer.writerow(['# window', since.isoformat(), until.isoformat()])
+        writer.writerow([
+            '# totals', len(customers), sum(row[1] for row in customers),
+            sum((Decimal(row[2]) for row in customers), Decimal(0)),
+        ])
+        writer.writerow(['section', 'id', 'name', 'orders', 'revenue', 'top_products'])
+        for customer_id, orders, revenue, top in customers:
+            writer.writerow([
+                'customer', customer_id, customer_names.get(customer_id, ''), orders, revenue,
+                ';'.join(product_names.get(product_id, str(product_id)) for product_id in top),
+            ])
+        for product_id, orders, revenue in products:
+            writer.writerow(['product', product_id, product_names.get(product_id, ''), orders, revenue, ''])
+    os.replace(tmp, path)
+    return path
+
+
+def parse_window(since, until):
+    return datetime.fromisoformat(since), datetime.fromisoformat(until)
@@ -0,0 +1,109 @@
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import StockReservation
+from .stock import decrement_stock, restore_stock
+from . import events
+
+DEFAULT_TTL = timedelta(minutes=15)
+SWEEP_BATCH_SIZE = 1000
+
+
+class ReservationError(ValueError):
+    pass
+
+
+def _quantities(rows):
+    quantities = defaultdict(int)
+    for product_id, quantity in rows:
+        quantities[product_id] += quantity
+    return dict(quantities)
+
+
+def reserve(quantities, ttl=DEFAULT_TTL):
+    """
+    Hold ``{product_id: quantity}`` for ``ttl``. Stock is taken with one
+    conditional UPDATE, so either every product is reserved or
+    ``InsufficientStock`` is raised and nothing is. Returns the
+    reservation token and its expiry.
+    """
+    token = uuid.uuid4()
+    expires_at = timezone.now() + ttl
+    with transaction.atomic(), events.batch():
+        decrement_stock(quantities)
+        StockReservation.objects.bulk_create([
+            StockReservation(token=token, product_id=pk, quantity=quantity, expires_at=expires_at)
+            for pk, quantity in quantities.items()
+        ])
+    return token, expires_at
+
+
+def _take(token):
+    # Lock and delete the rows of a reservation; whoever deletes them
+    # (consume, release or the sweep) owns the held stock.
+    rows = list(
+        StockReservation.objects.select_for_update()
+        .filter(token=token)
+        .values_list('pk', 'product_id', 'quantity')
+    )
+    if rows:
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    return _quantities((product_id, quantity) for _, product_id, quantity in rows)
+
+
+def consume(token, quantities):
+    """
+    Turn a reservation into an order: its stock stays taken. The order
+    must be for exactly the reserved quantities. Call inside the order's
+    transaction.
+    """
+    held = _take(token)
+    if not held:
+        raise ReservationError(f"Reservation {token} does not exist or has expired")
+    if held != dict(quantities):
+        raise ReservationError(f"Items do not match reservation {token}")
+    return held
+
+
+def release(token):
+    """
+    Give the stock of a reservation back. Returns whether it still held
+    any.
+    """
+    with transaction.atomic():
+        held = _take(token)
+        if held:
+            restore_stock(held)
+    return bool(held)
+
+
+def release_expired(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """
+    Return the stock of expired reservations, ``batch_size`` rows per
+    transaction, with one stock UPDATE per batch. Locked rows are skipped
+    where the backend supports it, so concurrent sweeps do not block each
+    other. Returns the number of rows released.
+    """
+    now = now or timezone.now()
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=skip_locked)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            if not rows:
+                break
+            StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            restore_stock(_quantities((product_id, quantity) for _, product_id, quantity in rows))
+        released += len(rows)
+        if len(rows) < batch_size:
+            break
+    return released
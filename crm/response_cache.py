@@ -0,0 +1,251 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.backends.signals import connection_created
+
+
+class LRUBackend:
+    """
+    In-process LRU backend. Entries and tag versions live in this process
+    only, so invalidations from other processes are not seen.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_versions(self, tags):
+        with self._lock:
+            return {tag: self._versions.get(tag, 0) for tag in tags}
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Backend on top of a configured Django cache, shared between processes
+    when the cache is (e.g. Redis or Memcached).
+    """
+
+    def __init__(self, alias='default', prefix='graphql-response'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _key(self, kind, name):
+        return f'{self.prefix}:{kind}:{name}'
+
+    def get(self, key):
+        return self.cache.get(self._key('entry', key))
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(self._key('entry', key), value, timeout)
+
+    def get_versions(self, tags):
+        keys = {self._key('tag', tag): tag for tag in tags}
+        found = self.cache.get_many(list(keys))
+        return {tag: found.get(key, 0) for key, tag in keys.items()}
+
+    def bump(self, tags):
+        for tag in tags:
+            key = self._key('tag', tag)
+            if not self.cache.add(key, 1, None):
+                try:
+                    self.cache.incr(key)
+                except ValueError:
+                    self.cache.set(key, 1, None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+# Tag of responses that read from a replica (crm.routers). A lagging
+# replica can return rows older than the tag versions the entry would be
+# stored with, and nothing would invalidate it afterwards.
+REPLICA_TAG = 'replica'
+
+# Responses with these tags are never cached: the change log is appended
+# without model signals, so nothing would invalidate them, and replica
+# reads may be stale (see REPLICA_TAG).
+UNCACHED_TAGS = {'crm.ChangeEvent', REPLICA_TAG}
+
+
+def _model_tag(model):
+    # Auto-created M2M through tables are tagged as the model that owns them.
+    if model._meta.auto_created:
+        model = model._meta.auto_created
+    return model._meta.label
+
+
+class ResponseCache:
+    """
+    Cache of GraphQL query results keyed by the normalized document,
+    variables and operation name.
+
+    Each entry is tagged with the models whose tables were read while it
+    was computed, together with the version of each tag at the start of
+    execution. Writes bump the tag versions, which makes every entry that
+    read those models stale without enumerating them.
+    """
+
+    def __init__(self, backend, timeout=300, app_label='crm'):
+        self.backend = backend
+        self.timeout = timeout
+        self.app_label = app_label
+        self._tables = None
+
+    @property
+    def tables(self):
+        if self._tables is None:
+            models = apps.get_app_config(self.app_label).get_models(include_auto_created=True)
+            self._tables = {model._meta.db_table: _model_tag(model) for model in models}
+        return self._tables
+
+    def make_key(self, document_id, variables, operation_name):
+        payload = json.dumps([document_id, variables or {}, operation_name], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def snapshot(self):
+        return self.backend.get_versions(set(self.tables.values()))
+
+    def lookup(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        if self.backend.get_versions(entry['tags']) != entry['tags']:
+            return None
+        return entry['data']
+
+    def store(self, key, data, tags, versions):
+        if tags & UNCACHED_TAGS:
+            return
+        self.backend.set(key, {'data': data, 'tags': {tag: versions.get(tag, 0) for tag in tags}}, self.timeout)
+
+    def invalidate(self, *models):
+        self.backend.bump({_model_tag(model) for model in models})
+
+    @contextmanager
+    def record_tags(self):
+        """
+        Collect the tags of every table referenced by SQL run inside the
+        block. The recorder is looked up through a context variable, so
+        queries issued from ``sync_to_async`` threads are seen as well.
+        """
+        # Replica connections (crm.routers) are recorded as well, and
+        # tag the response with REPLICA_TAG.
+        for conn in connections.all(initialized_only=True):
+            _install_recorder(conn)
+        quote = connection.ops.quote_name
+        recording = _Recording([(quote(table), tag) for table, tag in self.tables.items()])
+        token = _recording.set(recording)
+        try:
+            yield recording.tags
+        finally:
+            _recording.reset(token)
+
+
+class _Recording:
+    def __init__(self, tables):
+        self.tables = tables
+        self.tags = set()
+
+
+_recording = ContextVar('graphql_response_recording', default=None)
+
+
+def _recorder(execute, sql, params, many, context):
+    recording = _recording.get()
+    if recording is not None:
+        if context['connection'].alias != DEFAULT_DB_ALIAS:
+            recording.tags.add(REPLICA_TAG)
+        for quoted, tag in recording.tables:
+            if quoted in sql:
+                recording.tags.add(tag)
+    return execute(sql, params, many, context)
+
+
+def _install_recorder(conn):
+    if _recorder not in conn.execute_wrappers:
+        conn.execute_wrappers.append(_recorder)
+
+
+def _connection_created(sender, connection, **kwargs):
+    _install_recorder(connection)
+
+
+connection_created.connect(_connection_created)
+
+
+_response_cache = None
+_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache configured by
+    ``GRAPHQL_RESPONSE_CACHE``, or ``None`` when it is disabled.
+    """
+    global _response_cache
+    options = getattr(settings, 'GRAPHQL_RESPONSE_CACHE', None) or {}
+    if not options.get('ENABLED', False):
+        return None
+    with _lock:
+        if _response_cache is None:
+            if options.get('BACKEND', 'django') == 'lru':
+                backend = LRUBackend(options.get('MAX_ENTRIES', 1024))
+            else:
+                backend = DjangoCacheBackend(options.get('CACHE_ALIAS', 'default'))
+            _response_cache = ResponseCache(backend, options.get('TIMEOUT', 300))
+        return _response_cache
+
+
+def invalidate(*models):
+    """
+    Mark cached responses that read any of ``models`` as stale. Inside a
+    transaction the tags are bumped again on commit, so a response cached
+    from pre-commit data by a concurrent reader does not survive.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return
+    cache.invalidate(*models)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: cache.invalidate(*models))
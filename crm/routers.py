@@ -0,0 +1,169 @@
+"""
+Read-replica routing.
+
+Reads are sent to a replica only inside a ``read_replica()`` block: the
+GraphQL views open one around query operations, and the report tasks
+around their aggregation. Everything else, including mutations and every
+query inside ``transaction.atomic``, uses the primary (``default``).
+
+Writes are sticky: once something was written in the current request
+(``RoutingMiddleware``) or ``read_replica()`` block, its later reads go
+to the primary too, so a request never reads a replica that has not
+caught up with its own writes yet.
+
+Replicas are listed in ``CRM_DATABASE_ROUTING['READ_ALIASES']``. A
+replica is only used while it answers and has applied the same
+migrations as the primary; that is checked at most once every
+``HEALTH_CHECK_INTERVAL`` seconds per process.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+DEFAULTS = {
+    'READ_ALIASES': [],
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CRM_DATABASE_ROUTING', None) or {})
+    return options
+
+
+class _State:
+    def __init__(self):
+        self.replica = False
+        self.wrote = False
+
+
+_state = ContextVar('crm_database_routing', default=None)
+
+
+@contextmanager
+def routing_context():
+    """
+    Scope write stickiness to the block (one request or task).
+    """
+    token = _state.set(_State())
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def read_replica():
+    """
+    Let reads inside the block go to a replica, unless the current
+    request has already written.
+    """
+    state = _state.get()
+    token = None
+    if state is None:
+        state = _State()
+        token = _state.set(state)
+    previous, state.replica = state.replica, True
+    try:
+        yield
+    finally:
+        state.replica = previous
+        if token is not None:
+            _state.reset(token)
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def _applied_migrations(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM django_migrations')
+        return cursor.fetchone()[0]
+
+
+def is_healthy(alias):
+    """
+    Whether ``alias`` answers and has applied as many migrations as the
+    primary. The result is cached for ``HEALTH_CHECK_INTERVAL`` seconds.
+    """
+    now = time.monotonic()
+    with _health_lock:
+        checked = _health.get(alias)
+    if checked is not None and now - checked[0] < get_options()['HEALTH_CHECK_INTERVAL']:
+        return checked[1]
+    try:
+        healthy = _applied_migrations(alias) == _applied_migrations(DEFAULT_DB_ALIAS)
+    except DatabaseError:
+        healthy = False
+    with _health_lock:
+        _health[alias] = (now, healthy)
+    return healthy
+
+
+def read_alias():
+    """
+    A healthy replica to read from, or the primary when there is none.
+    Use it for querysets that are evaluated outside ``read_replica()``,
+    such as streamed responses.
+    """
+    aliases = [alias for alias in get_options()['READ_ALIASES'] if alias in connections.settings]
+    healthy = [alias for alias in aliases if is_healthy(alias)]
+    return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica:
+            return None
+        if state.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary along with the rows;
+        # migrating them directly would make them diverge.
+        if db in get_options()['READ_ALIASES']:
+            return False
+        return None
+
+
+def RoutingMiddleware(get_response):
+    """
+    Give every request its own routing context, so a write made while
+    handling it pins its later reads to the primary.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with routing_context():
+                return await get_response(request)
+
+        return middleware
+
+    def middleware(request):
+        with routing_context():
+            return get_response(request)
+
+    return middleware
+
+
+RoutingMiddleware.sync_capable = True
+RoutingMiddleware.async_capable = True
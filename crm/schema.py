@@ -1,28 +1,111 @@
+from contextlib import aclosing
+from datetime import timedelta
+
 import graphene
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
-from .models import Customer, Product, Order
-from django.db import transaction
-from crm.models import Product
+from graphql_relay import from_global_id
+from .models import ChangeEvent, Customer, Product, Order, OrderItem
+from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .loaders import get_loaders
+from .fields import BatchedConnectionField, CountableConnection, KeysetConnectionField, is_async
+from .stock import restock_low_stock
+from .stats import aget_totals, get_totals
+from .bulk import DEFAULT_CHUNK_SIZE, bulk_create_customers, bulk_create_products, bulk_create_orders
+from .orders import merge_items, place_order
+from .reservations import release, reserve
+from . import events, pubsub
+
+def load(info, loader, key):
+    # Under the async view a loader miss has to run its query off the event loop.
+    if is_async(info):
+        return sync_to_async(loader.load)(key)
+    return loader.load(key)
 
 class CustomerType(DjangoObjectType):
     class Meta:
+        connection_class = CountableConnection
         model = Customer
-        fields = ("id", "name", "email", "phone")
+        fields = ("id", "name", "email", "phone", "orders")
         interfaces = (graphene.relay.Node,)
 
+    @classmethod
+    def prime_loaders(cls, customers, info):
+        get_loaders(info).prime_customers(customers)
+
+    def resolve_orders(self, info, **kwargs):
+        if 'orders' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.orders.all()
+        return load(info, get_loaders(info).orders_by_customer, self.pk)
+
 class ProductType(DjangoObjectType):
     class Meta:
+        connection_class = CountableConnection
         model = Product
         fields = "__all__"
         interfaces = (graphene.relay.Node,)
 
 class OrderType(DjangoObjectType):
     class Meta:
+        connection_class = CountableConnection
         model = Order
         fields = "__all__"
         interfaces = (graphene.relay.Node,)
 
+    @classmethod
+    def prime_loaders(cls, orders, info):
+        get_loaders(info).prime_orders(orders)
+
+    def resolve_customer(self, info):
+        if Order.customer.is_cached(self):
+            return self.customer
+        return load(info, get_loaders(info).customer, self.customer_id)
+
+    def resolve_products(self, info, **kwargs):
+        if 'products' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.products.all()
+        return load(info, get_loaders(info).products_by_order, self.pk)
+
+class OrderItemType(DjangoObjectType):
+    class Meta:
+        model = OrderItem
+        fields = ("id", "order", "product", "quantity", "unit_price")
+
+class ChangeEventType(DjangoObjectType):
+    class Meta:
+        model = ChangeEvent
+        fields = ("id", "position", "kind", "object_id", "data", "created_at")
+        convert_choices_to_enum = False
+
+    order = graphene.Field(OrderType)
+    product = graphene.Field(ProductType)
+
+    def resolve_order(self, info):
+        return getattr(self, '_order', None)
+
+    def resolve_product(self, info):
+        return getattr(self, '_product', None)
+
+CHANGE_EVENTS_MAX = 500
+
+def _change_events(info, after, kinds, first):
+    """
+    Read a page of the change log and attach the orders and products the
+    events point at, fetched with one query per model.
+    """
+    page = events.read(kinds, after=after, limit=max(1, min(first, CHANGE_EVENTS_MAX)))
+    ids = {kind: {event.object_id for event in page if event.kind == kind} for kind, _ in ChangeEvent.KINDS}
+    orders = Order.objects.select_related('customer').in_bulk(ids[ChangeEvent.ORDER_CREATED])
+    products = Product.objects.in_bulk(ids[ChangeEvent.STOCK_CHANGED])
+    OrderType.prime_loaders(list(orders.values()), info)
+    for event in page:
+        if event.kind == ChangeEvent.ORDER_CREATED:
+            event._order = orders.get(event.object_id)
+        elif event.kind == ChangeEvent.STOCK_CHANGED:
+            event._product = products.get(event.object_id)
+    return page
+
 class CreateCustomer(graphene.Mutation):
     class Arguments:
         name = graphene.String(required=True)
@@ -40,108 +123,265 @@ class CreateCustomer(graphene.Mutation):
         customer.save()
         return CreateCustomer(customer=customer)
 
-class Mutation(graphene.ObjectType):
-    create_customer = CreateCustomer.Field()
+def _pk_from_id(value):
+    """
+    Accept either a relay global ID or a raw primary key.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        _, pk = from_global_id(value)
+        return int(pk)
+
+class CustomerInput(graphene.InputObjectType):
+    name = graphene.String(required=True)
+    email = graphene.String(required=True)
+    phone = graphene.String()
+
+class ProductInput(graphene.InputObjectType):
+    name = graphene.String(required=True)
+    price = graphene.Decimal(required=True)
+    stock = graphene.Int(default_value=0)
+
+class OrderInput(graphene.InputObjectType):
+    customer_id = graphene.ID(required=True)
+    product_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+class OrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+
+class BulkRowError(graphene.ObjectType):
+    index = graphene.Int()
+    field = graphene.String()
+    message = graphene.String()
+
+class BulkCreateCustomers(graphene.Mutation):
+    class Arguments:
+        input = graphene.List(graphene.NonNull(CustomerInput), required=True)
+        chunk_size = graphene.Int(default_value=DEFAULT_CHUNK_SIZE)
+
+    customers = graphene.List(CustomerType)
+    errors = graphene.List(BulkRowError)
+
+    def mutate(self, info, input, chunk_size):
+        customers, errors = bulk_create_customers([dict(row) for row in input], chunk_size)
+        return BulkCreateCustomers(customers=customers, errors=[BulkRowError(**e) for e in errors])
+
+class BulkCreateProducts(graphene.Mutation):
+    class Arguments:
+        input = graphene.List(graphene.NonNull(ProductInput), required=True)
+        chunk_size = graphene.Int(default_value=DEFAULT_CHUNK_SIZE)
+
+    products = graphene.List(ProductType)
+    errors = graphene.List(BulkRowError)
+
+    def mutate(self, info, input, chunk_size):
+        products, errors = bulk_create_products([dict(row) for row in input], chunk_size)
+        return BulkCreateProducts(products=products, errors=[BulkRowError(**e) for e in errors])
+
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        input = graphene.List(graphene.NonNull(OrderInput), required=True)
+        chunk_size = graphene.Int(default_value=DEFAULT_CHUNK_SIZE)
+
+    orders = graphene.List(OrderType)
+    errors = graphene.List(BulkRowError)
+
+    def mutate(self, info, input, chunk_size):
+        rows = [
+            {
+                'customer_id': _pk_from_id(row.customer_id),
+                'product_ids': [_pk_from_id(pk) for pk in row.product_ids],
+            }
+            for row in input
+        ]
+        orders, errors = bulk_create_orders(rows, chunk_size)
+        return BulkCreateOrders(orders=orders, errors=[BulkRowError(**e) for e in errors])
+
+def _items(items):
+    return [(_pk_from_id(item.product_id), item.quantity) for item in items]
+
+class ReserveStock(graphene.Mutation):
+    class Arguments:
+        items = graphene.List(graphene.NonNull(OrderItemInput), required=True)
+        ttl_seconds = graphene.Int(default_value=900)
+
+    reservation_id = graphene.UUID()
+    expires_at = graphene.DateTime()
+
+    def mutate(self, info, items, ttl_seconds):
+        if ttl_seconds <= 0:
+            raise ValueError("ttlSeconds must be positive")
+        token, expires_at = reserve(merge_items(_items(items)), timedelta(seconds=ttl_seconds))
+        return ReserveStock(reservation_id=token, expires_at=expires_at)
+
+class ReleaseReservation(graphene.Mutation):
+    class Arguments:
+        reservation_id = graphene.UUID(required=True)
+
+    success = graphene.Boolean()
+
+    def mutate(self, info, reservation_id):
+        return ReleaseReservation(success=release(reservation_id))
+
+class CreateOrder(graphene.Mutation):
+    class Arguments:
+        customer_id = graphene.ID(required=True)
+        items = graphene.List(graphene.NonNull(OrderItemInput), required=True)
+        reservation_id = graphene.UUID()
+
+    order = graphene.Field(OrderType)
+
+    def mutate(self, info, customer_id, items, reservation_id=None):
+        # Stock and prices are checked and the total computed server-side.
+        order = place_order(_pk_from_id(customer_id), _items(items), reservation=reservation_id)
+        lines = OrderItem.objects.select_related('product').order_by('pk')
+        order = Order.objects.prefetch_related(Prefetch('items', queryset=lines)).get(pk=order.pk)
+        return CreateOrder(order=order)
 
 class Query(graphene.ObjectType):
     hello = graphene.String()
-    all_customers = DjangoFilterConnectionField(CustomerType)
-    all_products = DjangoFilterConnectionField(ProductType)
-    all_orders = DjangoFilterConnectionField(OrderType)
+    all_customers = BatchedConnectionField(CustomerType, filterset_class=CustomerFilter)
+    all_products = BatchedConnectionField(ProductType, filterset_class=ProductFilter)
+    all_orders = BatchedConnectionField(OrderType, filterset_class=OrderFilter)
+    all_customers_keyset = KeysetConnectionField(CustomerType, filterset_class=CustomerFilter)
+    all_products_keyset = KeysetConnectionField(ProductType, filterset_class=ProductFilter)
+    all_orders_keyset = KeysetConnectionField(
+        OrderType, filterset_class=OrderFilter, keyset=('order_date', 'id')
+    )
+    # Orders placed at or after `since`, paged on (order_date, id) so both
+    # the range and the cursor are served by crm_order_date_idx.
+    recent_orders = KeysetConnectionField(
+        OrderType, filterset_class=OrderFilter, keyset=('order_date', 'id'),
+        since=graphene.DateTime(required=True),
+    )
 
     def resolve_hello(self, info):
         return "Hello, GraphQL!"
-    
-    total_customers = graphene.Int()
-    total_orders = graphene.Int()
-    total_revenue = graphene.Float()
-    
-    def resolve_total_customers(self, info):
-        return Customer.objects.count()
-    
-    def resolve_total_orders(self, info):
-        return Order.objects.count()
-    
-    def resolve_total_revenue(self, info):
-        result = Order.objects.aggregate(total_revenue=Sum('total_amount'))
-        return result['total_revenue'] or 0.0
 
-class UpdateLowStockProducts(graphene.Mutation):
-    class Arguments:
-        pass
+    def resolve_recent_orders(self, info, since, **kwargs):
+        return Order.objects.filter(order_date__gte=since)
 
-    success = graphene.Boolean()
-    message = graphene.String()
-    updated_products = graphene.List(ProductType)
+    # The order/stock change log after position `after`, oldest first;
+    # clients keep the last position they processed and pass it back as
+    # `after`.
+    change_events = graphene.List(
+        graphene.NonNull(ChangeEventType),
+        after=graphene.Int(default_value=0),
+        kinds=graphene.List(graphene.NonNull(graphene.String)),
+        first=graphene.Int(default_value=100),
+    )
 
-    @transaction.atomic
-    def mutate(self, info):
-        try:
-            # Find products with stock less than 10
-            low_stock_products = Product.objects.filter(stock__lt=10)
-            updated_count = low_stock_products.count()
-            
-            # Update stock by adding 10 to each low stock product
-            for product in low_stock_products:
-                product.stock += 10
-                product.save()
-            
-            return UpdateLowStockProducts(
-                success=True,
-                message=f"Updated {updated_count} low-stock products",
-                updated_products=low_stock_products
-            )
-            
-        except Exception as e:
-            return UpdateLowStockProducts(
-                success=False,
-                message=f"Error updating low-stock products: {str(e)}",
-                updated_products=[]
-            )
+    def resolve_change_events(self, info, after, first, kinds=None):
+        if is_async(info):
+            return sync_to_async(_change_events)(info, after, kinds, first)
+        return _change_events(info, after, kinds, first)
 
-class Mutation(graphene.ObjectType):
-    update_low_stock_products = UpdateLowStockProducts.Field()
+    total_customers = graphene.Int(since=graphene.Date(), until=graphene.Date())
+    total_orders = graphene.Int(since=graphene.Date(), until=graphene.Date())
+    total_revenue = graphene.Float(since=graphene.Date(), until=graphene.Date())
 
-# Add to your existing schema
-schema = graphene.Schema(
-    query=Query,  # Your existing Query class
-    mutation=Mutation
-)
+    # Totals come from the stats rollup maintained by crm.signals and the
+    # bulk paths; run `manage.py reconcile_stats` to rebuild it.
+    def resolve_total_customers(self, info, since=None, until=None):
+        if is_async(info):
+            return _atotal('customers', since, until)
+        return get_totals(since, until)['customers']
 
-class ProductType(DjangoObjectType):
-    class Meta:
-        model = Product
-        fields = "__all__"
+    def resolve_total_orders(self, info, since=None, until=None):
+        if is_async(info):
+            return _atotal('orders', since, until)
+        return get_totals(since, until)['orders']
+
+    def resolve_total_revenue(self, info, since=None, until=None):
+        if is_async(info):
+            return _atotal('revenue', since, until, float)
+        return float(get_totals(since, until)['revenue'])
+
+async def _atotal(name, since, until, convert=int):
+    return convert((await aget_totals(since, until))[name])
 
 class UpdateLowStockProducts(graphene.Mutation):
     class Arguments:
-        pass
+        threshold = graphene.Int(default_value=10)
+        increment = graphene.Int(default_value=10)
+        max_batch = graphene.Int(default_value=1000)
+        # Only consider these products (e.g. those whose stock changed).
+        product_ids = graphene.List(graphene.NonNull(graphene.ID))
 
     success = graphene.Boolean()
     message = graphene.String()
     updated_products = graphene.List(ProductType)
 
-    @transaction.atomic
-    def mutate(self, info):
+    def mutate(self, info, threshold, increment, max_batch, product_ids=None):
         try:
-            # Find products with stock less than 10
-            low_stock_products = Product.objects.filter(stock__lt=10)
-            updated_count = low_stock_products.count()
-            
-            # Update stock by adding 10 to each low stock product
-            for product in low_stock_products:
-                product.stock += 10
-                product.save()
-            
+            if product_ids is not None:
+                product_ids = [_pk_from_id(product_id) for product_id in product_ids]
+            # Restock up to max_batch products below the threshold in one UPDATE
+            updated_products = restock_low_stock(
+                threshold=threshold, increment=increment, max_batch=max_batch,
+                product_ids=product_ids,
+            )
+
             return UpdateLowStockProducts(
                 success=True,
-                message=f"Updated {updated_count} low-stock products",
-                updated_products=low_stock_products
+                message=f"Updated {len(updated_products)} low-stock products",
+                updated_products=updated_products
             )
-            
+
         except Exception as e:
             return UpdateLowStockProducts(
                 success=False,
                 message=f"Error updating low-stock products: {str(e)}",
                 updated_products=[]
             )
+
+LOW_STOCK_THRESHOLD = 10
+
+class Subscription(graphene.ObjectType):
+    # Pushed whenever a committed stock change leaves a product below
+    # `threshold`, from whichever process made it (see crm.pubsub).
+    low_stock_product = graphene.Field(ProductType, threshold=graphene.Int(default_value=LOW_STOCK_THRESHOLD))
+    # Pushed for every new order, or only those of `customerId`.
+    order_created = graphene.Field(OrderType, customer_id=graphene.ID())
+
+    async def subscribe_low_stock_product(root, info, threshold):
+        async with aclosing(pubsub.listen(events.STOCK_CHANGED)) as messages:
+            async for message in messages:
+                # Changes that report the new stock are filtered here; the
+                # others are checked with one query per message, which also
+                # skips products restocked since.
+                ids = set()
+                for event in message['events']:
+                    stock = event['data'].get('stock')
+                    if stock is None or stock < threshold:
+                        ids.add(event['object_id'])
+                if not ids:
+                    continue
+                async for product in Product.objects.filter(pk__in=ids, stock__lt=threshold).order_by('pk'):
+                    yield product
+
+    async def subscribe_order_created(root, info, customer_id=None):
+        if customer_id is not None:
+            customer_id = _pk_from_id(customer_id)
+        async with aclosing(pubsub.listen(events.ORDER_CREATED)) as messages:
+            async for message in messages:
+                ids = [
+                    event['object_id'] for event in message['events']
+                    if customer_id is None or event['data'].get('customer_id') == customer_id
+                ]
+                if not ids:
+                    continue
+                async for order in Order.objects.select_related('customer').filter(pk__in=ids).order_by('pk'):
+                    yield order
+
+class Mutation(graphene.ObjectType):
+    create_customer = CreateCustomer.Field()
+    create_order = CreateOrder.Field()
+    reserve_stock = ReserveStock.Field()
+    release_reservation = ReleaseReservation.Field()
+    bulk_create_customers = BulkCreateCustomers.Field()
+    bulk_create_products = BulkCreateProducts.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
+    update_low_stock_products = UpdateLowStockProducts.Field()
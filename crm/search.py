@@ -0,0 +1,251 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Customer, Product
+
+MAX_TERMS = 8
+
+
+class SearchIndex:
+    """
+    Full-text index over some text columns of a model.
+
+    On SQLite it is an FTS5 external-content table (``<table>_fts``) that
+    triggers keep in sync with every INSERT, DELETE and UPDATE of the
+    indexed columns, including bulk_create and queryset updates. On
+    PostgreSQL it is a GIN index on the ``to_tsvector`` of the columns,
+    which the database maintains itself.
+    """
+
+    def __init__(self, model, columns):
+        self.model = model
+        self.columns = columns
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def fts_table(self):
+        return f'{self.table}_fts'
+
+    @property
+    def gin_index(self):
+        return f'{self.table}_search_idx'
+
+    def triggers(self):
+        columns = ', '.join(self.columns)
+        new = ', '.join(f'new.{column}' for column in self.columns)
+        old = ', '.join(f'old.{column}' for column in self.columns)
+        delete = f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+        insert = f"INSERT INTO {self.fts_table}(rowid, {columns}) VALUES (new.id, {new});"
+        return {
+            f'{self.fts_table}_ai': f'AFTER INSERT ON {self.table} BEGIN {insert} END',
+            f'{self.fts_table}_ad': f'AFTER DELETE ON {self.table} BEGIN {delete} END',
+            f'{self.fts_table}_au': f'AFTER UPDATE OF {columns} ON {self.table} BEGIN {delete} {insert} END',
+        }
+
+    def document(self, qualify=False):
+        prefix = f'"{self.table}".' if qualify else ''
+        text = " || ' ' || ".join(f'coalesce({prefix}"{column}", \'\')' for column in self.columns)
+        return f"to_tsvector('simple', {text})"
+
+
+INDEXES = {
+    Customer: SearchIndex(Customer, ('name', 'email')),
+    Product: SearchIndex(Product, ('name',)),
+}
+
+
+def _sqlite_objects(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        return {row[0] for row in cursor.fetchall()}
+
+
+# The FTS tables present in each SQLite database, by alias. Looked up
+# whenever a connection is opened (and updated by install/uninstall), so
+# building a search queryset never queries the database: it may run on
+# the event loop of the async view, where blocking calls are refused.
+_search_tables = {}
+_search_tables_lock = threading.Lock()
+
+
+def _detect(connection):
+    tables = {index.fts_table for index in INDEXES.values()} & _sqlite_objects(connection)
+    with _search_tables_lock:
+        _search_tables[connection.alias] = tables
+
+
+def _connection_created(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        _detect(connection)
+
+
+connection_created.connect(_connection_created)
+
+
+def _probe(alias):
+    # A connection opened in this thread runs _connection_created.
+    try:
+        connections[alias].ensure_connection()
+    finally:
+        connections[alias].close()
+
+
+def _search_tables_of(connection):
+    if connection.alias not in _search_tables:
+        # No connection to this database was opened in this process yet.
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            _detect(connection)
+        else:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(_probe, connection.alias).result()
+    return _search_tables.get(connection.alias, set())
+
+
+def install(connection):
+    """
+    Create the search indexes on ``connection``. Idempotent, so it also
+    repairs an SQLite index whose triggers were lost when a migration
+    rebuilt the underlying table; the index is then rebuilt from the
+    table. Returns whether the backend has a search index.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for index in INDEXES.values():
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {index.gin_index} ON {index.table} USING gin ({index.document()})'
+                )
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+
+    existing = _sqlite_objects(connection)
+    with connection.cursor() as cursor:
+        for index in INDEXES.values():
+            if index.table not in existing:
+                continue
+            triggers = index.triggers()
+            if index.fts_table in existing and existing.issuperset(triggers):
+                continue
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.fts_table} USING fts5("
+                    f"{', '.join(index.columns)}, content='{index.table}', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                )
+            except OperationalError:
+                # SQLite built without FTS5: search falls back to icontains.
+                return False
+            for name, body in triggers.items():
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+            cursor.execute(f"INSERT INTO {index.fts_table}({index.fts_table}) VALUES ('rebuild')")
+    _detect(connection)
+    return True
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        for index in INDEXES.values():
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {index.gin_index}')
+            elif connection.vendor == 'sqlite':
+                for name in index.triggers():
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+                cursor.execute(f'DROP TABLE IF EXISTS {index.fts_table}')
+    if connection.vendor == 'sqlite':
+        _detect(connection)
+
+
+def _available(connection, index):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    return index.fts_table in _search_tables_of(connection)
+
+
+def search_terms(text):
+    return re.findall(r'[^\W_]+', text.lower())[:MAX_TERMS]
+
+
+def _match(connection, terms):
+    # Every term must match as a prefix, so results narrow as the user types.
+    if connection.vendor == 'postgresql':
+        return ' & '.join(f'{term}:*' for term in terms)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def matching_ids(model, text, using='default'):
+    """
+    A subquery of the primary keys of ``model`` rows matching ``text``,
+    unranked, for filtering related rows with ``__in``.
+    """
+    connection = connections[using]
+    index = INDEXES[model]
+    terms = search_terms(text)
+    if not terms:
+        return model.objects.using(using).none().values('pk')
+    if not _available(connection, index):
+        return _fallback(model.objects.using(using), index, terms).values('pk')
+    if connection.vendor == 'postgresql':
+        return RawSQL(
+            f"SELECT id FROM {index.table} WHERE {index.document()} @@ to_tsquery('simple', %s)",
+            [_match(connection, terms)],
+        )
+    return RawSQL(f'SELECT rowid FROM {index.fts_table} WHERE {index.fts_table} MATCH %s', [_match(connection, terms)])
+
+
+def _fallback(queryset, index, terms):
+    condition = Q()
+    for term in terms:
+        condition &= Q(*[Q(**{f'{column}__icontains': term}) for column in index.columns], _connector=Q.OR)
+    return queryset.filter(condition)
+
+
+def search(queryset, text):
+    """
+    Filter ``queryset`` to rows matching ``text`` and order them by
+    relevance (``search_rank``, higher is better). Without a search index
+    on the backend this falls back to ``icontains`` per term, unranked.
+    """
+    connection = connections[queryset.db]
+    index = INDEXES[queryset.model]
+    terms = search_terms(text)
+    if not terms:
+        return queryset.none()
+    if not _available(connection, index):
+        return _fallback(queryset, index, terms).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('pk')
+
+    match = _match(connection, terms)
+    if connection.vendor == 'postgresql':
+        rank = RawSQL(
+            f"ts_rank({index.document(qualify=True)}, to_tsquery('simple', %s))", [match],
+            output_field=FloatField(),
+        )
+        queryset = queryset.filter(pk__in=matching_ids(queryset.model, text, queryset.db)).annotate(search_rank=rank)
+    else:
+        # The FTS table has no model, so it is joined with extra(): the
+        # MATCH drives the query and every row's bm25() comes from that one
+        # scan (a correlated subquery would re-run the MATCH per row).
+        # bm25() is lower for better matches; negate it so both backends
+        # rank higher-is-better.
+        queryset = queryset.extra(
+            select={'search_rank': f'-"{index.fts_table}".rank'},
+            tables=[index.fts_table],
+            where=[f'"{index.fts_table}".rowid = "{index.table}"."id"', f'"{index.fts_table}" MATCH %s'],
+            params=[match],
+        )
+    return queryset.order_by('-search_rank', 'pk')
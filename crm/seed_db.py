@@ -1,10 +1,10 @@
 import os
 import django
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'graphql_crm.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 django.setup()
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderItem
 
 def seed_database():
     # Clear existing data
@@ -42,12 +42,15 @@ def seed_database():
     # Order 1
     order1 = Order(customer=customer1, total_amount=1029.98)
     order1.save()
-    order1.products.set([product1, product2])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order1, product=product, unit_price=product.price)
+        for product in (product1, product2)
+    ])
     
     # Order 2
     order2 = Order(customer=customer2, total_amount=79.99)
     order2.save()
-    order2.products.set([product3])
+    OrderItem.objects.create(order=order2, product=product3, unit_price=product3.price)
     
     print("Database seeded successfully!")
     print(f"Created {Customer.objects.count()} customers")
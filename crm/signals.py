@@ -0,0 +1,101 @@
+from decimal import Decimal
+
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Customer, Product, Order, OrderItem
+from . import events, response_cache, search, stats
+
+
+@receiver(post_save, sender=Customer)
+def customer_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.record_customers([instance])
+
+
+@receiver(post_delete, sender=Customer)
+def customer_deleted(sender, instance, **kwargs):
+    stats.record_customers([instance], sign=-1)
+
+
+@receiver(pre_save, sender=Order)
+def order_saving(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored total so an edited order adjusts revenue by the
+    difference only.
+    """
+    instance._stats_previous_total = None
+    if instance.pk and not raw and not instance._state.adding:
+        instance._stats_previous_total = (
+            Order.objects.filter(pk=instance.pk).values_list('total_amount', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.record_orders([instance])
+        events.record(events.ORDER_CREATED, instance.pk, customer_id=instance.customer_id)
+    elif instance._stats_previous_total is not None:
+        delta = Decimal(str(instance.total_amount)) - instance._stats_previous_total
+        if delta:
+            stats.record_revenue_change(instance, delta)
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored stock so a save that changes it is logged.
+    """
+    instance._events_previous_stock = None
+    if instance.pk and not raw and not instance._state.adding:
+        instance._events_previous_stock = (
+            Product.objects.filter(pk=instance.pk).values_list('stock', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = 0 if created else instance._events_previous_stock
+    if previous is not None and instance.stock != previous:
+        events.record(events.STOCK_CHANGED, instance.pk, delta=instance.stock - previous, stock=instance.stock)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    stats.record_orders([instance], sign=-1)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_responses(sender, **kwargs):
+    response_cache.invalidate(sender)
+
+
+@receiver(m2m_changed, sender=OrderItem)
+def order_products_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        response_cache.invalidate(Order, OrderItem)
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    # SQLite drops triggers when a migration rebuilds a table; put the
+    # search index triggers back and resync the index if that happened.
+    if sender.name != 'crm':
+        return
+    connection = connections[using]
+    if ('crm', '0006_search_index') in MigrationRecorder(connection).applied_migrations():
+        search.install(connection)
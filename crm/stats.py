@@ -0,0 +1,171 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Customer, Order, StatsCounter, DailyStats
+from . import response_cache
+
+ZERO = Decimal('0')
+
+# Known write hotspot: every order write bumps the same StatsCounter rows
+# (and today's DailyStats row) inside the writing transaction, so the row
+# locks are held until that transaction commits and concurrent order
+# writers queue on them. That is free on SQLite, which serializes writers
+# anyway, and cheap while order transactions stay short. If it shows up as
+# lock waits on PostgreSQL, shard the counters (rows per name and shard,
+# summed on read) or move the rollup off the request path onto the change
+# log (see crm.events).
+
+
+def _bump_counter(name, delta):
+    if not delta:
+        return
+    response_cache.invalidate(StatsCounter, DailyStats)
+    updated = StatsCounter.objects.filter(name=name).update(value=F('value') + delta)
+    if not updated:
+        try:
+            with transaction.atomic():
+                StatsCounter.objects.create(name=name, value=delta)
+        except IntegrityError:
+            StatsCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def _bump_day(day, **deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if not DailyStats.objects.filter(day=day).update(**updates):
+        try:
+            with transaction.atomic():
+                DailyStats.objects.create(day=day, **deltas)
+        except IntegrityError:
+            DailyStats.objects.filter(day=day).update(**updates)
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def record_customers(customers, sign=1):
+    """
+    Add (or, with ``sign=-1``, remove) customers to the rollup.
+    """
+    per_day = defaultdict(int)
+    for customer in customers:
+        per_day[_day(customer.created_at)] += sign
+    with transaction.atomic():
+        _bump_counter(StatsCounter.CUSTOMERS, sum(per_day.values()))
+        for day, count in per_day.items():
+            _bump_day(day, customers=count)
+
+
+def record_orders(orders, sign=1):
+    """
+    Add (or, with ``sign=-1``, remove) orders and their revenue to the
+    rollup.
+    """
+    per_day = defaultdict(lambda: [0, ZERO])
+    for order in orders:
+        bucket = per_day[_day(order.order_date)]
+        bucket[0] += sign
+        bucket[1] += sign * Decimal(str(order.total_amount))
+    with transaction.atomic():
+        _bump_counter(StatsCounter.ORDERS, sum(count for count, _ in per_day.values()))
+        _bump_counter(StatsCounter.REVENUE, sum((revenue for _, revenue in per_day.values()), ZERO))
+        for day, (count, revenue) in per_day.items():
+            _bump_day(day, orders=count, revenue=revenue)
+
+
+def record_revenue_change(order, delta):
+    with transaction.atomic():
+        _bump_counter(StatsCounter.REVENUE, delta)
+        _bump_day(_day(order.order_date), revenue=delta)
+
+
+def _all_time(values):
+    return {
+        'customers': int(values.get(StatsCounter.CUSTOMERS, 0)),
+        'orders': int(values.get(StatsCounter.ORDERS, 0)),
+        'revenue': values.get(StatsCounter.REVENUE, ZERO),
+    }
+
+
+def _buckets(since, until):
+    buckets = DailyStats.objects.all()
+    if since is not None:
+        buckets = buckets.filter(day__gte=since)
+    if until is not None:
+        buckets = buckets.filter(day__lte=until)
+    return buckets
+
+
+def _range(totals):
+    return {
+        'customers': totals['customers'] or 0,
+        'orders': totals['orders'] or 0,
+        'revenue': totals['revenue'] or ZERO,
+    }
+
+
+def get_totals(since=None, until=None):
+    """
+    Return ``{'customers', 'orders', 'revenue'}``. All-time totals are
+    read from the counter rows; a date range is summed over the daily
+    buckets, so neither depends on the size of the order table.
+    """
+    if since is None and until is None:
+        return _all_time(dict(StatsCounter.objects.values_list('name', 'value')))
+    return _range(_buckets(since, until).aggregate(
+        customers=Sum('customers'), orders=Sum('orders'), revenue=Sum('revenue')
+    ))
+
+
+async def aget_totals(since=None, until=None):
+    """
+    Async counterpart of ``get_totals`` using the async ORM.
+    """
+    if since is None and until is None:
+        return _all_time({name: value async for name, value in StatsCounter.objects.values_list('name', 'value')})
+    return _range(await _buckets(since, until).aaggregate(
+        customers=Sum('customers'), orders=Sum('orders'), revenue=Sum('revenue')
+    ))
+
+
+@transaction.atomic
+def rebuild():
+    """
+    Recompute every counter and daily bucket from the source tables.
+    """
+    per_day = defaultdict(dict)
+    customers = (
+        Customer.objects.annotate(day=TruncDate('created_at'))
+        .values('day').annotate(count=Count('id')).order_by()
+    )
+    for row in customers:
+        per_day[row['day']]['customers'] = row['count']
+    orders = (
+        Order.objects.annotate(day=TruncDate('order_date'))
+        .values('day').annotate(count=Count('id'), revenue=Sum('total_amount')).order_by()
+    )
+    for row in orders:
+        per_day[row['day']]['orders'] = row['count']
+        per_day[row['day']]['revenue'] = row['revenue'] or ZERO
+
+    DailyStats.objects.all().delete()
+    DailyStats.objects.bulk_create(
+        [DailyStats(day=day, **values) for day, values in sorted(per_day.items())],
+        batch_size=1000,
+    )
+    StatsCounter.objects.all().delete()
+    StatsCounter.objects.bulk_create([
+        StatsCounter(name=StatsCounter.CUSTOMERS, value=sum(v.get('customers', 0) for v in per_day.values())),
+        StatsCounter(name=StatsCounter.ORDERS, value=sum(v.get('orders', 0) for v in per_day.values())),
+        StatsCounter(name=StatsCounter.REVENUE, value=sum((v.get('revenue', ZERO) for v in per_day.values()), ZERO)),
+    ])
+    response_cache.invalidate(StatsCounter, DailyStats)
+    return len(per_day)
@@ -0,0 +1,172 @@
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Product
+from . import events, response_cache
+
+
+class InsufficientStock(ValueError):
+    pass
+
+
+class StockConflict(Exception):
+    pass
+
+
+def supports_update_returning(conn=connection):
+    """
+    Whether the backend understands ``UPDATE ... RETURNING``.
+    """
+    if conn.vendor == 'postgresql':
+        return True
+    if conn.vendor == 'sqlite':
+        return conn.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def _restock_returning(threshold, increment, max_batch, product_ids=None):
+    table = connection.ops.quote_name(Product._meta.db_table)
+    fields = Product._meta.concrete_fields
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    only = ''
+    params = [increment, threshold]
+    if product_ids is not None:
+        only = f"AND id IN ({', '.join(['%s'] * len(product_ids))}) "
+        params += list(product_ids)
+    # The subquery does not lock; the outer predicate is re-checked
+    # against each row as it is updated, so a product a concurrent
+    # restock already lifted above the threshold is left alone.
+    sql = (
+        f'UPDATE {table} SET stock = stock + %s, version = version + 1 '
+        f'WHERE id IN (SELECT id FROM {table} WHERE stock < %s {only}ORDER BY id LIMIT %s) '
+        f'AND stock < %s '
+        f'RETURNING {columns}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [max_batch, threshold])
+        rows = cursor.fetchall()
+    columns = [field.get_col(Product._meta.db_table) for field in fields]
+    converters = [
+        (col, connection.ops.get_db_converters(col) + col.get_db_converters(connection))
+        for col in columns
+    ]
+    products = []
+    for row in rows:
+        values = []
+        for (col, col_converters), value in zip(converters, row):
+            for converter in col_converters:
+                value = converter(value, col, connection)
+            values.append(value)
+        products.append(Product.from_db(connection.alias, [f.attname for f in fields], values))
+    products.sort(key=lambda product: product.pk)
+    return products
+
+
+def _restock_update(threshold, increment, max_batch, product_ids=None):
+    candidates = Product.objects.select_for_update().filter(stock__lt=threshold)
+    if product_ids is not None:
+        candidates = candidates.filter(id__in=product_ids)
+    ids = list(
+        candidates
+        .order_by('id')
+        .values_list('id', flat=True)[:max_batch]
+    )
+    if not ids:
+        return []
+    Product.objects.filter(id__in=ids).update(stock=F('stock') + increment, version=F('version') + 1)
+    return list(Product.objects.filter(id__in=ids).order_by('id'))
+
+
+def restock_low_stock(threshold=10, increment=10, max_batch=1000, product_ids=None):
+    """
+    Add ``increment`` to the stock of up to ``max_batch`` products whose
+    stock is below ``threshold`` with a single set-based UPDATE, and
+    return the rows that were touched with their new stock levels.
+    ``product_ids`` limits the candidates to those products.
+    """
+    if increment <= 0:
+        raise ValueError("increment must be a positive integer")
+    if max_batch <= 0:
+        raise ValueError("max_batch must be a positive integer")
+    if product_ids is not None:
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            return []
+    with transaction.atomic():
+        if supports_update_returning():
+            products = _restock_returning(threshold, increment, max_batch, product_ids)
+        else:
+            products = _restock_update(threshold, increment, max_batch, product_ids)
+        if products:
+            response_cache.invalidate(Product)
+            events.record_many(events.STOCK_CHANGED, [
+                (product.pk, {'delta': increment, 'stock': product.stock}) for product in products
+            ])
+        return products
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def decrement_stock(quantities):
+    """
+    Take ``{product_id: quantity}`` out of stock with one conditional
+    UPDATE (``... WHERE stock >= quantity``), so concurrent writers can
+    never drive stock negative. Raises ``InsufficientStock`` unless every
+    product had enough; callers run it inside a transaction, so the
+    partial decrement is rolled back.
+    """
+    amounts = _per_product(quantities)
+    updated = Product.objects.filter(pk__in=quantities, stock__gte=amounts).update(
+        stock=F('stock') - amounts, version=F('version') + 1
+    )
+    if updated != len(quantities):
+        short = list(
+            Product.objects.filter(pk__in=quantities, stock__lt=amounts).values_list('name', 'stock')
+        )
+        raise InsufficientStock(
+            "Insufficient stock: " + ", ".join(f"{name} (in stock {stock})" for name, stock in short)
+        )
+    response_cache.invalidate(Product)
+    events.record_many(events.STOCK_CHANGED, [(pk, {'delta': -quantity}) for pk, quantity in quantities.items()])
+    return updated
+
+
+def restore_stock(quantities):
+    """
+    Put ``{product_id: quantity}`` back into stock with one UPDATE.
+    """
+    updated = Product.objects.filter(pk__in=quantities).update(
+        stock=F('stock') + _per_product(quantities), version=F('version') + 1
+    )
+    response_cache.invalidate(Product)
+    events.record_many(events.STOCK_CHANGED, [(pk, {'delta': quantity}) for pk, quantity in quantities.items()])
+    return updated
+
+
+def update_stock(product_id, compute, retries=5):
+    """
+    Read-modify-write ``stock`` with optimistic locking: ``compute`` maps
+    the current stock to the new one, and the write only succeeds if the
+    row's version is unchanged, otherwise it is retried. Use it when the
+    new value is not a simple delta; deltas should use
+    ``decrement_stock``/``restore_stock``.
+    """
+    for _ in range(retries):
+        stock, version = Product.objects.values_list('stock', 'version').get(pk=product_id)
+        new_stock = compute(stock)
+        if new_stock < 0:
+            raise InsufficientStock(f"Stock of product {product_id} cannot go below 0")
+        updated = Product.objects.filter(pk=product_id, version=version).update(
+            stock=new_stock, version=F('version') + 1
+        )
+        if updated:
+            response_cache.invalidate(Product)
+            events.record(events.STOCK_CHANGED, product_id, delta=new_stock - stock, stock=new_stock)
+            return new_stock
+    raise StockConflict(f"Stock of product {product_id} kept changing; gave up after {retries} attempts")
@@ -0,0 +1,1228 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from gql.transport.exceptions import TransportQueryError
+from graphql_relay import to_global_id
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from alx_backend_graphql import instrumentation, subscriptions, views
+from alx_backend_graphql.documents import document_id
+from alx_backend_graphql.schema import schema
+from crm import (
+    cron, events, fields, graphql_client, pubsub, reports, reservations, response_cache, routers, search, stats, tasks,
+)
+from crm.celery import app
+from crm.cron_jobs import send_order_reminders as reminders_job
+from crm.management.commands.seed_crm import seed_epoch
+from crm.models import ChangeEvent, Customer, DailyStats, Order, OrderItem, Product, StockReservation
+from crm.orders import compute_totals, place_order
+from crm.stock import InsufficientStock, restock_low_stock
+
+
+def execute(query, **variables):
+    result = schema.execute(query, variable_values=variables, context_value=SimpleNamespace())
+    if result.errors:
+        raise AssertionError(result.errors)
+    return result.data
+
+
+class CeleryRoutingTests(SimpleTestCase):
+    """
+    Routing is checked against the in-memory broker, so no Redis is needed.
+    """
+
+    ROUTES = {
+        'crm.tasks.generate_weekly_reports': 'reports',
+        'crm.tasks.aggregate_customer_range': 'reports',
+        'crm.tasks.merge_weekly_reports': 'reports',
+        'crm.tasks.release_expired_reservations': 'stock',
+        'crm.tasks.update_low_stock': 'stock',
+        'crm.tasks.prune_change_events': 'stock',
+        'crm.tasks.log_crm_heartbeat': 'notifications',
+    }
+
+    def setUp(self):
+        self.connection = app.connection_for_write('memory://')
+        self.addCleanup(self.connection.release)
+        self.channel = self.connection.default_channel
+        for queue in app.amqp.queues.values():
+            queue(self.channel).declare()
+            self.addCleanup(queue(self.channel).purge)
+
+    def drain(self, name):
+        queue = app.amqp.queues[name](self.channel)
+        names = []
+        while (message := queue.get(no_ack=True)) is not None:
+            names.append(message.headers['task'])
+        return names
+
+    def test_settings_are_loaded_by_the_celery_app(self):
+        self.assertEqual(app.conf.task_routes, settings.CELERY_TASK_ROUTES)
+        self.assertEqual(app.conf.beat_schedule, settings.CELERY_BEAT_SCHEDULE)
+        self.assertIn('default', settings.DATABASES)
+
+    def test_each_task_is_routed_to_its_queue(self):
+        for task, queue in self.ROUTES.items():
+            with self.subTest(task=task):
+                self.assertEqual(app.amqp.router.route({}, task)['queue'].name, queue)
+
+    def test_messages_only_reach_their_own_queue(self):
+        with app.amqp.Producer(self.connection) as producer:
+            tasks.update_low_stock.apply_async(producer=producer)
+            tasks.log_crm_heartbeat.apply_async(producer=producer)
+            tasks.generate_weekly_reports.apply_async(producer=producer)
+        self.assertEqual(self.drain('stock'), ['crm.tasks.update_low_stock'])
+        self.assertEqual(self.drain('notifications'), ['crm.tasks.log_crm_heartbeat'])
+        self.assertEqual(self.drain('reports'), ['crm.tasks.generate_weekly_reports'])
+        self.assertEqual(self.drain('default'), [])
+
+    def test_former_cron_jobs_are_scheduled_by_beat(self):
+        scheduled = {entry['task'] for entry in app.conf.beat_schedule.values()}
+        self.assertIn('crm.tasks.log_crm_heartbeat', scheduled)
+        self.assertIn('crm.tasks.update_low_stock', scheduled)
+        self.assertNotIn('crm.tasks.generate_crm_report', scheduled)
+        self.assertNotIn('django_crontab', settings.INSTALLED_APPS)
+
+
+
+class WeeklyReportTests(TestCase):
+    """
+    The report chord runs in Celery's eager mode: the range tasks and the
+    merge callback execute in this process, against the test database.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customers = Customer.objects.bulk_create(
+            Customer(name=f'Customer {i}', email=f'customer{i}@example.com') for i in range(12)
+        )
+        cls.pen = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=100)
+        cls.ink = Product.objects.create(name='Ink', price=Decimal('4.00'), stock=100)
+        for i, customer in enumerate(customers):
+            order = Order.objects.create(customer=customer, total_amount=Decimal('0'))
+            OrderItem.objects.create(order=order, product=cls.pen, quantity=i + 1, unit_price=cls.pen.price)
+            if i % 3 == 0:
+                OrderItem.objects.create(order=order, product=cls.ink, quantity=1, unit_price=cls.ink.price)
+        compute_totals(Order.objects.values_list('pk', flat=True))
+        # Outside the window.
+        Order.objects.filter(customer=customers[0]).update(order_date=timezone.now() - timedelta(days=30))
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        eager = {'task_always_eager': True, 'task_eager_propagates': True}
+        previous = {key: app.conf[key] for key in eager}
+        app.conf.update(eager)
+        self.addCleanup(app.conf.update, previous)
+
+    def read_report(self, path):
+        with open(path, newline='') as report:
+            return list(csv.reader(report))
+
+    def test_chord_merges_every_range_into_one_report(self):
+        until = timezone.now() + timedelta(seconds=1)
+        with override_settings(CRM_REPORT_DIR=self.directory.name, CRM_REPORT_RANGES=4), \
+                mock.patch('crm.reports.aggregate_range', wraps=reports.aggregate_range) as aggregate:
+            tasks.generate_weekly_reports.delay(until.isoformat())
+            path = reports.report_path(until)
+        self.assertEqual(aggregate.call_count, 4)
+
+        rows = self.read_report(path)
+        self.assertEqual(rows[1][:3], ['# totals', '11', '11'])
+        self.assertEqual(Decimal(rows[1][3]), Decimal('127.50'))
+        customers = [(row[2], int(row[3]), Decimal(row[4]), row[5]) for row in rows if row[0] == 'customer']
+        products = {row[2]: (int(row[3]), Decimal(row[4])) for row in rows if row[0] == 'product'}
+        self.assertEqual(len(customers), 11)
+        self.assertEqual(customers[0], ('Customer 9', 1, Decimal('19.00'), 'Pen;Ink'))
+        self.assertEqual(products, {'Pen': (11, Decimal('115.50')), 'Ink': (3, Decimal('12.00'))})
+
+    def test_legacy_task_writes_the_weekly_report(self):
+        with override_settings(CRM_REPORT_DIR=self.directory.name):
+            tasks.generate_crm_report.delay()
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+
+class HeartbeatTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(graphql_client._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_jobs_run_in_process_but_the_heartbeat_uses_http(self):
+        self.assertIsInstance(graphql_client.get_client(), graphql_client.LocalClient)
+        self.assertIsInstance(graphql_client.get_client('http'), graphql_client.HTTPClient)
+
+        log = mock.mock_open()
+        with mock.patch.object(graphql_client.HTTPClient, 'execute', return_value={'hello': 'Hello!'}) as http, \
+                mock.patch.object(graphql_client.LocalClient, 'execute') as local, \
+                mock.patch('crm.cron.open', log, create=True):
+            cron.log_crm_heartbeat()
+        http.assert_called_once()
+        local.assert_not_called()
+        self.assertIn('GraphQL endpoint is responsive - Hello!', log().write.call_args.args[0])
+
+    def test_http_client_does_not_replay_posts_on_gateway_errors(self):
+        client = graphql_client.HTTPClient('http://crm.invalid/graphql')
+        client.session()
+        self.addCleanup(client.close)
+        retry = client.transport.session.get_adapter('http://crm.invalid/graphql').max_retries
+        self.assertFalse(retry.is_retry('POST', 502))
+        self.assertTrue(retry.is_retry('GET', 502))
+        self.assertEqual(retry.total, 3)
+
+
+
+BULK_CREATE_ORDERS = """
+    mutation BulkCreateOrders($input: [OrderInput!]!, $chunkSize: Int) {
+        bulkCreateOrders(input: $input, chunkSize: $chunkSize) {
+            orders { id totalAmount }
+            errors { index field message }
+        }
+    }
+"""
+
+
+class BulkCreateOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name='Ann', email='ann@example.com', phone='+1234567890')
+        cls.pen = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=3)
+        cls.ink = Product.objects.create(name='Ink', price=Decimal('4.00'), stock=1)
+
+    def row(self, *products):
+        return {'customerId': str(self.customer.pk), 'productIds': [str(p.pk) for p in products]}
+
+    def test_total_is_not_accepted_from_the_client(self):
+        row = {**self.row(self.pen), 'totalAmount': '-5'}
+        result = schema.execute(BULK_CREATE_ORDERS, variable_values={'input': [row]}, context_value=SimpleNamespace())
+        self.assertTrue(result.errors)
+        self.assertFalse(Order.objects.exists())
+
+    def test_orders_go_through_the_create_order_path(self):
+        data = execute(BULK_CREATE_ORDERS, input=[self.row(self.pen, self.ink), self.row(self.pen)])
+        self.assertEqual(data['bulkCreateOrders']['errors'], [])
+        self.assertEqual([o['totalAmount'] for o in data['bulkCreateOrders']['orders']], ['5.50', '1.50'])
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.pen.refresh_from_db()
+        self.ink.refresh_from_db()
+        self.assertEqual((self.pen.stock, self.ink.stock), (1, 0))
+        self.assertEqual(stats.get_totals()['revenue'], Decimal('7.00'))
+
+    def test_rows_exceeding_the_stock_are_rejected(self):
+        data = execute(BULK_CREATE_ORDERS, input=[self.row(self.ink), self.row(self.ink, self.pen)])
+        errors = data['bulkCreateOrders']['errors']
+        self.assertEqual([(e['index'], e['message']) for e in errors], [(1, 'Insufficient stock: Ink')])
+        self.assertEqual(Order.objects.count(), 1)
+        self.pen.refresh_from_db()
+        self.assertEqual(self.pen.stock, 3)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        Product.objects.filter(pk=self.pen.pk).update(stock=100)
+        # The first order creates the stats counters.
+        execute(BULK_CREATE_ORDERS, input=[self.row(self.pen)])
+        counts = []
+        for size in (2, 20):
+            with CaptureQueriesContext(connection) as queries:
+                execute(BULK_CREATE_ORDERS, input=[self.row(self.pen)] * size, chunkSize=100)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+ALL_ORDERS = """
+    query AllOrders($first: Int) {
+        allOrders(first: $first) {
+            totalCount
+            edges { node {
+                id totalAmount
+                customer { name }
+                products { edges { node { name price } } }
+                items { quantity unitPrice product { name } }
+            } }
+        }
+    }
+"""
+
+ALL_CUSTOMERS = """
+    query AllCustomers($first: Int) {
+        allCustomers(first: $first) {
+            edges { node {
+                name
+                orders { totalCount edges { node { totalAmount products { edges { node { name } } } } } }
+            } }
+        }
+    }
+"""
+
+
+class QueryCountTests(TestCase):
+    """
+    Nested fields are batched, so the number of queries must not grow
+    with the page size.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customers = Customer.objects.bulk_create(
+            Customer(name=f'Customer {i}', email=f'customer{i}@example.com') for i in range(60)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=Decimal('2.00'), stock=10) for i in range(3)
+        )
+        orders = Order.objects.bulk_create(
+            Order(customer=customers[i], total_amount=Decimal('4.00')) for i in range(60)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, unit_price=product.price)
+            for order in orders for product in products[:2]
+        )
+
+    def count_queries(self, query, first):
+        with CaptureQueriesContext(connection) as queries:
+            data = execute(query, first=first)
+        return len(queries), data
+
+    def assert_flat(self, query, field):
+        counts = []
+        for first in (5, 20, 60):
+            count, data = self.count_queries(query, first)
+            self.assertEqual(len(data[field]['edges']), first)
+            counts.append(count)
+        self.assertEqual(len(set(counts)), 1, counts)
+        return counts[0]
+
+    def test_all_orders(self):
+        # count, orders with their customers, products, items
+        self.assertEqual(self.assert_flat(ALL_ORDERS, 'allOrders'), 4)
+
+    def test_all_customers_with_their_orders(self):
+        # count, customers, their orders, the orders' products
+        self.assertEqual(self.assert_flat(ALL_CUSTOMERS, 'allCustomers'), 4)
+
+    def test_selection_plan_replaces_per_edge_queries(self):
+        unoptimized = mock.patch('crm.fields.optimize_queryset', side_effect=lambda queryset, info: queryset)
+        with unoptimized:
+            count, _ = self.count_queries(ALL_ORDERS, 20)
+        self.assertGreater(count, 20)
+        with self.assertNumQueries(4):
+            execute(ALL_ORDERS, first=20)
+
+    def test_only_selected_columns_are_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            execute(ALL_ORDERS, first=5)
+        orders = queries.captured_queries[1]['sql']
+        self.assertIn('"crm_customer"."name"', orders)
+        self.assertNotIn('"crm_customer"."email"', orders)
+        self.assertNotIn('"crm_order"."order_date"', orders)
+
+    def test_fragments_are_planned(self):
+        query = """
+            query AllOrders($first: Int) {
+                allOrders(first: $first) {
+                    totalCount
+                    edges { node { ...OrderFields } }
+                }
+            }
+            fragment OrderFields on OrderType {
+                id totalAmount
+                customer { ...on CustomerType { name } }
+                products { edges { node { ...ProductFields } } }
+                items { quantity unitPrice product { ...on ProductType { name } } }
+            }
+            fragment ProductFields on ProductType { name price }
+        """
+        expected = execute(ALL_ORDERS, first=20)
+        with self.assertNumQueries(4):
+            data = execute(query, first=20)
+        self.assertEqual(data, expected)
+
+    def test_aliases_are_planned(self):
+        query = """
+            query AllCustomers($first: Int) {
+                clients: allCustomers(first: $first) {
+                    edges { node {
+                        label: name
+                        purchases: orders { edges { node { amount: totalAmount goods: products { edges { node { title: name } } } } } }
+                    } }
+                }
+            }
+        """
+        # count, customers, their orders, the orders' products
+        with self.assertNumQueries(4):
+            data = execute(query, first=20)
+        node = data['clients']['edges'][0]['node']
+        self.assertEqual(node['label'], 'Customer 0')
+        self.assertEqual(len(node['purchases']['edges'][0]['node']['goods']['edges']), 2)
+
+
+class StatsRollupTests(TestCase):
+    """
+    The rollup must always agree with an aggregate over the source
+    tables, for all-time totals and for a date range.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann = Customer.objects.create(name='Ann', email='ann@example.com')
+        cls.bob = Customer.objects.create(name='Bob', email='bob@example.com')
+        cls.pen = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=10)
+
+    def assert_matches_aggregate(self):
+        fresh = {
+            'customers': Customer.objects.count(),
+            'orders': Order.objects.count(),
+            'revenue': Order.objects.aggregate(revenue=Sum('total_amount'))['revenue'] or Decimal('0'),
+        }
+        self.assertEqual(stats.get_totals(), fresh)
+        today = timezone.localdate()
+        self.assertEqual(stats.get_totals(today, today), fresh)
+
+    def test_created_orders_and_customers_are_counted(self):
+        place_order(self.ann.pk, [(self.pen.pk, 2)])
+        Order.objects.create(customer=self.bob, total_amount=Decimal('9.99'))
+        Customer.objects.create(name='Cy', email='cy@example.com')
+        self.assert_matches_aggregate()
+        self.assertEqual(stats.get_totals()['revenue'], Decimal('12.99'))
+
+    def test_deleted_orders_and_customers_are_subtracted(self):
+        Order.objects.create(customer=self.ann, total_amount=Decimal('4.00'))
+        Order.objects.create(customer=self.bob, total_amount=Decimal('6.00'))
+        self.bob.delete()
+        self.assert_matches_aggregate()
+        self.assertEqual(stats.get_totals()['orders'], 1)
+
+    def test_total_amount_changes_adjust_revenue(self):
+        order = Order.objects.create(customer=self.ann, total_amount=Decimal('4.00'))
+        order.total_amount = Decimal('2.50')
+        order.save()
+        order.save()
+        self.assert_matches_aggregate()
+        self.assertEqual(stats.get_totals()['revenue'], Decimal('2.50'))
+
+    def test_reconcile_stats_rebuilds_a_drifted_rollup(self):
+        Order.objects.create(customer=self.ann, total_amount=Decimal('4.00'))
+        # Queryset updates bypass the signals.
+        Order.objects.update(total_amount=Decimal('8.00'))
+        DailyStats.objects.all().delete()
+        self.assertNotEqual(stats.get_totals()['revenue'], Decimal('8.00'))
+        call_command('reconcile_stats', stdout=StringIO())
+        self.assert_matches_aggregate()
+
+
+KEYSET_PRODUCTS = """
+    query Products($first: Int, $after: String, $last: Int, $before: String) {
+        allProductsKeyset(first: $first, after: $after, last: $last, before: $before) {
+            edges { node { name } }
+            pageInfo { startCursor endCursor hasNextPage hasPreviousPage }
+        }
+    }
+"""
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=Decimal('1.00'), stock=10) for i in range(7)
+        )
+        # Runs of equal created_at, so pages have to break ties on id.
+        products = list(Product.objects.order_by('pk'))
+        moment = timezone.now()
+        for index, product in enumerate(products):
+            Product.objects.filter(pk=product.pk).update(created_at=moment + timedelta(seconds=index // 3))
+        cls.names = [product.name for product in products]
+
+    def page(self, **variables):
+        data = execute(KEYSET_PRODUCTS, **variables)['allProductsKeyset']
+        return [edge['node']['name'] for edge in data['edges']], data['pageInfo']
+
+    def test_forward_paging_across_equal_keys(self):
+        names, after, pages = [], None, []
+        while True:
+            page, info = self.page(first=2, after=after)
+            names += page
+            pages.append((len(page), info['hasNextPage'], info['hasPreviousPage']))
+            if not info['hasNextPage']:
+                break
+            after = info['endCursor']
+        self.assertEqual(names, self.names)
+        self.assertEqual(pages, [(2, True, False), (2, True, True), (2, True, True), (1, False, True)])
+
+    def test_backward_paging_across_equal_keys(self):
+        names, before = [], None
+        while True:
+            page, info = self.page(last=2, before=before)
+            names = page + names
+            if not info['hasPreviousPage']:
+                break
+            before = info['startCursor']
+        self.assertEqual(names, self.names)
+
+    def test_pages_meet_in_the_middle(self):
+        _, info = self.page(first=4)
+        page, info = self.page(last=2, before=info['endCursor'])
+        self.assertEqual(page, self.names[1:3])
+        self.assertEqual((info['hasNextPage'], info['hasPreviousPage']), (True, True))
+
+    def test_invalid_and_foreign_cursors_are_rejected(self):
+        offset_cursor = execute('{ allProducts(first: 1) { edges { cursor } } }')['allProducts']['edges'][0]['cursor']
+        for cursor in (
+            'not a cursor',
+            offset_cursor,
+            fields.encode_keyset_cursor([1]),
+            fields.encode_keyset_cursor(['yesterday', 1]),
+            fields.encode_keyset_cursor([timezone.now(), 'one']),
+        ):
+            result = schema.execute(KEYSET_PRODUCTS, variable_values={'first': 2, 'after': cursor})
+            self.assertEqual([error.message for error in result.errors], [f'Invalid cursor: {cursor}'])
+
+    def test_total_count_is_only_run_when_selected(self):
+        Product.objects.filter(name='Product 0').update(stock=0)
+        query = '{ allProductsKeyset(first: 2, stockGte: 1) { totalCount edges { node { name } } } }'
+        with CaptureQueriesContext(connection) as queries:
+            data = execute(query)
+        self.assertEqual(data['allProductsKeyset']['totalCount'], 6)
+        self.assertEqual(sum('COUNT(' in query['sql'] for query in queries.captured_queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.page(first=2)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+
+class RestockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(name=f'Product {stock}', price=Decimal('1.00'), stock=stock) for stock in (0, 5, 9, 10, 50)
+        )
+
+    def test_only_low_stock_rows_are_restocked_and_returned(self):
+        products = restock_low_stock(threshold=10, increment=10, max_batch=2)
+        self.assertEqual([(p.name, p.stock) for p in products], [('Product 0', 10), ('Product 5', 15)])
+        products = restock_low_stock(threshold=10, increment=10)
+        self.assertEqual([(p.name, p.stock) for p in products], [('Product 9', 19)])
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('stock', flat=True)), [10, 15, 19, 10, 50]
+        )
+
+
+class RecordingSender:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send(self, customer, orders):
+        if customer['email'] in self.failing:
+            raise OSError(f"cannot reach {customer['email']}")
+        self.sent.append((customer['email'], [order['id'] for order in orders]))
+
+
+class OrderRemindersTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for name, value in (
+            ('STATE_FILE', os.path.join(directory.name, 'state.json')),
+            ('DEAD_LETTER_FILE', os.path.join(directory.name, 'dead.jsonl')),
+            ('LOG_FILE', os.path.join(directory.name, 'log.txt')),
+            ('MAX_ATTEMPTS', 3),
+            ('PAGE_SIZE', 2),
+        ):
+            patcher = mock.patch.object(reminders_job, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.orders = {}
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('ann', 'bob', 'cat'):
+                customer = Customer.objects.create(name=name, email=f'{name}@example.com')
+                self.orders[name] = Order.objects.create(customer=customer, total_amount=Decimal('10.00'))
+
+    def run_job(self, sender):
+        with mock.patch.object(reminders_job, 'get_sender', return_value=sender), \
+                mock.patch('builtins.print'):
+            reminders_job.send_order_reminders()
+        return sender.sent
+
+    def sent(self, *names):
+        return [(f'{name}@example.com', [to_global_id('OrderType', self.orders[name].pk)]) for name in names]
+
+    def test_failed_reminders_are_retried_without_resending_the_rest(self):
+        self.assertCountEqual(self.run_job(RecordingSender(failing={'bob@example.com'})), self.sent('ann', 'cat'))
+        position, retries = reminders_job.load_state()
+        self.assertEqual(position, events.latest_position())
+        self.assertEqual([(r['customer']['email'], r['attempts']) for r in retries], [('bob@example.com', 1)])
+
+        self.assertEqual(self.run_job(RecordingSender()), self.sent('bob'))
+        self.assertEqual(reminders_job.load_state(), (position, []))
+        self.assertEqual(self.run_job(RecordingSender()), [])
+
+    def test_reminders_go_to_the_dead_letters_after_max_attempts(self):
+        for _ in range(3):
+            self.run_job(RecordingSender(failing={'bob@example.com'}))
+        self.assertEqual(reminders_job.load_state()[1], [])
+        with open(reminders_job.DEAD_LETTER_FILE) as dead_letters:
+            dead = [json.loads(line) for line in dead_letters]
+        self.assertEqual([(d['customer']['email'], d['attempts']) for d in dead], [('bob@example.com', 3)])
+        self.assertEqual(self.run_job(RecordingSender()), [])
+
+    def test_pages_are_checkpointed_as_they_are_delivered(self):
+        execute = graphql_client.execute
+        pages = []
+
+        def fail_on_second_page(query, variables=None, mode=None):
+            pages.append(variables)
+            if len(pages) == 2:
+                raise TransportQueryError('unavailable', errors=['unavailable'])
+            return execute(query, variables, mode)
+
+        with mock.patch.object(graphql_client, 'execute', fail_on_second_page):
+            self.assertEqual(self.run_job(RecordingSender()), self.sent('ann', 'bob'))
+        self.assertEqual(self.run_job(RecordingSender()), self.sent('cat'))
+
+
+class UpdateLowStockJobTests(TestCase):
+    def test_first_run_restocks_every_batch_before_the_checkpoint(self):
+        Product.objects.bulk_create(
+            Product(name=f'Product {n}', price=Decimal('1.00'), stock=n % 3) for n in range(7)
+        )
+        consumer = events.Consumer('update_low_stock', [events.STOCK_CHANGED])
+        with mock.patch.object(cron, 'RESTOCK_BATCH', 3), mock.patch('crm.cron.open', mock.mock_open(), create=True):
+            cron.update_low_stock()
+        self.assertFalse(Product.objects.filter(stock__lt=10).exists())
+        self.assertIsNotNone(consumer.position())
+
+
+class ChangeLogTests(TestCase):
+    def test_committed_events_are_read_without_delay(self):
+        product = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=5)
+        consumer = events.Consumer('test', [events.STOCK_CHANGED])
+        consumer.consume(lambda batch: None)
+
+        restock_low_stock(threshold=10, increment=10)
+        seen = []
+        self.assertEqual(consumer.consume(seen.extend), 1)
+        self.assertEqual([(event.object_id, event.data) for event in seen], [(product.pk, {'delta': 10, 'stock': 15})])
+        self.assertEqual(consumer.position(), seen[0].position)
+        self.assertEqual(consumer.consume(seen.extend), 0)
+
+    def test_late_commits_are_positioned_after_the_checkpoint(self):
+        first, second = ChangeEvent.objects.bulk_create([
+            ChangeEvent(kind=events.STOCK_CHANGED, object_id=1), ChangeEvent(kind=events.STOCK_CHANGED, object_id=2),
+        ])
+        # The transaction of the second event committed (and was positioned
+        # and consumed) before the first one's.
+        ChangeEvent.objects.filter(pk=second.pk).update(position=second.pk)
+        consumer = events.Consumer('test', [events.STOCK_CHANGED])
+        consumer.commit(second.pk)
+
+        self.assertEqual(events.assign_positions(), 1)
+        seen = []
+        self.assertEqual(consumer.consume(seen.extend), 1)
+        self.assertEqual([event.object_id for event in seen], [1])
+        self.assertGreater(seen[0].position, second.pk)
+
+
+class NoOversellTests(TransactionTestCase):
+    """
+    Threads race to order and reserve a product on real transactions;
+    the conditional decrement must never sell more than there is.
+    """
+
+    STOCK = 150
+    THREADS = 8
+    ATTEMPTS = 25
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        self.product = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=self.STOCK)
+
+    def attempt(self, reserve, quantity):
+        while True:
+            try:
+                if reserve:
+                    reservations.reserve({self.product.pk: quantity})
+                else:
+                    place_order(self.customer.pk, [(self.product.pk, quantity)])
+                return 'ok'
+            except InsufficientStock:
+                return 'short'
+            except OperationalError:
+                # SQLite fails a concurrent writer with "table is locked"
+                # instead of waiting; the transaction was rolled back.
+                time.sleep(0.001)
+
+    def worker(self, number, outcomes, start):
+        start.wait()
+        try:
+            for attempt in range(self.ATTEMPTS):
+                outcomes.append(self.attempt(attempt % 2, 1 + (number + attempt) % 3))
+        finally:
+            connection.close()
+
+    def test_concurrent_orders_and_reservations_never_oversell(self):
+        outcomes = []
+        start = threading.Barrier(self.THREADS)
+        threads = [
+            threading.Thread(target=self.worker, args=(number, outcomes, start))
+            for number in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(product=self.product).values_list('quantity', flat=True))
+        held = sum(StockReservation.objects.filter(product=self.product).values_list('quantity', flat=True))
+        self.assertGreaterEqual(self.product.stock, 0)
+        self.assertEqual(self.product.stock + sold + held, self.STOCK)
+        self.assertIn('ok', outcomes)
+        self.assertIn('short', outcomes)
+
+        # Once the holds expire, their stock comes back.
+        reservations.release_expired(now=timezone.now() + timedelta(days=1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock + sold, self.STOCK)
+
+
+class MetricsLabelTests(TestCase):
+    """
+    Metric labels must stay bounded whatever aliases and operation names
+    clients send.
+    """
+
+    def setUp(self):
+        for metric in instrumentation.METRICS:
+            metric.clear()
+        instrumentation._operation_names.clear()
+
+    def post(self, query):
+        response = self.client.post('/graphql', json.dumps({'query': query}), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def series(self, metric, label):
+        prefix = f'{metric}_count{{'
+        return {
+            line[len(prefix):].split('"')[1]
+            for line in instrumentation.render_metrics().splitlines()
+            if line.startswith(prefix) and line[len(prefix):].startswith(f'{label}=')
+        }
+
+    def test_resolvers_are_labelled_by_schema_field(self):
+        Product.objects.create(name='Pen', price=Decimal('1.50'), stock=3)
+        for alias in ('first', 'second', 'third'):
+            self.post(f'query {{ {alias}: allProducts(first: 1) {{ edges {{ node {{ n: name }} }} }} }}')
+        self.assertEqual(self.series('graphql_resolver_duration_seconds', 'field'), {
+            'Query.allProducts', 'ProductTypeConnection.edges', 'ProductTypeEdge.node', 'ProductType.name',
+        })
+
+    @override_settings(GRAPHQL_INSTRUMENTATION={'METRICS_MAX_OPERATION_NAMES': 2})
+    def test_operation_names_beyond_the_limit_are_other(self):
+        for name in ('One', 'Two', 'Three', 'Four', 'One'):
+            self.post(f'query {name} {{ totalCustomers }}')
+        self.post('{ totalCustomers }')
+        self.assertEqual(
+            self.series('graphql_operation_duration_seconds', 'operation'), {'One', 'Two', 'other', 'anonymous'}
+        )
+
+    @override_settings(GRAPHQL_INSTRUMENTATION={'METRICS_OPERATION_NAMES': ['Known']})
+    def test_only_listed_operation_names_are_kept(self):
+        self.post('query Unknown { totalCustomers }')
+        self.post('query Known { totalCustomers }')
+        self.assertEqual(self.series('graphql_operation_duration_seconds', 'operation'), {'Known', 'other'})
+
+
+class DebugProfileTests(TestCase):
+    QUERY = json.dumps({'query': '{ totalCustomers }'})
+
+    def debug(self, **extra):
+        response = self.client.post(
+            '/graphql', self.QUERY, content_type='application/json', HTTP_X_GRAPHQL_DEBUG='1', **extra
+        )
+        return response.json().get('extensions', {}).get('debug')
+
+    def test_profile_is_returned_to_metrics_clients(self):
+        self.assertEqual(self.debug()['sql']['count'], 1)
+
+    @override_settings(DEBUG=False)
+    def test_profile_is_not_returned_to_other_clients(self):
+        self.assertIsNone(self.debug(REMOTE_ADDR='203.0.113.7'))
+
+    @override_settings(DEBUG=True)
+    def test_profile_is_returned_to_anyone_under_debug(self):
+        self.assertIsNotNone(self.debug(REMOTE_ADDR='203.0.113.7'))
+
+
+class QueryCostTests(TestCase):
+    """
+    Operations over the cost limits are rejected before any SQL runs, and
+    every response reports the computed cost.
+    """
+
+    def post(self, query, **variables):
+        body = json.dumps({'query': query, 'variables': variables})
+        return self.client.post('/graphql', body, content_type='application/json').json()
+
+    def assert_rejected(self, query, message, **variables):
+        with self.assertNumQueries(0):
+            result = self.post(query, **variables)
+        self.assertNotIn('data', result)
+        self.assertEqual(result['errors'][0]['extensions']['code'], 'QUERY_TOO_COMPLEX')
+        self.assertIn(message, result['errors'][0]['message'])
+        return result
+
+    def test_cost_is_reported(self):
+        result = self.post('{ allProducts(first: 5) { edges { node { name } } } }')
+        self.assertEqual(result['data'], {'allProducts': {'edges': []}})
+        self.assertEqual(result['extensions']['cost'], {'requested': 6, 'maximum': 5000, 'depth': 2, 'maxDepth': 7})
+
+    @override_settings(GRAPHQL_COST={'MAX_DEPTH': 3})
+    def test_deep_queries_are_rejected(self):
+        query = '{ allOrders(first: 1) { edges { node { customer { orders { edges { node { id } } } } } } } }'
+        result = self.assert_rejected(query, 'Query depth 4 exceeds the maximum of 3.')
+        self.assertEqual(result['extensions']['cost']['depth'], 4)
+
+    def test_expensive_queries_are_rejected(self):
+        query = """
+            query ($first: Int) { allCustomers(first: $first) { edges { node {
+                orders(first: $first) { edges { node { products(first: $first) { edges { node { name } } } } } }
+            } } } }
+        """
+        result = self.assert_rejected(query, 'exceeds the maximum of 5000.', first=100)
+        self.assertGreater(result['extensions']['cost']['requested'], 5000)
+
+    def test_oversized_pages_are_rejected(self):
+        self.assert_rejected(
+            '{ allProducts(first: 101) { edges { node { name } } } }',
+            'Requested page size 101 on `allProducts` exceeds the maximum of 100.',
+        )
+        self.assert_rejected(
+            'query ($last: Int) { allProducts(last: $last) { edges { node { name } } } }',
+            'Requested page size 500',
+            last=500,
+        )
+
+
+class ExportViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        ann = Customer.objects.create(name='Ann', email='ann@example.com')
+        bob = Customer.objects.create(name='Bob', email='bob@example.com')
+        pen = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=10)
+        pencil = Product.objects.create(name='Pencil', price=Decimal('0.50'), stock=10)
+        cls.first = Order.objects.create(customer=ann, total_amount=Decimal('2.00'))
+        cls.second = Order.objects.create(customer=bob, total_amount=Decimal('1.50'))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cls.first, product=pen, unit_price=pen.price),
+            OrderItem(order=cls.first, product=pencil, unit_price=pencil.price),
+            OrderItem(order=cls.second, product=pen, unit_price=pen.price),
+        ])
+
+    def export(self, path, **extra):
+        response = self.client.get(f'/export/{path}', **extra)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def ndjson(self, path):
+        _, content = self.export(path)
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    def test_csv(self):
+        response, content = self.export('customers?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="customers.csv"')
+        rows = list(csv.reader(StringIO(content.decode())))
+        self.assertEqual(rows[0], ['id', 'name', 'email', 'phone', 'created_at'])
+        self.assertEqual([row[1] for row in rows[1:]], ['Ann', 'Bob'])
+
+    def test_ndjson(self):
+        rows = self.ndjson('orders?chunk_size=1')
+        self.assertEqual([row['id'] for row in rows], [self.first.pk, self.second.pk])
+        self.assertEqual(rows[0]['products'], ['Pen', 'Pencil'])
+        self.assertEqual((rows[0]['customer_name'], rows[0]['total_amount']), ('Ann', '2.00'))
+
+    def test_filters_accept_graphql_and_filter_set_names(self):
+        for path in ('orders?customerName=ann', 'orders?customer_name=ann', 'orders?totalAmountGte=2'):
+            self.assertEqual([row['id'] for row in self.ndjson(path)], [self.first.pk], path)
+
+    def test_product_filters_do_not_repeat_orders(self):
+        # "pen" matches both products of the first order.
+        self.assertEqual([row['id'] for row in self.ndjson('orders?productName=pen')], [self.first.pk, self.second.pk])
+
+    def test_gzip_uses_content_encoding_when_accepted(self):
+        response, content = self.export('customers?format=csv&gzip=1', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="customers.csv"')
+        self.assertTrue(gzip.decompress(content).startswith(b'id,name,email'))
+
+    def test_gzip_is_an_attachment_otherwise(self):
+        response, content = self.export('customers?gzip=1')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="customers.ndjson.gz"')
+        self.assertEqual(len(gzip.decompress(content).splitlines()), 2)
+
+    def test_bad_parameters_are_rejected(self):
+        for query, field in (
+            ('chunk_size=many', 'chunk_size'),
+            ('chunkSize=0', 'chunk_size'),
+            ('format=xml', 'format'),
+            ('totalAmountGte=lots', 'total_amount_gte'),
+        ):
+            response = self.client.get(f'/export/orders?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn(field, response.json()['errors'])
+        self.assertEqual(self.client.get('/export/products').status_code, 404)
+
+
+class WebsocketClient:
+    """
+    Drives an ASGI websocket application through its receive and send
+    queues, like channels' ``WebsocketCommunicator``.
+    """
+
+    def __init__(self, application, path='/graphql', subprotocols=(subscriptions.PROTOCOL,)):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'subprotocols': list(subprotocols)}
+        self.task = asyncio.create_task(application(scope, self.inbox.get, self.outbox.put))
+
+    async def output(self, timeout=5):
+        return await asyncio.wait_for(self.outbox.get(), timeout)
+
+    async def connect(self):
+        await self.inbox.put({'type': 'websocket.connect'})
+        return await self.output()
+
+    async def send_json(self, message):
+        await self.inbox.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive_json(self):
+        message = await self.output()
+        if message['type'] != 'websocket.send':
+            raise AssertionError(message)
+        return json.loads(message['text'])
+
+    async def disconnect(self):
+        await self.inbox.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+class SubscriptionTests(TestCase):
+    ORDER_CREATED = 'subscription { orderCreated { totalAmount customer { name } } }'
+    LOW_STOCK = 'subscription { lowStockProduct(threshold: 5) { name stock } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        cls.product = Product.objects.create(name='Pen', price=Decimal('1.50'), stock=10)
+
+    async def connect(self):
+        client = WebsocketClient(subscriptions.GraphQLSubscriptionApp())
+        self.assertEqual(await client.connect(), {'type': 'websocket.accept', 'subprotocol': subscriptions.PROTOCOL})
+        await client.send_json({'type': 'connection_init'})
+        self.assertEqual(await client.receive_json(), {'type': 'connection_ack'})
+        return client
+
+    async def subscribe(self, client, operation_id, query, channel):
+        await client.send_json({'id': operation_id, 'type': 'subscribe', 'payload': {'query': query}})
+        # Events published before the resolver listens are not delivered.
+        for _ in range(500):
+            if pubsub.get_broker().has_subscribers(channel):
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f'{operation_id} is not listening on {channel}')
+
+    def commit(self, write):
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+
+    async def test_connection_init(self):
+        client = WebsocketClient(subscriptions.GraphQLSubscriptionApp())
+        await client.connect()
+        await client.send_json({'id': '1', 'type': 'subscribe', 'payload': {'query': self.ORDER_CREATED}})
+        self.assertEqual(await client.output(), {'type': 'websocket.close', 'code': 4401, 'reason': 'Unauthorized'})
+        await client.disconnect()
+
+        client = await self.connect()
+        await client.send_json({'type': 'ping'})
+        self.assertEqual(await client.receive_json(), {'type': 'pong'})
+        await client.send_json({'type': 'connection_init'})
+        self.assertEqual((await client.output())['code'], 4429)
+        await client.disconnect()
+
+    async def test_other_paths_and_protocols_are_refused(self):
+        for client in (
+            WebsocketClient(subscriptions.GraphQLSubscriptionApp(), path='/other'),
+            WebsocketClient(subscriptions.GraphQLSubscriptionApp(), subprotocols=('graphql-ws',)),
+        ):
+            self.assertEqual(await client.connect(), {'type': 'websocket.close', 'code': 4406})
+            await asyncio.wait_for(client.task, 5)
+
+    async def test_order_created_is_delivered(self):
+        client = await self.connect()
+        await self.subscribe(client, 'orders', self.ORDER_CREATED, events.ORDER_CREATED)
+        await sync_to_async(self.commit)(
+            lambda: Order.objects.create(customer=self.customer, total_amount=Decimal('3.00'))
+        )
+        self.assertEqual(await client.receive_json(), {
+            'id': 'orders',
+            'type': 'next',
+            'payload': {'data': {'orderCreated': {'totalAmount': '3.00', 'customer': {'name': 'Ann'}}}},
+        })
+        await client.send_json({'id': 'orders', 'type': 'complete'})
+        await client.disconnect()
+        self.assertFalse(pubsub.get_broker().has_subscribers(events.ORDER_CREATED))
+
+    async def test_low_stock_product_is_delivered(self):
+        client = await self.connect()
+        await self.subscribe(client, 'stock', self.LOW_STOCK, events.STOCK_CHANGED)
+
+        def set_stock(stock):
+            self.product.stock = stock
+            self.product.save()
+
+        # Above the threshold: nothing is pushed.
+        await sync_to_async(self.commit)(lambda: set_stock(8))
+        await sync_to_async(self.commit)(lambda: set_stock(2))
+        self.assertEqual(await client.receive_json(), {
+            'id': 'stock',
+            'type': 'next',
+            'payload': {'data': {'lowStockProduct': {'name': 'Pen', 'stock': 2}}},
+        })
+        await client.disconnect()
+
+    @override_settings(GRAPHQL_SUBSCRIPTIONS={'MAX_SUBSCRIPTIONS': 2})
+    async def test_subscriptions_per_connection_are_limited(self):
+        client = await self.connect()
+        for operation_id in ('1', '2'):
+            await self.subscribe(client, operation_id, self.ORDER_CREATED, events.ORDER_CREATED)
+        await client.send_json({'id': '3', 'type': 'subscribe', 'payload': {'query': self.ORDER_CREATED}})
+        message = await client.receive_json()
+        self.assertEqual((message['id'], message['type']), ('3', 'error'))
+        self.assertEqual(message['payload'][0]['message'], 'At most 2 subscriptions per connection')
+        await client.disconnect()
+
+
+class RedisBrokerTests(SimpleTestCase):
+    def test_publish_is_bounded_and_failures_are_logged(self):
+        client = mock.Mock()
+        client.publish.side_effect = RedisTimeoutError('Timeout reading from socket')
+        broker = pubsub.RedisBroker('redis://redis.invalid:6379/1', 'crm.events.', publish_timeout=0.5)
+        with mock.patch('redis.Redis.from_url', return_value=client) as from_url:
+            with self.assertLogs('crm.pubsub', 'WARNING') as logs:
+                broker.publish(events.ORDER_CREATED, {'events': []})
+        from_url.assert_called_once_with(
+            'redis://redis.invalid:6379/1', socket_timeout=0.5, socket_connect_timeout=0.5,
+        )
+        self.assertIn('Could not publish', logs.output[0])
+
+
+class PersistedQueryTests(TestCase):
+    QUERY = '{ totalCustomers }'
+
+    def setUp(self):
+        views.document_cache.clear()
+        self.addCleanup(views.document_cache.clear)
+
+    def post(self, query=None, sha256_hash=None):
+        body = {}
+        if query is not None:
+            body['query'] = query
+        if sha256_hash is not None:
+            body['extensions'] = {'persistedQuery': {'version': 1, 'sha256Hash': sha256_hash}}
+        return self.client.post('/graphql', json.dumps(body), content_type='application/json')
+
+    def test_unknown_hash_is_not_found_until_registered(self):
+        sha256_hash = document_id(self.QUERY)
+        response = self.post(sha256_hash=sha256_hash)
+        self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+        self.assertEqual(response.json()['errors'][0]['extensions']['code'], 'PERSISTED_QUERY_NOT_FOUND')
+
+        self.assertEqual(self.post(self.QUERY, sha256_hash).json()['data'], {'totalCustomers': 0})
+        self.assertEqual(self.post(sha256_hash=sha256_hash).json()['data'], {'totalCustomers': 0})
+
+    def test_wrong_hash_is_rejected(self):
+        response = self.post(self.QUERY, document_id('{ totalOrders }'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(views.document_cache.stats()['size'], 0)
+
+    def test_repeated_document_is_a_cache_hit(self):
+        for _ in range(3):
+            self.assertEqual(self.post(self.QUERY).status_code, 200)
+        stats = views.document_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 1, 1))
+
+    def test_cache_counters_are_exported(self):
+        self.post(self.QUERY)
+        self.post(self.QUERY)
+        lines = self.client.get('/metrics').content.decode().splitlines()
+        self.assertIn('graphql_document_cache_hits_total 1', lines)
+        self.assertIn('graphql_document_cache_misses_total 1', lines)
+        self.assertIn('graphql_document_cache_size 1', lines)
+
+
+@override_settings(CRM_DATABASE_ROUTING={'READ_ALIASES': ['replica']})
+class ReadReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReadReplicaRouter()
+        for patcher in (
+            mock.patch.dict(connections.settings, {'replica': connections.settings['default']}),
+            mock.patch.object(routers, 'is_healthy', return_value=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_writes_go_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(Customer), 'default')
+        with routers.routing_context(), routers.read_replica():
+            self.assertEqual(self.router.db_for_write(Customer), 'default')
+
+    def test_reads_go_to_the_replica_only_inside_read_replica(self):
+        self.assertIsNone(self.router.db_for_read(Customer))
+        with routers.routing_context():
+            self.assertIsNone(self.router.db_for_read(Customer))
+            with routers.read_replica():
+                self.assertEqual(self.router.db_for_read(Customer), 'replica')
+
+    def test_unhealthy_replicas_fall_back_to_the_primary(self):
+        with mock.patch.object(routers, 'is_healthy', return_value=False), routers.read_replica():
+            self.assertEqual(self.router.db_for_read(Customer), 'default')
+
+    def test_reads_after_a_write_stay_on_the_primary_for_the_request(self):
+        def view(request):
+            with routers.read_replica():
+                before = self.router.db_for_read(Customer)
+                self.router.db_for_write(Order)
+                after = self.router.db_for_read(Customer)
+            with routers.read_replica():
+                return before, after, self.router.db_for_read(Customer)
+
+        middleware = routers.RoutingMiddleware(view)
+        self.assertEqual(middleware(None), ('replica', 'default', 'default'))
+        # The next request starts unpinned.
+        self.assertEqual(middleware(None)[0], 'replica')
+
+    def test_only_the_primary_is_migrated(self):
+        self.assertIsNone(self.router.allow_migrate('default', 'crm', model_name='customer'))
+        self.assertIs(self.router.allow_migrate('replica', 'crm', model_name='customer'), False)
+
+
+class ResponseCacheBackendTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(response_cache, '_response_cache', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(response_cache.get_response_cache())
+
+    @override_settings(GRAPHQL_RESPONSE_CACHE={'ENABLED': True})
+    def test_shared_django_cache_when_enabled(self):
+        cache = response_cache.get_response_cache()
+        self.assertIsInstance(cache.backend, response_cache.DjangoCacheBackend)
+
+    @override_settings(GRAPHQL_RESPONSE_CACHE={'ENABLED': True, 'BACKEND': 'lru'})
+    def test_per_process_lru_is_opt_in(self):
+        cache = response_cache.get_response_cache()
+        self.assertIsInstance(cache.backend, response_cache.LRUBackend)
+
+    def record(self, cache, alias):
+        with cache.record_tags() as tags:
+            context = {'connection': SimpleNamespace(alias=alias)}
+            response_cache._recorder(lambda *args: None, 'SELECT * FROM "crm_customer"', None, False, context)
+        return tags
+
+    def test_replica_reads_are_not_cached(self):
+        cache = response_cache.ResponseCache(response_cache.LRUBackend())
+        cache.store('primary', {'totalCustomers': 1}, self.record(cache, 'default'), {})
+        cache.store('replica', {'totalCustomers': 0}, self.record(cache, 'replica'), {})
+        self.assertEqual(cache.lookup('primary'), {'totalCustomers': 1})
+        self.assertIsNone(cache.lookup('replica'))
+
+
+class SeedCrmTests(TestCase):
+    def seed(self, seed):
+        call_command('seed_crm', customers=5, products=3, orders=10, seed=seed, clear=True, stdout=StringIO())
+        return (
+            list(Customer.objects.order_by('email').values_list('email', 'created_at')),
+            list(Order.objects.order_by('order_date').values_list('order_date', 'total_amount')),
+        )
+
+    def test_same_seed_same_rows(self):
+        first = self.seed(7)
+        self.assertEqual(self.seed(7), first)
+        self.assertNotEqual(self.seed(8), first)
+
+    def test_timestamps_end_at_the_epoch_of_the_seed(self):
+        customers, orders = self.seed(7)
+        newest = max([created_at for _, created_at in customers] + [order_date for order_date, _ in orders])
+        self.assertLessEqual(newest, seed_epoch(7))
+        self.assertGreater(newest, seed_epoch(7) - timedelta(days=90))
+
+
+SEARCH_CUSTOMERS = """
+    query Search($search: String) {
+        allCustomers(first: 5, search: $search) { edges { node { name } } }
+    }
+"""
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number, name in enumerate(('Bob Annable', 'Ann Ann', 'Carol Smith', 'Ann Lee')):
+            Customer.objects.create(name=name, email=f'customer{number}@example.com')
+
+    def names(self, data):
+        return [edge['node']['name'] for edge in data['allCustomers']['edges']]
+
+    def test_full_text_index_ranks_prefix_matches(self):
+        names = self.names(execute(SEARCH_CUSTOMERS, search='ann'))
+        self.assertCountEqual(names, ['Bob Annable', 'Ann Ann', 'Ann Lee'])
+        self.assertEqual(names[0], 'Ann Ann')
+
+    def test_without_an_index_search_falls_back_to_icontains(self):
+        with mock.patch.dict(search._search_tables, {'default': set()}):
+            names = self.names(execute(SEARCH_CUSTOMERS, search='ann lee'))
+        self.assertEqual(names, ['Ann Lee'])
+
+    def test_postgresql_query_uses_the_tsvector_index(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            queryset = search.search(Customer.objects.all(), 'ann le')
+            sql = str(queryset.query)
+        self.assertIn("@@ to_tsquery('simple', ann:* & le:*)", sql)
+        self.assertIn('ts_rank(', sql)
+        self.assertEqual(queryset.query.order_by, ('-search_rank', 'pk'))
+
+    def test_keyset_connections_do_not_take_ranked_filters(self):
+        result = schema.execute('{ allCustomersKeyset(first: 5, search: "ann") { edges { node { name } } } }')
+        self.assertIn("Unknown argument 'search'", str(result.errors))
+
+    async def test_async_view_searches_without_blocking_calls(self):
+        # Also when no connection was opened yet to find the FTS tables.
+        with mock.patch.dict(search._search_tables, clear=True):
+            response = await AsyncClient().post(
+                '/graphql/async', json.dumps({'query': SEARCH_CUSTOMERS, 'variables': {'search': 'ann lee'}}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.names(response.json()['data']), ['Ann Lee'])
@@ -0,0 +1,41 @@
+"""
+Start a Celery worker from a profile in ``CRM_WORKER_PROFILES``::
+
+    python -m crm.worker reports
+    python -m crm.worker notifications --loglevel=info
+
+Extra arguments are passed on to ``celery worker``.
+"""
+import sys
+
+from django.conf import settings
+
+from crm.celery import app
+
+
+def worker_argv(profile, extra=()):
+    profiles = getattr(settings, 'CRM_WORKER_PROFILES', {})
+    if profile not in profiles:
+        raise SystemExit(f"Unknown worker profile {profile!r}; choose from {', '.join(sorted(profiles))}")
+    options = profiles[profile]
+    return [
+        'worker',
+        '--queues', ','.join(options['queues']),
+        '--concurrency', str(options['concurrency']),
+        '--prefetch-multiplier', str(options['prefetch_multiplier']),
+        '--hostname', f'{profile}@%h',
+        # Hand tasks only to idle processes instead of round-robin.
+        '--optimization', 'fair',
+        *extra,
+    ]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        raise SystemExit(__doc__)
+    app.worker_main(worker_argv(argv[0], argv[1:]))
+
+
+if __name__ == '__main__':
+    main()